@@ -0,0 +1,228 @@
+from agility.maestro import Maestro
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import deque
+from threading import Thread, Event, Lock
+import asyncio
+import logging
+
+logger = logging.getLogger('universe')
+
+
+class AsyncMaestro(Maestro):
+    """
+    A Maestro whose port is owned by an asyncio event loop on a background thread.
+    A single reader task matches replies to a FIFO of outstanding requests, so many requests can be in flight at once.
+    Writes are queued on the loop and never block behind reads.
+
+    The blocking methods of Maestro keep working from any thread.
+    Use request() from coroutines on the loop or submit() to pipeline requests from other threads.
+
+    A write that fails on the loop is raised by the next call to write() or query(). A query whose reply does not
+    arrive in time fails every outstanding request and discards buffered input, so later replies line up again.
+
+    This implementation is thread-safe.
+    """
+
+    def __init__(self, port=None, baud=115200, history=1000, timeout=0.05, reply_timeout=0.5):
+        """
+        :param port: The virtual port number.
+        :param baud: Baud rate. Should use maximum.
+        :param history: The number of writes to keep byte counts for.
+        :param timeout: How long the reader blocks on the port before checking for shutdown, in seconds.
+        :param reply_timeout: How long query() waits for a reply, in seconds.
+        """
+
+        super().__init__(port, baud, history)
+        self.usb.timeout = timeout
+        self.reply_timeout = reply_timeout
+
+        # The first failed write on the loop, raised by the next write() or query().
+        self.error = None
+        self.error_lock = Lock()
+
+        # Outstanding requests as (size, future), oldest first.
+        self.pending = deque()
+        self.received = bytearray()
+
+        # The port is only read by one thread.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.closing = False
+
+        self.loop = asyncio.new_event_loop()
+
+        started = Event()
+        self.thread = Thread(target=self._run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(started.set)
+        self.loop.run_until_complete(self._read())
+        self.loop.close()
+
+    async def _read(self):
+        while not self.closing:
+            try:
+                data = await self.loop.run_in_executor(self.executor, self._read_some)
+            except Exception as e:
+                logger.error('Maestro reader failed: {}'.format(e))
+                self.fail(e)
+                return
+
+            if data:
+                self.received.extend(data)
+                self.dispatch()
+
+    def _read_some(self):
+        return self.usb.read(max(1, self.usb.in_waiting))
+
+    def dispatch(self):
+        """
+        Resolve outstanding requests whose replies have fully arrived. Must run on the loop.
+        """
+
+        while self.pending and len(self.received) >= self.pending[0][0]:
+            size, future = self.pending.popleft()
+            reply = bytes(self.received[:size])
+            del self.received[:size]
+
+            if self.recorder is not None:
+                self.recorder.reply(reply)
+
+            if not future.done():
+                future.set_result(reply)
+
+    def fail(self, e):
+        """
+        Fail every outstanding request. Must run on the loop.
+        :param e: The exception to raise in waiting callers.
+        """
+
+        while self.pending:
+            size, future = self.pending.popleft()
+
+            if not future.done():
+                future.set_exception(e)
+
+    def resync(self, e):
+        """
+        Fail every outstanding request and discard input, after which replies line up with requests again.
+        Must run on the loop.
+        :param e: The exception to raise in waiting callers.
+        """
+
+        self.fail(e)
+        self.received.clear()
+        self.usb.reset_input_buffer()
+
+    def check(self):
+        """
+        Raise the error of a failed write, if any.
+        """
+
+        with self.error_lock:
+            e, self.error = self.error, None
+
+        if e is not None:
+            raise e
+
+    async def request(self, data, size):
+        """
+        Send a request and wait for its reply. Must run on the loop.
+        :param data: The request.
+        :param size: The size of the reply in bytes.
+        :return: The reply.
+        """
+
+        future = self.loop.create_future()
+
+        # Queue and send in the same step so that replies stay in request order.
+        self.pending.append((size, future))
+
+        try:
+            self.usb.write(bytes(data))
+        except Exception:
+            # Nothing was sent, so no reply is coming.
+            self.pending.remove((size, future))
+            raise
+
+        if self.recorder is not None:
+            self.recorder.request(data)
+
+        return await future
+
+    def submit(self, data, size):
+        """
+        Send a request from any thread without waiting for the reply.
+        :param data: The request.
+        :param size: The size of the reply in bytes.
+        :return: A concurrent.futures.Future of the reply.
+        """
+
+        return asyncio.run_coroutine_threadsafe(self.request(data, size), self.loop)
+
+    def query(self, data, size):
+        """
+        Send a request and wait for its reply. Other requests may be in flight at the same time.
+        :param data: The request.
+        :param size: The size of the reply in bytes.
+        :return: The reply.
+        """
+
+        self.check()
+        future = self.submit(data, size)
+
+        try:
+            return future.result(self.reply_timeout)
+        except FutureTimeoutError:
+            e = TimeoutError('Maestro did not reply within {} s.'.format(self.reply_timeout))
+            self.loop.call_soon_threadsafe(self.resync, e)
+            raise e from None
+
+    def write(self, buffer):
+        """
+        Queue data to be sent to the Maestro. Returns immediately.
+        Raises the error of an earlier write that failed on the loop.
+        :param buffer: The data to send.
+        """
+
+        self.check()
+        self.loop.call_soon_threadsafe(self.send, bytes(buffer))
+        self.tick_bytes.append(len(buffer))
+
+    def send(self, data):
+        """
+        Send data now. Must run on the loop.
+        :param data: The data to send.
+        """
+
+        try:
+            self.usb.write(data)
+        except Exception as e:
+            logger.error('Maestro write failed: {}'.format(e))
+
+            with self.error_lock:
+                if self.error is None:
+                    self.error = e
+
+            return
+
+        if self.recorder is not None:
+            self.recorder.write(data)
+
+    def close(self):
+        """
+        Stop the event loop and close the USB port.
+        """
+
+        def stop():
+            self.closing = True
+            self.fail(ConnectionError('Maestro closed.'))
+
+        # The reader returns after its current read.
+        self.loop.call_soon_threadsafe(stop)
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+
+        super().close()
@@ -0,0 +1,302 @@
+from agility.cache import get_profile
+import numpy as np
+import argparse
+import logging
+import time
+import os
+
+logger = logging.getLogger('universe')
+
+
+class GaitAtlas:
+    """
+    Prepared gaits sampled on a grid over the (forward, rotation) command space, stored as a few dense arrays.
+    Build it offline with build() and save(), then load() it on the robot.
+
+    At runtime, the frames of any vector are blended from the surrounding grid entries with bilinear weights.
+    Only entries with the same gait pattern and step count as the nearest usable entry are blended, so that frames
+    line up one to one. Lookup costs the same for every vector, which suits continuously changing commands.
+
+    This implementation is thread-safe.
+    """
+
+    version = 1
+
+    # Gait patterns by index. An entry with no usable gait has pattern -1.
+    patterns = ('crawl', 'trot')
+
+    def __init__(self, agility, forward, rotation, frames, dt, steps, pattern, profile=None):
+        """
+        :param agility: An Agility object used to compile blended gaits.
+        :param forward: Grid values of forward speed in cm/s (n).
+        :param rotation: Grid values of rotation speed in rad/s (m).
+        :param frames: Prepared frames padded to the largest step count (n x m x max_steps x 4 x 3).
+        :param dt: Delta t of every entry (n x m).
+        :param steps: Step count of every entry (n x m).
+        :param pattern: Gait pattern index of every entry (n x m).
+        :param profile: Digest of the robot and gait constants the atlas was built for.
+        """
+
+        self.agility = agility
+        self.forward = np.asarray(forward, dtype=float)
+        self.rotation = np.asarray(rotation, dtype=float)
+        self.frames = frames
+        self.dt = np.asarray(dt, dtype=float)
+        self.steps = np.asarray(steps, dtype=int)
+        self.pattern = np.asarray(pattern, dtype=int)
+        self.profile = profile
+
+        shape = (len(self.forward), len(self.rotation))
+        assert self.frames.shape[:2] == shape
+        assert self.dt.shape == self.steps.shape == self.pattern.shape == shape
+
+        # The last lookup. Callers tend to ask for the same vector every frame.
+        self.last = (None, None)
+
+    @classmethod
+    def build(cls, agility, dynamic, forward=(-15, 15, 31), rotation=(-2, 2, 41), dtype=np.float32):
+        """
+        Prepare and validate a gait at every grid point.
+        :param agility: An Agility object used to prepare gaits.
+        :param dynamic: A Dynamic object used to generate gaits.
+        :param forward: (start, stop, count) of forward speed in cm/s.
+        :param rotation: (start, stop, count) of rotation speed in rad/s.
+        :param dtype: The data type of stored frames.
+        :return: A GaitAtlas.
+        """
+
+        forward = np.linspace(*forward)
+        rotation = np.linspace(*rotation)
+        shape = (len(forward), len(rotation))
+
+        frames = np.zeros((*shape, dynamic.max_steps, 4, 3), dtype=dtype)
+        dt = np.zeros(shape)
+        steps = np.zeros(shape, dtype=int)
+        pattern = np.full(shape, -1, dtype=int)
+
+        for i, f in enumerate(forward):
+            for j, r in enumerate(rotation):
+                entry = cls.prepare(agility, dynamic, f, r)
+
+                if entry is None:
+                    continue
+
+                prepared, dt[i, j], pattern[i, j] = entry
+                steps[i, j] = len(prepared)
+                frames[i, j, :len(prepared)] = prepared
+
+            logger.info('Gait atlas row {} of {} done.'.format(i + 1, len(forward)))
+
+        invalid = np.count_nonzero(pattern < 0)
+        if invalid > 0:
+            logger.warning('Gait atlas has {} of {} unusable entries.'.format(invalid, pattern.size))
+
+        profile = get_profile(agility.robot, dynamic, cls.version)
+
+        return cls(agility, forward, rotation, frames, dt, steps, pattern, profile)
+
+    @classmethod
+    def prepare(cls, agility, dynamic, forward, rotation):
+        """
+        Prepare and validate the gait of one grid point.
+        :param agility: An Agility object.
+        :param dynamic: A Dynamic object.
+        :param forward: Forward speed in cm/s.
+        :param rotation: Rotation speed in rad/s.
+        :return: (frames, dt, pattern) or None if the gait is not usable.
+        """
+
+        if forward == 0 and rotation == 0:
+            return None
+
+        gait = dynamic.generate(forward, rotation)
+        frames, dt = agility.prepare_smoothly(gait)
+
+        # Every leg must reach every point.
+        angles, valid = agility.solve(frames)
+
+        if not valid.all():
+            return None
+
+        bank = agility.robot.bank
+        index = bank.indices(agility.robot.leg_servos)
+        deg, reachable = bank.normalize(angles.reshape(len(angles), 12), index)
+
+        if not reachable.all():
+            return None
+
+        offset, beta = dynamic.pattern(forward)
+        pattern = cls.patterns.index('trot' if offset == 'trot' else 'crawl')
+
+        return frames, dt, pattern
+
+    def save(self, file):
+        """
+        Save the atlas as a single .npz file.
+        :param file: The file name.
+        """
+
+        temp = file + '.tmp'
+
+        with open(temp, 'wb') as f:
+            np.savez(f, version=self.version, profile=str(self.profile), forward=self.forward,
+                     rotation=self.rotation, frames=self.frames, dt=self.dt, steps=self.steps, pattern=self.pattern)
+
+        os.replace(temp, file)
+
+    @classmethod
+    def load(cls, agility, dynamic, file):
+        """
+        Load an atlas saved by save().
+        :param agility: An Agility object.
+        :param dynamic: The Dynamic object that gaits would otherwise come from.
+        :param file: The file name.
+        :return: A GaitAtlas.
+        """
+
+        with np.load(file) as data:
+            if int(data['version']) != cls.version:
+                raise ValueError('Gait atlas version {} is not supported.'.format(int(data['version'])))
+
+            profile = str(data['profile'])
+
+            if profile != get_profile(agility.robot, dynamic, cls.version):
+                raise ValueError('Gait atlas was built for a different robot or gait.')
+
+            return cls(agility, data['forward'], data['rotation'], data['frames'], data['dt'],
+                       data['steps'], data['pattern'], profile)
+
+    @staticmethod
+    def bracket(grid, x):
+        """
+        Find the grid cell containing a value. Values outside of the grid are clamped.
+        :param grid: Sorted grid values.
+        :param x: The value.
+        :return: (i, w) such that x is (1 - w) * grid[i] + w * grid[i + 1].
+        """
+
+        if len(grid) == 1:
+            return 0, 0.0
+
+        x = min(max(x, grid[0]), grid[-1])
+        i = min(int(np.searchsorted(grid, x, side='right')) - 1, len(grid) - 2)
+        w = (x - grid[i]) / (grid[i + 1] - grid[i])
+
+        return i, w
+
+    def blend(self, vector):
+        """
+        Blend the frames of a vector from the surrounding grid entries.
+        :param vector: (forward, rotation).
+        :return: (frames, dt) or None if no surrounding entry is usable.
+        """
+
+        i, u = self.bracket(self.forward, vector[0])
+        j, v = self.bracket(self.rotation, vector[1])
+
+        n, m = self.pattern.shape
+        corners = []
+
+        for di, wi in ((0, 1 - u), (1, u)):
+            for dj, wj in ((0, 1 - v), (1, v)):
+                k, l = min(i + di, n - 1), min(j + dj, m - 1)
+
+                if self.pattern[k, l] >= 0:
+                    corners.append((wi * wj, k, l))
+
+        if not corners:
+            return None
+
+        # The nearest usable entry decides the pattern and step count.
+        weight, k, l = max(corners)
+        pattern = self.pattern[k, l]
+        steps = self.steps[k, l]
+
+        corners = [(w, k, l) for w, k, l in corners
+                   if self.pattern[k, l] == pattern and self.steps[k, l] == steps]
+        total = sum(w for w, k, l in corners)
+
+        if total == 0:
+            return self.frames[k, l, :steps].astype(float), self.dt[k, l]
+
+        frames = np.zeros((steps, 4, 3))
+        dt = 0
+
+        for w, k, l in corners:
+            frames += (w / total) * self.frames[k, l, :steps]
+            dt += (w / total) * self.dt[k, l]
+
+        return frames, dt
+
+    def get(self, vector):
+        """
+        Get a compiled gait for a vector.
+        :param vector: (forward, rotation).
+        :return: A CompiledGait, or None if the vector is (0, 0) or no surrounding entry is usable.
+        """
+
+        vector = tuple(vector)
+
+        if vector == (0, 0):
+            return None
+
+        last, compiled = self.last
+
+        if last == vector:
+            return compiled
+
+        blended = self.blend(vector)
+
+        if blended is None:
+            logger.warning('Gait atlas has no usable gait near {}.'.format(vector))
+            compiled = None
+        else:
+            compiled = self.agility.compile(*blended)
+
+        self.last = (vector, compiled)
+
+        return compiled
+
+    def __len__(self):
+        return int(np.count_nonzero(self.pattern >= 0))
+
+
+if __name__ == '__main__':
+    from agility.emulator import Emulator
+    from agility.maestro import Maestro
+    from agility.main import Agility
+    from agility.gait import Dynamic
+    from agility.search import get_robot
+    from shared.debug import Dummy
+
+    parser = argparse.ArgumentParser(description='Build the gait atlas of a robot.')
+    parser.add_argument('output', help='The atlas to write, such as cerebral/pack1/gaits/atlas.npz.')
+    parser.add_argument('--pack', default='pack1', help='The robot to build for.')
+    parser.add_argument('--parameters', help='A parameter table from agility.search. The worker loads the same one.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    robot = get_robot(args.pack)
+
+    # Gaits are prepared offline, so an emulated Maestro will do.
+    emulator = Emulator()
+    maestro = Maestro(port=emulator.port)
+    agility = Agility(robot, maestro=maestro, usc=Dummy())
+    dynamic = Dynamic(robot)
+
+    if args.parameters is not None:
+        dynamic.load(args.parameters)
+
+    # Cover the limits of set_vector().
+    start = time.time()
+    atlas = GaitAtlas.build(agility, dynamic, forward=(-15, 15, 31), rotation=(-2, 2, 41))
+    print('Built {} of {} entries in {:.1f} s.'.format(len(atlas), atlas.pattern.size, time.time() - start))
+
+    output = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    atlas.save(output)
+    print('Saved to {} ({} bytes).'.format(output, os.path.getsize(output)))
+
+    maestro.close()
+    emulator.close()
@@ -0,0 +1,279 @@
+from agility.main import CompiledGait
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+import hashlib
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger('universe')
+
+
+def get_profile(robot, dynamic, *extra):
+    """
+    Compute a digest of everything that affects prepared gaits.
+    :param robot: A Robot object.
+    :param dynamic: A Dynamic object.
+    :param extra: Other values to include, such as a format version.
+    :return: A hex string.
+    """
+
+    servos = [(s.channel, s.min_deg, s.max_deg, s.min_pwm, s.max_pwm, s.max_vel,
+               s.bias, s.direction, s.left_bound, s.right_bound) for s in robot.leg_servos]
+    legs = [tuple(leg.lengths) for leg in robot.legs]
+    body = robot.body
+    body = (body.length, body.width, body.cx, body.cy, body.mb, body.ml)
+    gait = (dynamic.ground, dynamic.lift, dynamic.beta_crawl, dynamic.beta_trot, dynamic.t,
+            dynamic.transition, dynamic.crawl, dynamic.max_steps, dynamic.min_steps, dynamic.j0, dynamic.j1,
+            sorted(dynamic.gait_offset.items()))
+
+    data = repr((*extra, servos, legs, body, gait))
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+class GaitCache:
+    """
+    A persistent cache of prepared gaits keyed on a quantized (forward, rotation) vector.
+    Prepared frames and servo target tables are stored as memory-mappable .npy files.
+    Entries are evicted in least recently used order once the cache exceeds its size budget.
+
+    This implementation is thread-safe.
+    """
+
+    version = 1
+
+    def __init__(self, agility, dynamic, path, resolution=(0.5, 0.05), budget=64 * 1024 * 1024):
+        """
+        :param agility: An Agility object used to prepare and compile gaits.
+        :param dynamic: A Dynamic object used to generate gaits.
+        :param path: The root directory of the cache.
+        :param resolution: Quantization step of (forward, rotation) in (cm/s, rad/s).
+        :param budget: Maximum size of the cache on disk in bytes.
+        """
+
+        self.agility = agility
+        self.dynamic = dynamic
+        self.resolution = resolution
+        self.budget = budget
+
+        # Each robot profile gets its own directory.
+        self.profile = self.get_profile(agility.robot, dynamic)
+        self.path = os.path.join(path, self.profile)
+        os.makedirs(self.path, exist_ok=True)
+
+        # Entries in LRU order, most recent last.
+        self.index = OrderedDict()
+        self.entries = {}
+        self.size = 0
+
+        # Statistics.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.lock = Lock()
+        self.load_index()
+
+    def get_profile(self, robot, dynamic):
+        """
+        Compute a digest of everything that affects prepared gaits.
+        :param robot: A Robot object.
+        :param dynamic: A Dynamic object.
+        :return: A hex string.
+        """
+
+        return get_profile(robot, dynamic, self.version, self.resolution)
+
+    def quantize(self, vector):
+        """
+        Snap a vector to the cache grid.
+        :param vector: (forward, rotation).
+        :return: (key, (forward, rotation)) where the vector is the grid point.
+        """
+
+        i = int(round(vector[0] / self.resolution[0]))
+        j = int(round(vector[1] / self.resolution[1]))
+
+        return '{}_{}'.format(i, j), (i * self.resolution[0], j * self.resolution[1])
+
+    def get(self, vector):
+        """
+        Get a compiled gait for a vector, generating and storing it if necessary.
+        :param vector: (forward, rotation).
+        :return: A CompiledGait, or None if the vector quantizes to (0, 0).
+        """
+
+        key, vector = self.quantize(vector)
+
+        if vector == (0, 0):
+            return None
+
+        with self.lock:
+            compiled = self.lookup(key)
+
+            if compiled is not None:
+                self.hits += 1
+                return compiled
+
+            self.misses += 1
+
+        # Generate outside of the lock. Gait synthesis is slow.
+        gait = self.dynamic.generate(*vector)
+        frames, dt = self.agility.prepare_smoothly(gait)
+        compiled = self.agility.compile(frames, dt)
+
+        with self.lock:
+            self.store(key, vector, compiled)
+
+        return compiled
+
+    def lookup(self, key):
+        """
+        Find an entry in memory or on disk. Must hold lock.
+        :param key: The quantized key.
+        :return: A CompiledGait or None.
+        """
+
+        if key not in self.index:
+            return None
+
+        self.index.move_to_end(key)
+        self.index[key]['used'] = time.time()
+
+        if key not in self.entries:
+            self.entries[key] = self.read(key)
+
+        return self.entries[key]
+
+    def store(self, key, vector, compiled):
+        """
+        Write an entry to disk and evict as needed. Must hold lock.
+        :param key: The quantized key.
+        :param vector: The quantized vector.
+        :param compiled: A CompiledGait.
+        """
+
+        if key in self.index:
+            return
+
+        size = 0
+
+        for name, array in (('frames', compiled.frames), ('targets', compiled.targets)):
+            file = self.get_file(key, name)
+            temp = file + '.tmp'
+
+            with open(temp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+
+            os.replace(temp, file)
+            size += os.path.getsize(file)
+
+        self.index[key] = {'vector': vector, 'dt': compiled.dt, 'size': size, 'used': time.time()}
+        self.entries[key] = compiled
+        self.size += size
+
+        self.evict()
+        self.save_index()
+
+    def read(self, key):
+        """
+        Memory-map an entry from disk. Must hold lock.
+        :param key: The quantized key.
+        :return: A CompiledGait.
+        """
+
+        frames = np.load(self.get_file(key, 'frames'), mmap_mode='r')
+        targets = np.load(self.get_file(key, 'targets'), mmap_mode='r')
+        dt = self.index[key]['dt']
+
+        return CompiledGait(self.agility.robot.leg_servos, targets, dt, frames)
+
+    def evict(self):
+        """
+        Remove least recently used entries until within budget. Must hold lock.
+        """
+
+        while self.size > self.budget and len(self.index) > 1:
+            key, entry = self.index.popitem(last=False)
+            self.entries.pop(key, None)
+            self.size -= entry['size']
+            self.evictions += 1
+
+            for name in ('frames', 'targets'):
+                try:
+                    os.remove(self.get_file(key, name))
+                except OSError:
+                    pass
+
+    def warm(self):
+        """
+        Load every entry on disk into memory, most recently used first.
+        """
+
+        with self.lock:
+            for key in reversed(self.index):
+                if key not in self.entries:
+                    try:
+                        self.entries[key] = self.read(key)
+                    except (OSError, ValueError):
+                        logger.warning('Dropping unreadable gait cache entry {}.'.format(key))
+
+            # Forget entries that failed to load.
+            for key in [key for key in self.index if key not in self.entries]:
+                self.size -= self.index.pop(key)['size']
+
+        logger.info('Gait cache warmed with {} entries.'.format(len(self.entries)))
+
+    def stats(self):
+        """
+        Get cache statistics.
+        :return: A dictionary of statistics.
+        """
+
+        with self.lock:
+            total = self.hits + self.misses
+
+            return {
+                'entries': len(self.index),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'ratio': self.hits / total if total > 0 else 0
+            }
+
+    def get_file(self, key, name):
+        return os.path.join(self.path, '{}.{}.npy'.format(key, name))
+
+    def load_index(self):
+        """
+        Load the index from disk, ordered by last use.
+        """
+
+        file = os.path.join(self.path, 'index.json')
+
+        try:
+            with open(file, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        for key, entry in sorted(index.items(), key=lambda item: item[1]['used']):
+            entry['vector'] = tuple(entry['vector'])
+            self.index[key] = entry
+            self.size += entry['size']
+
+    def save_index(self):
+        """
+        Save the index to disk. Must hold lock.
+        """
+
+        file = os.path.join(self.path, 'index.json')
+        temp = file + '.tmp'
+
+        with open(temp, 'w') as f:
+            json.dump(self.index, f)
+
+        os.replace(temp, file)
@@ -0,0 +1,350 @@
+from threading import Thread, Lock, Event
+from queue import Queue, Empty
+import numpy as np
+import logging
+import select
+import time
+import pty
+import tty
+import os
+
+logger = logging.getLogger('universe')
+
+
+class Emulator:
+    """
+    A software Mini Maestro that speaks the compact protocol over a pseudo-terminal.
+    Servo motion is simulated in 10 ms ticks with speed and acceleration limits.
+    Connect to it with Maestro(port=emulator.port).
+
+    Supported commands are 0x84, 0x87, 0x89, 0x8A, 0x90, 0x93, 0x9F, 0xA1, 0xA2, 0xA4, 0xA7, 0xA8 and 0xAE.
+    Other command bytes raise the serial protocol error bit.
+    """
+
+    # Number of data bytes following each fixed-length command.
+    lengths = {
+        0x84: 3,
+        0x87: 3,
+        0x89: 3,
+        0x8A: 4,
+        0x90: 1,
+        0x93: 0,
+        0xA1: 0,
+        0xA2: 0,
+        0xA4: 0,
+        0xA7: 1,
+        0xA8: 3,
+        0xAE: 0
+    }
+
+    # Error bits.
+    ERROR_PROTOCOL = 0x0010
+
+    def __init__(self, channels=18, latency=0.001, tick=0.01, home=6000):
+        """
+        :param channels: The number of channels.
+        :param latency: Simulated USB latency in seconds before every reply. Later commands are not held up.
+        :param tick: Simulation period in seconds. The Maestro uses 10 ms.
+        :param home: Home (and initial) position of every channel in 0.25 us.
+        """
+
+        self.count = channels
+        self.latency = latency
+        self.tick = tick
+
+        # Channel state in 0.25 us, 0.25 us / 10 ms and 0.25 us / 10 ms / 80 ms.
+        self.home = np.full(channels, home, dtype=float)
+        self.position = self.home.copy()
+        self.target = self.home.copy()
+        self.velocity = np.zeros(channels)
+        self.speed = np.zeros(channels)
+        self.acceleration = np.zeros(channels)
+
+        # Device state.
+        self.errors = 0
+        self.pwm = (0, 0)
+        self.script_running = False
+        self.subroutine = None
+        self.parameter = None
+
+        # Statistics.
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.commands = 0
+        self.replies = 0
+        self.started = time.monotonic()
+
+        # Pseudo-terminal. Raw mode so that bytes pass through untouched.
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.lock = Lock()
+        self.stop_event = Event()
+
+        # Replies as (due, data), in order.
+        self.outgoing = Queue()
+
+        self.reader = Thread(target=self._read, daemon=True)
+        self.writer = Thread(target=self._write, daemon=True)
+        self.ticker = Thread(target=self._tick, daemon=True)
+        self.reader.start()
+        self.writer.start()
+        self.ticker.start()
+
+    def close(self):
+        """
+        Stop the emulator and close the pseudo-terminal.
+        """
+
+        self.stop_event.set()
+        self.reader.join()
+        self.writer.join()
+        self.ticker.join()
+
+        os.close(self.master)
+        os.close(self.slave)
+
+    def stats(self):
+        """
+        Get bus statistics since creation or the last reset.
+        :return: A dictionary of statistics.
+        """
+
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+
+            return {
+                'elapsed': elapsed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'commands': self.commands,
+                'replies': self.replies,
+                'rate_in': self.bytes_in / elapsed,
+                'rate_out': self.bytes_out / elapsed
+            }
+
+    def utilization(self, baud=115200):
+        """
+        Compute the fraction of a serial link that the traffic so far would occupy.
+        :param baud: Baud rate of the link. Each byte takes 10 bits.
+        :return: Utilization in [0, 1+).
+        """
+
+        stats = self.stats()
+        return (stats['rate_in'] + stats['rate_out']) * 10 / baud
+
+    def reset_stats(self):
+        """
+        Reset bus statistics.
+        """
+
+        with self.lock:
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.commands = 0
+            self.replies = 0
+            self.started = time.monotonic()
+
+    ##########################################
+    # Begin implementation of the simulation.
+    ##########################################
+
+    def _tick(self):
+        deadline = time.monotonic()
+
+        while not self.stop_event.is_set():
+            deadline += self.tick
+
+            with self.lock:
+                self.step()
+
+            remaining = deadline - time.monotonic()
+
+            if remaining > 0:
+                self.stop_event.wait(remaining)
+            else:
+                # Fell behind. Do not try to catch up.
+                deadline = time.monotonic()
+
+    def step(self):
+        """
+        Advance every channel by one 10 ms tick. Must hold lock.
+        """
+
+        delta = self.target - self.position
+        distance = np.abs(delta)
+        direction = np.sign(delta)
+
+        # A speed of 0 means unlimited.
+        limit = np.where(self.speed > 0, self.speed, np.inf)
+
+        # Acceleration is per 80 ms, so each tick gets an eighth. An acceleration of 0 means unlimited.
+        accelerating = self.acceleration > 0
+        step = self.acceleration / 8
+        ramp = np.minimum(self.velocity + step, limit)
+
+        # Ramp down early enough to stop at the target.
+        stopping = np.sqrt(2 * step * distance)
+        ramp = np.minimum(ramp, np.maximum(stopping, step))
+
+        velocity = np.where(accelerating, ramp, limit)
+        velocity = np.minimum(velocity, distance)
+
+        self.position += direction * velocity
+        self.velocity = np.where(distance > 0, velocity, 0)
+
+    ###############################################
+    # Begin implementation of the serial protocol.
+    ###############################################
+
+    def _read(self):
+        buffer = bytearray()
+
+        while not self.stop_event.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+
+            if not ready:
+                continue
+
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+
+            # Replies are due some time after the request arrives.
+            due = time.monotonic() + self.latency
+
+            with self.lock:
+                self.bytes_in += len(data)
+
+            buffer.extend(data)
+
+            while buffer:
+                used, reply = self.parse(buffer)
+
+                if used == 0:
+                    # Incomplete command.
+                    break
+
+                del buffer[:used]
+
+                if reply:
+                    self.outgoing.put((due, reply))
+
+    def _write(self):
+        while not self.stop_event.is_set():
+            try:
+                due, reply = self.outgoing.get(timeout=0.05)
+            except Empty:
+                continue
+
+            remaining = due - time.monotonic()
+
+            if remaining > 0:
+                time.sleep(remaining)
+
+            try:
+                os.write(self.master, reply)
+            except OSError:
+                return
+
+            with self.lock:
+                self.bytes_out += len(reply)
+                self.replies += 1
+
+    def parse(self, buffer):
+        """
+        Execute the first command in a buffer.
+        :param buffer: Received bytes.
+        :return: (used, reply) where used is 0 if the command is incomplete.
+        """
+
+        command = buffer[0]
+
+        if command == 0x9F:
+            if len(buffer) < 3:
+                return 0, None
+            size = 3 + 2 * buffer[1]
+        elif command in self.lengths:
+            size = 1 + self.lengths[command]
+        else:
+            # Not a known command. Skip it.
+            with self.lock:
+                self.errors |= self.ERROR_PROTOCOL
+            return 1, None
+
+        if len(buffer) < size:
+            return 0, None
+
+        data = buffer[1:size]
+
+        # Data bytes must have their most significant bit cleared.
+        if any(byte & 0x80 for byte in data):
+            with self.lock:
+                self.errors |= self.ERROR_PROTOCOL
+            return 1, None
+
+        with self.lock:
+            self.commands += 1
+            reply = self.execute(command, data)
+
+        return size, reply
+
+    def execute(self, command, data):
+        """
+        Execute one complete command. Must hold lock.
+        :param command: The command byte.
+        :param data: The data bytes.
+        :return: The reply, if any.
+        """
+
+        if command in (0x84, 0x87, 0x89, 0x90) and data[0] >= self.count:
+            self.errors |= self.ERROR_PROTOCOL
+            return b'\x00\x00' if command == 0x90 else None
+
+        if command == 0x84:
+            self.target[data[0]] = self.word(data[1], data[2])
+        elif command == 0x87:
+            self.speed[data[0]] = self.word(data[1], data[2])
+        elif command == 0x89:
+            self.acceleration[data[0]] = self.word(data[1], data[2])
+        elif command == 0x8A:
+            self.pwm = (self.word(data[0], data[1]), self.word(data[2], data[3]))
+        elif command == 0x90:
+            return int(round(self.position[data[0]])).to_bytes(2, 'little')
+        elif command == 0x93:
+            return b'\x01' if np.any(np.round(self.position) != self.target) else b'\x00'
+        elif command == 0x9F:
+            count, start = data[0], data[1]
+
+            if start + count > self.count:
+                self.errors |= self.ERROR_PROTOCOL
+                return None
+
+            for i in range(count):
+                self.target[start + i] = self.word(data[2 + 2 * i], data[3 + 2 * i])
+        elif command == 0xA1:
+            errors, self.errors = self.errors, 0
+            return errors.to_bytes(2, 'little')
+        elif command == 0xA2:
+            self.target[:] = self.home
+        elif command == 0xA4:
+            self.script_running = False
+        elif command == 0xA7:
+            self.script_running = True
+            self.subroutine = data[0]
+            self.parameter = None
+        elif command == 0xA8:
+            self.script_running = True
+            self.subroutine = data[0]
+            self.parameter = self.word(data[1], data[2])
+        elif command == 0xAE:
+            # The Maestro replies 0 while the script is running.
+            return b'\x00' if self.script_running else b'\x01'
+
+        return None
+
+    @staticmethod
+    def word(lsb, msb):
+        return lsb | (msb << 7)
@@ -0,0 +1,192 @@
+import numpy as np
+import logging
+import time
+
+logger = logging.getLogger('universe')
+
+
+class GaitEngine:
+    """
+    Executes compiled gaits one frame at a time and switches between them mid-cycle.
+    A new gait takes over at the next safe phase point, where every leg is on the ground.
+    The new gait is entered at the same phase and the transition is linearly blended over a few frames.
+    Since prepared frames already include center of mass biases, the biases are blended as well.
+    """
+
+    def __init__(self, agility, blend=4, rate=5, epsilon=1e-6):
+        """
+        :param agility: An Agility object.
+        :param blend: The number of frames used to blend from one gait to the next.
+        :param rate: Position samples per second used for drift correction. 0 to never sample.
+        :param epsilon: Tolerance when deciding whether a leg is on the ground.
+        """
+
+        self.agility = agility
+        self.blend = blend
+        self.rate = rate
+        self.epsilon = epsilon
+
+        # The gait being executed and the next frame to execute.
+        self.current = None
+        self.states = None
+        self.index = 0
+
+        # Blended frames left to execute, as (frame, dt, grounded).
+        self.transition = []
+
+        # Whether every leg was on the ground in the last executed frame.
+        self.grounded = True
+
+        # Scheduling.
+        self.deadline = 0
+        self.sample = 0
+
+    def get_states(self, compiled):
+        """
+        Determine which legs are in the air in every frame of a compiled gait.
+        :param compiled: A CompiledGait with frames.
+        :return: A boolean array (steps x 4).
+        """
+
+        z = compiled.frames[:, :, 2]
+        return z > z.min() + self.epsilon
+
+    def get_phase(self):
+        """
+        Get the phase of the last executed frame.
+        :return: Phase in [0, 1) or None if not walking.
+        """
+
+        if self.current is None:
+            return None
+
+        steps = len(self.current)
+        return ((self.index - 1) % steps) / steps
+
+    def is_safe(self):
+        """
+        Checks if the current gait may be left now.
+        :return: True if every leg is on the ground or a cycle just ended.
+        """
+
+        return not self.transition and (self.grounded or self.index == 0)
+
+    def start(self, compiled):
+        """
+        Start a gait from the beginning.
+        :param compiled: A CompiledGait with frames.
+        """
+
+        self.current = compiled
+        self.states = self.get_states(compiled)
+        self.index = 0
+        self.transition = []
+
+        now = time.monotonic()
+        self.deadline = now
+        self.sample = now
+
+    def switch(self, compiled):
+        """
+        Blend from the current gait into a new gait at the same phase.
+        :param compiled: A CompiledGait with frames.
+        """
+
+        old, new = self.current, compiled
+        old_steps, new_steps = len(old), len(new)
+        states = self.get_states(new)
+
+        # Find the frame in the new gait with the same phase, then the first one with every leg on the ground.
+        phase = self.get_phase()
+        j = int(round(phase * new_steps)) % new_steps
+
+        for k in range(new_steps):
+            if not states[(j + k) % new_steps].any():
+                j = (j + k) % new_steps
+                break
+
+        # Blend positions (and thus biases) and timing.
+        transition = []
+
+        for k in range(1, self.blend + 1):
+            w = k / self.blend
+            a = old.frames[(self.index + k - 1) % old_steps]
+            b = new.frames[(j + k) % new_steps]
+
+            frame = (1 - w) * a + w * b
+            dt = (1 - w) * old.dt + w * new.dt
+            grounded = not (self.states[(self.index + k - 1) % old_steps].any() or states[(j + k) % new_steps].any())
+
+            transition.append((frame, dt, grounded))
+
+        logger.debug('Switching gait at phase {:.2f} over {} frames.'.format(phase, self.blend))
+
+        self.current = new
+        self.states = states
+        self.index = (j + self.blend + 1) % new_steps
+        self.transition = transition
+
+    def step(self, target):
+        """
+        Execute one frame, switching to a target gait at the next safe phase point.
+        :param target: The desired CompiledGait, or None to come to a stop.
+        :return: True if a frame was executed, False if standing still.
+        """
+
+        agility = self.agility
+        servos = agility.robot.leg_servos
+
+        if self.current is None:
+            if target is None:
+                return False
+
+            self.start(target)
+
+        elif target is not self.current and self.is_safe():
+            if target is None:
+                # Stop here with every leg on the ground.
+                if agility.sleep_until(self.deadline):
+                    agility.wait(servos)
+
+                self.current = None
+                return False
+
+            self.switch(target)
+
+        # Wait until the previous frame should be done.
+        if not agility.sleep_until(self.deadline):
+            self.current = None
+            return False
+
+        # Sample positions and wait out any lag.
+        now = time.monotonic()
+
+        if self.rate > 0 and now >= self.sample:
+            agility.update(servos)
+            self.deadline = now + agility.lag(servos) / 1000
+            self.sample = self.deadline + 1 / self.rate
+
+            if not agility.sleep_until(self.deadline):
+                self.current = None
+                return False
+
+        if self.transition:
+            frame, dt, self.grounded = self.transition.pop(0)
+            t = agility.step_frame(frame, dt)
+        else:
+            compiled = self.current
+            i = self.index
+            bank = agility.robot.bank
+
+            # Compiled speeds are only correct coming from the previous frame.
+            if np.array_equal(bank.target[bank.indices(servos)], compiled.targets[i - 1]):
+                t = agility.step_compiled(compiled, i)
+            else:
+                t = agility.step_frame(compiled.frames[i], compiled.dt)
+
+            self.grounded = not self.states[i].any()
+            self.index = (i + 1) % len(compiled)
+
+        self.deadline = max(self.deadline, time.monotonic()) + t / 1000
+
+        return True
@@ -1,6 +1,5 @@
-from scipy import interpolate
 import numpy as np
-from functools import partial
+import json
 import math
 
 
@@ -35,6 +34,16 @@ class Gait:
 
         raise NotImplementedError
 
+    def evaluate_all(self, legs, t):
+        """
+        Evaluate the positions of several legs at times t.
+        :param legs: A list of leg objects.
+        :param t: An array containing t values to be evaluated where t is in [0, 1000).
+        :return: An array of points (times x legs x 3).
+        """
+
+        return np.stack([self.evaluate(leg, t) for leg in legs], axis=1)
+
 
 class Linear(Gait):
     def __init__(self, sequence, ground, time, steps):
@@ -53,16 +62,27 @@ class Linear(Gait):
 
         super().__init__(ground, time, steps)
 
-        # Generate private functions called during evaluation.
-        self._fn = [self.interpolate(s) for s in sequence]
-        assert len(self._fn) == 4
+        # Breakpoints of every leg, padded to the same length with infinite times.
+        breakpoints = [self.interpolate(s) for s in sequence]
+        assert len(breakpoints) == 4
+
+        size = max(len(t) for t, p in breakpoints)
+
+        self.times = np.full((4, size), np.inf)
+        self.points = np.zeros((4, size, 3))
+        self.counts = np.array([len(t) for t, p in breakpoints])
+
+        for i, (t, p) in enumerate(breakpoints):
+            self.times[i, :len(t)] = t
+            self.points[i, :len(t)] = p
+            self.points[i, len(t):] = p[-1]
 
     @staticmethod
     def interpolate(sequence):
         """
-        Create parametric functions given a sequence of points.
+        Get sorted breakpoints that cover [0, 1000] given a sequence of points.
         :param sequence: A numpy sequence of points.
-        :return: A function to interpolate points at times t.
+        :return: (times, points).
         """
 
         # Boundary constraints.
@@ -94,19 +114,51 @@ class Linear(Gait):
         # Unique time assertion.
         assert np.array_equiv(np.unique(t), t)
 
-        # Interpolate.
-        tck, _ = interpolate.splprep(p.T, u=t, s=0, k=1)
-        return partial(interpolate.splev, tck=tck)
+        return t, p
 
     def evaluate(self, leg, t):
-        index = leg.index
-        fn = self._fn[index]
-        p = np.array(fn(t))
+        return self.evaluate_legs([leg.index], t)[:, 0]
+
+    def evaluate_all(self, legs, t):
+        return self.evaluate_legs([leg.index for leg in legs], t)
+
+    def evaluate_legs(self, indices, t):
+        """
+        Evaluate legs by piecewise linear interpolation between breakpoints, all at once.
+        Times wrap around, so t + 1000 is the same as t.
+        :param indices: Leg indices.
+        :param t: An array of times.
+        :return: An array of points (times x legs x 3).
+        """
 
-        return p.T
+        t = np.mod(np.atleast_1d(np.asarray(t, dtype=float)), 1000)
+        times = self.times[indices]
+        points = self.points[indices]
+
+        # Interval of every time for every leg, such that times[l] <= t < times[l + 1].
+        l = np.empty((len(indices), len(t)), dtype=int)
+
+        for k, i in enumerate(indices):
+            l[k] = np.searchsorted(self.times[i, 1:self.counts[i] - 1], t, side='right')
+
+        t0 = np.take_along_axis(times, l, axis=1)
+        t1 = np.take_along_axis(times, l + 1, axis=1)
+        p0 = np.take_along_axis(points, l[..., np.newaxis], axis=1)
+        p1 = np.take_along_axis(points, l[..., np.newaxis] + 1, axis=1)
+
+        # Same arithmetic as a degree 1 B-spline.
+        f = 1 / (t1 - t0)
+        h0 = (f * (t1 - t))[..., np.newaxis]
+        h1 = (f * (t - t0))[..., np.newaxis]
+        p = p0 * h0 + p1 * h1
+
+        return p.transpose(1, 0, 2)
 
 
 class Dynamic:
+    # Constants that may be tuned, such as by agility.search.
+    parameters = ('beta_crawl', 'beta_trot', 'lift', 'transition', 'crawl', 'min_steps', 'max_steps')
+
     def __init__(self, robot):
         body = robot.body
         ground = -max([leg.length for leg in robot.legs]) + 1
@@ -130,6 +182,7 @@ class Dynamic:
         self.beta_trot = 0.800      # Beta value for trot gait.
         self.t = 2                  # Maximum cycle time.
         self.transition = 5         # Velocity at which to transition from crawl to trot.
+        self.crawl = '1423'         # Leg order of the crawl gait.
 
         self.max_steps = 100        # Maximum number of dt steps.
         self.min_steps = 20         # Minimum number of dt steps.
@@ -161,14 +214,7 @@ class Dynamic:
         assert not (forward == 0 and rotation == 0)
 
         # Check which type of gait to use.
-        if abs(forward) >= self.transition:
-            # Use trot.
-            offset = 'trot'
-            beta = self.beta_trot
-        else:
-            # Use crawl.
-            offset = '1423'
-            beta = self.beta_crawl
+        offset, beta = self.pattern(forward)
 
         # Create t decision array.
         t = [0, 0]
@@ -211,6 +257,55 @@ class Dynamic:
 
         return gait
 
+    def pattern(self, forward):
+        """
+        Get the gait pattern used for a forward speed.
+        :param forward: Forward speed in cm/second.
+        :return: (offset, beta).
+        """
+
+        if abs(forward) >= self.transition:
+            # Use trot.
+            return 'trot', self.beta_trot
+        else:
+            # Use crawl.
+            return self.crawl, self.beta_crawl
+
+    def get_parameters(self):
+        """
+        Get the tunable constants.
+        :return: A dictionary of parameter name to value.
+        """
+
+        return {name: getattr(self, name) for name in self.parameters}
+
+    def set_parameters(self, parameters):
+        """
+        Set tunable constants.
+        :param parameters: A dictionary of parameter name to value.
+        """
+
+        for name in parameters:
+            if name not in self.parameters:
+                raise KeyError('Unknown gait parameter {}.'.format(name))
+
+        if parameters.get('crawl', self.crawl) not in self.gait_offset:
+            raise ValueError('Unknown crawl order {}.'.format(parameters['crawl']))
+
+        for name, value in parameters.items():
+            setattr(self, name, value)
+
+    def load(self, file):
+        """
+        Load tunable constants from a parameter table, such as one written by agility.search.
+        :param file: The file name.
+        """
+
+        with open(file, 'r') as f:
+            table = json.load(f)
+
+        self.set_parameters(table['parameters'])
+
     def get(self, theta, v, beta, ground, lift, offset):
         """
         Get a sequence. If none exists in cache, generate it.
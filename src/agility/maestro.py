@@ -5,8 +5,13 @@ import time
 import serial
 from serial import SerialTimeoutException
 import struct
-from threading import Lock
+from threading import Lock, local
 from serial.tools import list_ports
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from agility import trajectory
+import numpy as np
 
 logger = logging.getLogger('universe')
 
@@ -21,10 +26,72 @@ class Maestro:
     Having a servo in multiple threads will cause errors.
     """
 
-    def __init__(self, port=None, baud=115200):
+    def __init__(self, port=None, baud=115200, history=1000):
         """
         :param port: The virtual port number.
         :param baud: Baud rate. Should use maximum.
+        :param history: The number of writes to keep byte counts for.
+        """
+
+        self.port = None
+        self.usb = self.connect(port, baud)
+
+        # Struct objects are faster.
+        self.struct = struct.Struct('<H')
+
+        # Locks.
+        self.read_lock = Lock()
+
+        # Coalesced commands are kept per thread.
+        self.local = local()
+
+        # Bytes sent by every write, most recent last.
+        self.tick_bytes = deque(maxlen=history)
+
+        # An optional Recorder of all traffic.
+        self.recorder = None
+
+        # Stepper moves run one at a time in the background.
+        self.stepper_executor = ThreadPoolExecutor(max_workers=1)
+
+    def write(self, buffer):
+        """
+        Send data to the Maestro. Every write is counted as one tick.
+        :param buffer: The data to send.
+        """
+
+        self.usb.write(buffer)
+        self.tick_bytes.append(len(buffer))
+
+        if self.recorder is not None:
+            self.recorder.write(buffer)
+
+    def query(self, data, size):
+        """
+        Send a request and wait for its reply.
+        :param data: The request.
+        :param size: The size of the reply in bytes.
+        :return: The reply.
+        """
+
+        with self.read_lock:
+            self.usb.write(data)
+
+            if self.recorder is None:
+                return self.usb.read(size=size)
+
+            self.recorder.request(data)
+            reply = self.usb.read(size=size)
+            self.recorder.reply(reply)
+
+        return reply
+
+    def connect(self, port, baud):
+        """
+        Open the command port.
+        :param port: The virtual port number. Automatically detected if None.
+        :param baud: Baud rate.
+        :return: The serial port.
         """
 
         if port is not None:
@@ -55,30 +122,19 @@ class Maestro:
 
         # Start a connection using pyserial.
         try:
-            self.usb = serial.Serial(self.port, baudrate=baud, write_timeout=0)
-            logger.debug('Using command port "{}".'.format(self.usb.port))
+            usb = serial.Serial(self.port, baudrate=baud, write_timeout=0)
+            logger.debug('Using command port "{}".'.format(usb.port))
         except:
             raise ConnectionError('Unable to connect to servo controller at {}.'.format(self.port))
 
-        # Struct objects are faster.
-        self.struct = struct.Struct('<H')
-
-        # Locks.
-        self.read_lock = Lock()
-
-    def write(self, buffer):
-        """
-        Send data to the Maestro.
-        :param buffer: The data to send.
-        """
-
-        self.usb.write(buffer)
+        return usb
 
     def close(self):
         """
         Close the USB port.
         """
 
+        self.stepper_executor.shutdown(wait=True)
         self.usb.close()
 
     ##########################################
@@ -94,6 +150,113 @@ class Maestro:
         """
         return value & 0x7F, (value >> 7) & 0x7F
 
+    @staticmethod
+    def encode(command, channels, values):
+        """
+        Encode one 4-byte compact command per channel at once.
+        :param command: The command byte (0x84, 0x87 or 0x89).
+        :param channels: An array of channels (S).
+        :param values: An array of values (S) or (N x S).
+        :return: A uint8 array of shape (S x 4) or (N x S x 4).
+        """
+
+        values = np.asarray(values, dtype=int)
+        data = np.empty(values.shape + (4,), dtype=np.uint8)
+
+        data[..., 0] = command
+        data[..., 1] = channels
+        data[..., 2] = values & 0x7F
+        data[..., 3] = (values >> 7) & 0x7F
+
+        return data
+
+    @staticmethod
+    def encode_frames(channels, speeds, targets):
+        """
+        Pre-encode the speed and target commands of many frames into one contiguous buffer.
+        Each frame is equivalent to the speed and target commands of end_together().
+        :param channels: An array of channels (S).
+        :param speeds: Speeds for every frame in 0.25 us / 10 ms (N x S).
+        :param targets: Targets for every frame in 0.25 us (N x S).
+        :return: (buffer, offsets) where frame i is buffer[offsets[i]:offsets[i + 1]].
+        """
+
+        speeds = Maestro.encode(0x87, channels, speeds)
+        speeds = speeds.reshape(speeds.shape[:-2] + (-1,))
+        targets = Maestro.encode_targets(channels, targets)
+
+        data = np.concatenate((speeds, targets), axis=1)
+        size = data[0].nbytes if len(data) > 0 else 0
+        offsets = np.arange(len(data) + 1) * size
+
+        return data.tobytes(), offsets
+
+    @staticmethod
+    def get_bank(servos):
+        """
+        Find the ServoBank that holds some servos.
+        :param servos: Servo objects.
+        :return: (bank, index), or (None, None) if the servos are not all in one bank.
+        """
+
+        bank = getattr(servos[0], 'bank', None) if len(servos) > 0 else None
+
+        if bank is None:
+            return None, None
+
+        index = bank.indices(servos)
+
+        if index is None:
+            return None, None
+
+        return bank, index
+
+    @staticmethod
+    def get_runs(channels):
+        """
+        Split channels into runs of consecutive channels.
+        :param channels: An array of channels.
+        :return: A list of (start, stop) index pairs.
+        """
+
+        breaks = np.where(np.diff(channels) != 1)[0] + 1
+        edges = [0] + breaks.tolist() + [len(channels)]
+
+        return list(zip(edges[:-1], edges[1:]))
+
+    @staticmethod
+    def encode_targets(channels, targets):
+        """
+        Encode targets in as few bytes as possible.
+        Runs of consecutive channels use one set multiple targets command (3 + 2 * n bytes).
+        Lone channels use a set target command (4 bytes).
+        :param channels: An array of channels (S).
+        :param targets: An array of targets (S) or (N x S).
+        :return: A uint8 array of shape (B) or (N x B).
+        """
+
+        channels = np.asarray(channels, dtype=int)
+        targets = np.asarray(targets, dtype=int)
+        shape = targets.shape[:-1]
+        parts = []
+
+        for start, stop in Maestro.get_runs(channels):
+            count = stop - start
+            values = targets[..., start:stop]
+
+            if count == 1:
+                parts.append(Maestro.encode(0x84, channels[start:stop], values).reshape(shape + (4,)))
+            else:
+                header = np.array((0x9F, count, channels[start]), dtype=np.uint8)
+                data = np.empty(values.shape + (2,), dtype=np.uint8)
+                data[..., 0] = values & 0x7F
+                data[..., 1] = (values >> 7) & 0x7F
+
+                parts.append(np.broadcast_to(header, shape + (3,)))
+                parts.append(data.reshape(shape + (2 * count,)))
+
+        return np.concatenate(parts, axis=-1)
+
     ############################################
     # Begin implementation of digital protocol.
     ############################################
@@ -107,31 +270,90 @@ class Maestro:
         :param t: The total time.
         """
 
-        steps = stepper.deg_to_steps(degrees)
+        self.rotate_async(stepper, degrees, t).result()
+
+    def rotate_async(self, stepper, degrees, t):
+        """
+        Like rotate(), but returns immediately. Moves are queued and run one at a time.
+        If the stepper's pulse script is uploaded (see Stepper.script()), the Maestro times the pulses.
+        Otherwise a background thread does.
+        The script rounds the half period of a pulse to whole ms, so a half period of 1.4 ms would run at 1 ms and finish
+        29% early. The script is only used when rounding changes the duration by at most Stepper.max_timing_error.
+        :param stepper: Stepper object.
+        :param degrees: The number of degrees to turn.
+        :param t: The total time.
+        :return: A concurrent.futures.Future of the stepper's step when done.
+        """
+
+        return self.stepper_executor.submit(self.pulse, stepper, stepper.deg_to_steps(degrees), t)
+
+    def pulse(self, stepper, steps, t):
+        """
+        Send pulses to a stepper and track its step. Blocking until completion.
+        :param stepper: Stepper object.
+        :param steps: The number of steps. Negative steps turn the other way.
+        :param t: The total time.
+        :return: The stepper's step.
+        """
 
         if steps == 0:
-            return
+            return stepper.step
 
         if steps > 0:
             direction = 1
-            self.usb.write((0x84, stepper.c1, 64, 62))
+            self.write((0x84, stepper.c1, 64, 62))
         else:
             direction = -1
-            self.usb.write((0x84, stepper.c1, 104, 7))
+            self.write((0x84, stepper.c1, 104, 7))
 
         steps = abs(steps)
 
-        x = t / (2 * steps) / 1000
-        low_pulse = (0x84, stepper.c2, 104, 7)
-        high_pulse = (0x84, stepper.c2, 64, 62)
+        # Half period in ms.
+        x = t / (2 * steps)
+
+        half = int(round(x))
+
+        if stepper.subroutine is not None and 1 <= half <= stepper.max_half_period and \
+                abs(half - x) <= stepper.max_timing_error * x:
+
+            # Batches are limited by the parameter size.
+            for start in range(0, steps, stepper.max_batch):
+                count = min(stepper.max_batch, steps - start)
+
+                self.restart(stepper.subroutine, (half << 8) | count)
+                self.wait_for_script(2 * half * count / 1000)
 
-        for i in range(steps):
-            self.usb.write(high_pulse)
-            time.sleep(x)
-            self.usb.write(low_pulse)
-            time.sleep(x)
+                for i in range(count):
+                    stepper.step_one(direction)
+        else:
+            low_pulse = (0x84, stepper.c2, 104, 7)
+            high_pulse = (0x84, stepper.c2, 64, 62)
+
+            for i in range(steps):
+                self.write(high_pulse)
+                time.sleep(x / 1000)
+                self.write(low_pulse)
+                time.sleep(x / 1000)
+
+                stepper.step_one(direction)
+
+        return stepper.step
+
+    def wait_for_script(self, t, timeout=1):
+        """
+        Block until the running script stops.
+        :param t: The expected run time in seconds. No status is requested before then.
+        :param timeout: Extra time allowed in seconds before giving up.
+        """
 
-            stepper.step_one(direction)
+        end = time.monotonic() + t + timeout
+        time.sleep(t)
+
+        while self.get_script_status():
+            if time.monotonic() > end:
+                raise TimeoutError('Script did not stop in time.')
+
+            time.sleep(0.001)
 
     ##########################################################
     # Begin implementation of buffer-capable compact protocol.
@@ -151,8 +373,8 @@ class Maestro:
         # Compose and send or return.
         ins = (0x84, servo.channel, lsb, msb)
 
-        if send:
-            self.usb.write(ins)
+        if send and not self.queue(0x84, servo.channel, servo.target):
+            self.write(ins)
 
         return ins
 
@@ -174,8 +396,8 @@ class Maestro:
         # Compose and send or return.
         ins = (0x87, servo.channel, lsb, msb)
 
-        if send:
-            self.usb.write(ins)
+        if send and not self.queue(0x87, servo.channel, speed):
+            self.write(ins)
 
         return ins
 
@@ -197,8 +419,8 @@ class Maestro:
         # Compose and add to buffer.
         ins = (0x89, servo.channel, lsb, msb)
 
-        if send:
-            self.usb.write(ins)
+        if send and not self.queue(0x89, servo.channel, accel):
+            self.write(ins)
 
         return ins
 
@@ -219,19 +441,25 @@ class Maestro:
         for servo in servos:
             data.extend((0x90, servo.channel))
 
-        with self.read_lock:
-            self.usb.write(data)
-            reply = self.usb.read(size=size)
+        reply = self.query(data, size)
+
+        bank, index = self.get_bank(servos)
+
+        if bank is not None:
+            bank.pwm[index] = np.frombuffer(reply, dtype='<u2', count=count)
+            return
 
         for i in range(count):
             data = reply[2 * i: 2 * i + 2]
             servos[i].pwm = self.struct.unpack(data)[0]
 
-    def set_multiple_targets(self, servos):
+    def set_multiple_targets(self, servos, send=True):
         """
         Set multiple targets with one command. Faster than multiple set_target().
         Only use for contiguous blocks!
         :param servos: Servo objects.
+        :param send: Whether or not to send instruction immediately.
+        :return: The instruction bytes.
         """
 
         # Count the number of targets. Required by controller.
@@ -246,24 +474,122 @@ class Maestro:
         # Data header.
         data = bytearray((0x9F, count, start))
 
-        # Iterate through all servos, appending to data as needed.
+        # Iterate through all servos, appending to data as needed. Targets are already in 0.25 us.
         for servo in servos:
-            target = servo.deg_to_maestro(servo.target)
-
             # Check contiguity.
             if servo.channel != start:
                 raise Exception('Channels not contiguous!')
             else:
                 start += 1
 
-            lsb, msb = self.endianize(target)
+            lsb, msb = self.endianize(servo.target)
             data.extend((lsb, msb))
 
-            # Update object.
-            servo.pwm = target
-
         # Write.
-        self.usb.write(data)
+        if send:
+            self.write(data)
+
+        return data
+
+    ##########################################
+    # Begin implementation of write coalescing.
+    ##########################################
+
+    @contextmanager
+    def tick(self):
+        """
+        Coalesce all set_target(), set_speed() and set_acceleration() calls of this thread into a single write.
+        A later update of the same channel replaces an earlier one.
+        Targets of consecutive channels are sent with one set multiple targets command.
+        Ticks may be nested. Only the outermost one writes.
+        """
+
+        if getattr(self.local, 'pending', None) is not None:
+            yield
+            return
+
+        # Accelerations, speeds and targets, in the order they are sent.
+        pending = {0x89: {}, 0x87: {}, 0x84: {}}
+        self.local.pending = pending
+
+        try:
+            yield
+        finally:
+            self.local.pending = None
+
+        self.flush(pending)
+
+    def queue(self, command, channel, value):
+        """
+        Add a command to the open tick of this thread.
+        :param command: The command byte (0x84, 0x87 or 0x89).
+        :param channel: The channel.
+        :param value: The value.
+        :return: True if queued, False if no tick is open.
+        """
+
+        pending = getattr(self.local, 'pending', None)
+
+        if pending is None:
+            return False
+
+        pending[command][channel] = value
+        return True
+
+    def queue_many(self, command, channels, values):
+        """
+        Add one command per channel to the open tick of this thread.
+        :param command: The command byte (0x84, 0x87 or 0x89).
+        :param channels: An array of channels.
+        :param values: An array of values.
+        :return: True if queued, False if no tick is open.
+        """
+
+        pending = getattr(self.local, 'pending', None)
+
+        if pending is None:
+            return False
+
+        pending[command].update(zip(np.asarray(channels).tolist(), np.asarray(values).tolist()))
+        return True
+
+    def flush(self, pending):
+        """
+        Send coalesced commands in one write.
+        :param pending: Values by channel for each command.
+        """
+
+        buffer = bytearray()
+
+        for command in (0x89, 0x87):
+            if pending[command]:
+                channels = list(pending[command].keys())
+                values = list(pending[command].values())
+                buffer.extend(self.encode(command, channels, values).tobytes())
+
+        targets = pending[0x84]
+
+        if targets:
+            channels = sorted(targets)
+            buffer.extend(self.encode_targets(channels, [targets[c] for c in channels]).tobytes())
+
+        if buffer:
+            self.write(buffer)
+
+    def get_tick_stats(self):
+        """
+        Get statistics on the bytes sent per write.
+        :return: A dictionary of statistics.
+        """
+
+        sizes = list(self.tick_bytes)
+
+        return {
+            'ticks': len(sizes),
+            'last': sizes[-1] if sizes else 0,
+            'mean': sum(sizes) / len(sizes) if sizes else 0,
+            'max': max(sizes) if sizes else 0
+        }
 
     ##########################################
     # Begin implementation of read operations.
@@ -275,10 +601,8 @@ class Maestro:
         :param servo: A servo object.
         """
 
-        with self.read_lock:
-            # Send command and get reply.
-            self.usb.write((0x90, servo.channel))
-            reply = self.usb.read(size=2)
+        # Send command and get reply.
+        reply = self.query((0x90, servo.channel), 2)
 
         # Unpack data.
         pwm = self.struct.unpack(reply)[0]
@@ -292,10 +616,8 @@ class Maestro:
         :return: Returns True if one or more servos are moving, else False.
         """
 
-        with self.read_lock:
-            # Send command and receive.
-            self.usb.write((0x93,))
-            reply = self.usb.read()
+        # Send command and receive.
+        reply = self.query((0x93,), 1)
 
         # Check and return.
         if reply == b'\x00':
@@ -309,10 +631,8 @@ class Maestro:
         :return: Returns an integer reprenstation of an error or None if there are no errors.
         """
 
-        with self.read_lock:
-            # Send command and receive.
-            self.usb.write((0xA1,))
-            reply = self.usb.read(size=2)
+        # Send command and receive.
+        reply = self.query((0xA1,), 2)
 
         if reply:
             return self.struct.unpack(reply)[0]
@@ -338,14 +658,14 @@ class Maestro:
         data = (0x8A, lsb1, msb1, lsb2, msb2)
 
         # Write.
-        self.usb.write(data)
+        self.write(data)
 
     def go_home(self):
         """
         Return all servos to their home positions.
         """
         # Send command.
-        self.usb.write((0xA2,))
+        self.write((0xA2,))
 
     ############################################
     # Begin implementation of script operations.
@@ -357,7 +677,7 @@ class Maestro:
         """
 
         # Send command.
-        self.usb.write((0xA4,))
+        self.write((0xA4,))
 
     # Restart script.
     def restart(self, subroutine, parameter=None):
@@ -372,10 +692,10 @@ class Maestro:
             data = (0xA7, subroutine)
         else:
             lsb, msb = self.endianize(parameter)
-            data = (0xA8, lsb, msb)
+            data = (0xA8, subroutine, lsb, msb)
 
         # Send data.
-        self.usb.write(data)
+        self.write(data)
 
     def get_script_status(self):
         """
@@ -383,16 +703,11 @@ class Maestro:
         :return: Returns True if script is running and False if it is not.
         """
 
-        with self.read_lock:
-            # Send command and receive.
-            self.usb.write((0xAE,))
-            reply = self.usb.read()
+        # Send command and receive.
+        reply = self.query((0xAE,), 1)
 
-        # Check and return.
-        if reply == b'\x00':
-            return False
-        else:
-            return True
+        # The Maestro replies 0x00 while the script is running.
+        return reply == b'\x00'
 
     ###################################################
     # Begin implementation of complex helper functions.
@@ -418,26 +733,20 @@ class Maestro:
         if t == 0:
             return
 
-        # Faster send.
-        buffer = bytearray()
-
-        # Set acceleration to zero.
-        ins = self.set_acceleration(servo, 0, send=False)
-        buffer.extend(ins)
-
-        # Compute velocity as a change in 0.25us PWM / 10ms.
-        delta = abs(servo.target - servo.pwm)
-        vel = int(round(delta / t * 10))
+        # Send everything in one write.
+        with self.tick():
+            # Set acceleration to zero.
+            self.set_acceleration(servo, 0)
 
-        # Set velocity.
-        ins = self.set_speed(servo, vel, send=False)
-        buffer.extend(ins)
+            # Compute velocity as a change in 0.25us PWM / 10ms.
+            delta = abs(servo.target - servo.pwm)
+            vel = int(round(delta / t * 10))
 
-        # Send data.
-        self.write(buffer)
+            # Set velocity.
+            self.set_speed(servo, vel)
 
-        # Synchronize instruction.
-        self.set_target(servo)
+            # Synchronize instruction.
+            self.set_target(servo)
 
     def end_together(self, servos, t=0, update=False):
         """
@@ -446,47 +755,135 @@ class Maestro:
         :param servos: Servo objects.
         :param t: The time in ms for the operation. Set to 0 for max speed.
         :param update: Whether of not to update servo positions.
+        :return: The time in ms until all servos arrive given the commanded (rounded) speeds.
         """
 
         # Update servo positions as needed.
         if update:
             self.get_multiple_positions(servos)
 
+        # Compute everything at once if the servos are in a bank.
+        bank, index = self.get_bank(servos)
+
+        if bank is not None:
+            vel, arrival = bank.get_velocities(t, index)
+
+            # Already at target.
+            if vel is None:
+                return 0
+
+            # Update objects.
+            bank.accel[index] = 0
+            bank.vel[index] = vel
+
+            channels = bank.channel[index]
+
+            # Send everything in one write. Targets are sent last.
+            with self.tick():
+                self.queue_many(0x89, channels, np.zeros(len(channels), dtype=int))
+                self.queue_many(0x87, channels, vel)
+                self.queue_many(0x84, channels, bank.target[index])
+
+            return arrival
+
         # Max speed.
         if t == 0:
             t = max([abs(servo.target - servo.pwm) / servo.max_vel * 10 for servo in servos])
 
         # Already at target.
         if t == 0:
-            return
+            return 0
 
-        # Faster send.
-        buffer = bytearray()
+        # Arrival time of the slowest servo.
+        arrival = 0
 
-        # Compute and set the velocity for every servo.
-        for servo in servos:
-            # Set acceleration to zero.
-            ins = self.set_acceleration(servo, 0, send=False)
-            buffer.extend(ins)
+        # Send everything in one write. Targets are sent last.
+        with self.tick():
+            # Compute and set the velocity for every servo.
+            for servo in servos:
+                # Set acceleration to zero.
+                self.set_acceleration(servo, 0)
 
-            # Compute velocity as a change in 0.25us PWM / 10ms.
-            delta = abs(servo.target - servo.pwm)
-            vel = int(round(delta / t * 10))
+                # Compute velocity as a change in 0.25us PWM / 10ms.
+                delta = abs(servo.target - servo.pwm)
+                vel = int(round(delta / t * 10))
 
-            # Set velocity.
-            ins = self.set_speed(servo, vel, send=False)
-            buffer.extend(ins)
+                # Set velocity.
+                self.set_speed(servo, vel)
 
-        # Send data.
-        self.write(buffer)
+                if vel > 0:
+                    arrival = max(arrival, delta / vel * 10)
 
-        # Synchronize instructions.
-        buffer = bytearray()
+            # Move all servos to their respective targets.
+            for servo in servos:
+                self.set_target(servo)
 
-        # Move all servos to their respective targets.
-        for servo in servos:
-            ins = self.set_target(servo, send=False)
-            buffer.extend(ins)
+        return arrival
+
+    def end_ramped(self, servos, t=0, ramp=0.25, update=False):
+        """
+        Move all servos to their respective targets such that they arrive together, like end_together(), but with a
+        trapezoidal velocity profile. The Maestro ramps every servo up and down by itself, so this is still one write.
+        :param servos: Servo objects.
+        :param t: The time in ms for the operation. Set to 0 for max speed.
+        :param ramp: The fraction of t spent on each ramp, in (0, 0.5].
+        :param update: Whether of not to update servo positions.
+        :return: The time in ms until all servos arrive given the commanded (rounded) limits.
+        """
+
+        # Update servo positions as needed.
+        if update:
+            self.get_multiple_positions(servos)
+
+        targets = np.array([servo.target for servo in servos], dtype=int)
+        delta = np.abs(targets - np.array([servo.pwm for servo in servos]))
+
+        # Max speed. The peak speed of a trapezoid is 1 / (1 - ramp) times its average.
+        if t == 0:
+            max_vel = np.array([servo.max_vel for servo in servos], dtype=float)
+            t = np.max(delta / max_vel * 10) / (1 - ramp)
+
+        # Already at target.
+        if t == 0:
+            return 0
+
+        speeds, accels = trajectory.trapezoid(delta, t, ramp)
+        self.move_together(servos, targets, speeds, accels)
+
+        return trajectory.arrival(delta, speeds, accels)
+
+    def move_together(self, servos, targets, speeds, accels):
+        """
+        Set the acceleration, speed and target of servos in one write.
+        :param servos: Servo objects.
+        :param targets: Targets in 0.25 us.
+        :param speeds: Speeds in 0.25 us / 10 ms.
+        :param accels: Accelerations in 0.25 us / 10 ms / 80 ms.
+        """
+
+        bank, index = self.get_bank(servos)
+
+        if bank is not None:
+            # Update objects.
+            bank.target[index] = targets
+            bank.vel[index] = speeds
+            bank.accel[index] = accels
+
+            channels = bank.channel[index]
+
+            # Targets are sent last.
+            with self.tick():
+                self.queue_many(0x89, channels, accels)
+                self.queue_many(0x87, channels, speeds)
+                self.queue_many(0x84, channels, targets)
+
+            return
+
+        with self.tick():
+            for servo, speed, accel in zip(servos, speeds, accels):
+                self.set_acceleration(servo, int(accel))
+                self.set_speed(servo, int(speed))
 
-        # Send to execute move.
-        self.write(buffer)
+            for servo, target in zip(servos, targets):
+                servo.target = int(target)
+                self.set_target(servo)
@@ -1,13 +1,15 @@
 from agility.maestro import Maestro
+from agility.poller import Poller
 from agility.pololu.enumeration import uscSerialMode, ChannelMode, HomeMode
 from agility.pololu.usc import Usc
+from agility.pololu.reader import BytecodeReader
+from agility.stability import Stability, contains
+from agility.trajectory import Trajectory
+from agility import stream
 from threading import Event
 from shared.debug import Dummy
 import numpy as np
 import math
-from matplotlib.path import Path
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 import time
 import logging
 import sys
@@ -20,6 +22,13 @@ class ServoError(Exception):
 
 
 class Stepper:
+    # Limits of a move by the pulse script, set by the 14 bit script parameter.
+    max_batch = 255
+    max_half_period = 63
+
+    # The script times whole ms half periods. Moves that would run more than this fraction off use host timing.
+    max_timing_error = 0.05
+
     def __init__(self, c1, c2, steps, direction=1):
         self.c1 = c1  # Direction channel.
         self.c2 = c2  # Step channel.
@@ -29,6 +38,31 @@ class Stepper:
         self.step = 1
         self.target = 1
 
+        # Number of the uploaded pulse script subroutine. See script().
+        self.name = 'stepper_{}'.format(c2)
+        self.subroutine = None
+
+    def script(self):
+        """
+        Get a Maestro script subroutine that pulses the step channel, so that pulse timing does not depend on Python.
+        Upload with Agility.upload_scripts() and set subroutine to its number to use it with Maestro.rotate().
+        Only one script runs at a time, so this cannot run together with a gait script.
+        :return: The script source.
+        """
+
+        return '\n'.join([
+            'sub {}'.format(self.name),
+            '  # The parameter is the half period in ms * 256 + the number of steps.',
+            '  dup 8 shift_right swap 255 bitwise_and',
+            '  begin',
+            '    dup while',
+            '    8000 {} servo over delay'.format(self.c2),
+            '    1000 {} servo over delay'.format(self.c2),
+            '    1 minus',
+            '  repeat',
+            '  drop drop quit'
+        ])
+
     def get_position(self):
         """
         Get the stepper's current position in degrees.
@@ -126,6 +160,11 @@ class Servo:
         # This reverses the directionality of all angle inputs.
         self.direction = direction
 
+        # Dynamic data as (target, pwm, vel, accel). Becomes a view into a ServoBank once added to one.
+        self.state = np.zeros(4, dtype=int)
+        self.bank = None
+        self.index = None
+
         # Dynamic current data.
         self.pwm = 0
         self.vel = 0
@@ -141,6 +180,38 @@ class Servo:
         self.k_vel2mae = (60 * self.k_deg2mae) / self.max_vel * 10
         self.k_mae2vel = self.max_vel / ((60 * self.k_deg2mae) * 10)
 
+    @property
+    def target(self):
+        return int(self.state[0])
+
+    @target.setter
+    def target(self, value):
+        self.state[0] = value
+
+    @property
+    def pwm(self):
+        return int(self.state[1])
+
+    @pwm.setter
+    def pwm(self, value):
+        self.state[1] = value
+
+    @property
+    def vel(self):
+        return int(self.state[2])
+
+    @vel.setter
+    def vel(self, value):
+        self.state[2] = value
+
+    @property
+    def accel(self):
+        return int(self.state[3])
+
+    @accel.setter
+    def accel(self, value):
+        self.state[3] = value
+
     def zero(self):
         """
         Set the servo to zero, ignoring bias.
@@ -244,6 +315,167 @@ class Servo:
         return self.min_deg + self.k_mae2deg * (pwm - self.min_pwm)
 
 
+class ServoBank:
+    def __init__(self, servos):
+        """
+        Struct of arrays holding the constants and dynamic data of many servos.
+        Each servo's target, pwm, vel and accel become views into the bank, so both stay in sync.
+        :param servos: Servo objects. Each servo can only belong to one bank.
+        """
+
+        self.servos = list(servos)
+
+        # Constants.
+        self.channel = self.gather('channel', int)
+        self.min_deg = self.gather('min_deg')
+        self.max_deg = self.gather('max_deg')
+        self.min_pwm = self.gather('min_pwm')
+        self.max_pwm = self.gather('max_pwm')
+        self.max_vel = self.gather('max_vel')
+        self.bias = self.gather('bias')
+        self.direction = self.gather('direction')
+        self.left_bound = self.gather('left_bound')
+        self.right_bound = self.gather('right_bound')
+        self.k_deg2mae = self.gather('k_deg2mae')
+        self.k_mae2deg = self.gather('k_mae2deg')
+
+        # Dynamic data as (target, pwm, vel, accel) x servos.
+        self.state = np.array([servo.state for servo in self.servos], dtype=int).T.copy()
+        self.target, self.pwm, self.vel, self.accel = self.state
+
+        # Turn servos into views.
+        for i, servo in enumerate(self.servos):
+            servo.state = self.state[:, i]
+            servo.bank = self
+            servo.index = i
+
+        # Indices of servo lists seen before.
+        self.cache = {}
+
+    def gather(self, name, dtype=float):
+        return np.array([getattr(servo, name) for servo in self.servos], dtype=dtype)
+
+    def indices(self, servos):
+        """
+        Get the indices of some servos in the bank.
+        :param servos: Servo objects.
+        :return: An array of indices, or None if a servo is not in the bank.
+        """
+
+        key = tuple(map(id, servos))
+        index = self.cache.get(key)
+
+        if index is None:
+            if not all(servo.bank is self for servo in servos):
+                return None
+
+            index = np.array([servo.index for servo in servos], dtype=int)
+            self.cache[key] = index
+
+        return index
+
+    def normalize(self, deg, index=None):
+        """
+        Vectorized Servo.normalize(). Out of range degrees are flagged instead of raising ServoError.
+        :param deg: An array of input degrees (... x S).
+        :param index: Indices of the S servos. If None, uses all servos.
+        :return: (deg, valid) where valid is a boolean mask.
+        """
+
+        if index is None:
+            index = slice(None)
+
+        left, right = self.left_bound[index], self.right_bound[index]
+
+        # Account for direction and bias.
+        deg = np.asarray(deg, dtype=float) * self.direction[index] + self.bias[index]
+
+        # Normalize.
+        deg = np.where(deg > right, deg - 360, deg)
+        deg = np.where(deg < left, deg + 360, deg)
+
+        valid = (deg <= right) & (deg >= left)
+
+        return deg, valid
+
+    def deg_to_maestro(self, deg, index=None):
+        """
+        Vectorized Servo.deg_to_maestro().
+        :param deg: An array of input degrees (... x S).
+        :param index: Indices of the S servos. If None, uses all servos.
+        :return: An integer array of PWM in units of 0.25 us.
+        """
+
+        if index is None:
+            index = slice(None)
+
+        pwm = self.min_pwm[index] + self.k_deg2mae[index] * (deg - self.min_deg[index])
+        return np.rint(pwm).astype(int)
+
+    def at_target(self, index=None):
+        """
+        Vectorized Servo.at_target().
+        :param index: Indices of servos. If None, uses all servos.
+        :return: A boolean array.
+        """
+
+        if index is None:
+            index = slice(None)
+
+        return self.target[index] == self.pwm[index]
+
+    def get_velocities(self, t=0, index=None):
+        """
+        Compute velocities such that servos arrive at their targets together, as in end_together().
+        :param t: The time in ms. Set to 0 for max speed.
+        :param index: Indices of servos. If None, uses all servos.
+        :return: (vel, arrival) where vel is in 0.25 us / 10 ms and arrival is the time in ms of the slowest servo.
+                 vel is None if all servos are already at their targets.
+        """
+
+        if index is None:
+            index = slice(None)
+
+        delta = np.abs(self.target[index] - self.pwm[index])
+
+        # Max speed.
+        if t == 0:
+            t = np.max(delta / self.max_vel[index] * 10)
+
+        # Already at target.
+        if t == 0:
+            return None, 0
+
+        # Velocity as a change in 0.25us PWM / 10ms.
+        vel = np.rint(delta / t * 10).astype(int)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arrival = np.where(vel > 0, delta / vel * 10, 0)
+
+        return vel, float(arrival.max())
+
+    def get_lag(self, index=None):
+        """
+        Estimate how long servos need to reach their targets at their current speeds.
+        :param index: Indices of servos. If None, uses all servos.
+        :return: The time in ms.
+        """
+
+        if index is None:
+            index = slice(None)
+
+        vel = self.vel[index]
+        delta = np.abs(self.target[index] - self.pwm[index])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(vel > 0, delta / vel * 10, 0)
+
+        return float(t.max()) if len(t) > 0 else 0
+
+    def __len__(self):
+        return len(self.servos)
+
+
 class Body:
     def __init__(self, length, width, cx, cy, mb, ml):
         """
@@ -475,6 +707,64 @@ class Body:
         else:
             return self.default_bias(next_frame)
 
+    def adjust_batch(self, off, frames, sigma=1.5):
+        """
+        Vectorized adjust() over many frames. Gives the same biases as calling adjust() on each frame.
+        :param off: An array indicating which legs are in the air (N x 4).
+        :param frames: The next frame for each bias (N x 4 x 3).
+        :param sigma: Safety boundary for the crawl gait.
+        :return: The biases (N x 3).
+        """
+
+        off = np.asarray(off, dtype=bool)
+        frames = np.asarray(frames, dtype=float)
+        n = len(frames)
+        rows = np.arange(n)
+
+        # Relative to absolute.
+        original = frames + self.vertices
+
+        # Compute center of mass as with leg positions.
+        com = self.ml * np.sum(original[:, :, :2], axis=1) / (self.ml + self.mb)
+        com += self.com[:2]
+        cx, cy = com[:, 0], com[:, 1]
+
+        # Determine which (if any) optimization is needed.
+        count = np.count_nonzero(off, axis=1)
+        crawl = count == 1
+        trot = (count == 2) & (off[:, 1] == off[:, 2])
+
+        # Default bias.
+        biases = np.zeros((n, 3))
+        biases[:, 0] = -cx
+        biases[:, 1] = -cy
+
+        # Get the supporting legs. For crawl, these are given by the leg in the air.
+        # For trot, these are the legs on the ground.
+        legs = np.zeros((n, 2), dtype=int)
+        legs[crawl] = self.j[np.argmax(off[crawl], axis=1)]
+        legs[trot] = np.where(off[trot, :1], (1, 2), (0, 3))
+
+        # Get points.
+        x1, y1 = original[rows, legs[:, 0], 0], original[rows, legs[:, 0], 1]
+        x2, y2 = original[rows, legs[:, 1], 0], original[rows, legs[:, 1], 1]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Get closest point from center of mass to support.
+            x0, y0 = self.closest(x1, x2, y1, y2, cx, cy)
+
+            # Compute additional safety margin for crawl.
+            theta = np.arctan2((y2 - y1), (x2 - x1))
+
+        biases[crawl, 0] = (sigma * np.sin(theta) + x0)[crawl]
+        biases[crawl, 1] = (-sigma * np.cos(theta) + y0)[crawl]
+
+        # Compute bias for trot.
+        biases[trot, 0] = (x0 - cx)[trot]
+        biases[trot, 1] = (y0 - cy)[trot]
+
+        return biases
+
     def translate(self, x, y, z):
         """
         Translate the body and thus the center of mass.
@@ -497,12 +787,11 @@ class Body:
         :return: True if center of mass is in triangle, else False.
         """
 
-        triangle = Path(vertices)
-        return triangle.contains_point(self.com[:2])
+        return contains(vertices, self.com[:2])
 
 
 class Leg:
-    def __init__(self, servo1, servo2, servo3, lengths, index, ik, fk):
+    def __init__(self, servo1, servo2, servo3, lengths, index, ik, fk, ik_batch=None):
         """
         Create a leg object.
         :param servo1: The first hip servo object.
@@ -512,6 +801,7 @@ class Leg:
         :param index: The leg index (1 - 4).
         :param ik: Inverse kinematics solver.
         :param fk: Forward kinematics solver.
+        :param ik_batch: Vectorized inverse kinematics solver returning (angles, valid). Optional.
         """
 
         self.servos = [servo1, servo2, servo3]
@@ -521,6 +811,7 @@ class Leg:
 
         self.ik_solver = ik
         self.fk_solver = fk
+        self.ik_batch_solver = ik_batch
 
         self.position = None
 
@@ -543,6 +834,29 @@ class Leg:
 
         return True
 
+    def target_solved(self, point, angles, valid=True):
+        """
+        Target a point in space using an already solved angle configuration.
+        :param point: (x, y, z).
+        :param angles: (theta1, theta2, theta3) from get_angles_batch().
+        :param valid: Whether the solver was able to reach the point.
+        :return: True if target is reachable, else False.
+        """
+
+        try:
+            if not valid:
+                raise ValueError
+
+            self.servos[0].set_target(angles[0])
+            self.servos[1].set_target(angles[1])
+            self.servos[2].set_target(angles[2])
+            self.position = point
+        except (ServoError, ValueError):
+            logger.error('Leg {} is unable to reach point ({:.2f}, {:.2f}, {:.2f})'.format(self.index, *point))
+            return False
+
+        return True
+
     def target_angle(self, angle):
         """
         Target an angle configuration.
@@ -569,6 +883,29 @@ class Leg:
 
         return self.ik_solver(self.lengths, point)
 
+    def get_angles_batch(self, points):
+        """
+        Convert many points to angles. Will not throw exceptions.
+        :param points: An array of points (N x 3).
+        :return: (angles, valid) where angles is (N x 3) and valid is a boolean mask of length N.
+        """
+
+        if self.ik_batch_solver is not None:
+            return self.ik_batch_solver(self.lengths, points)
+
+        # Fall back on the scalar solver.
+        angles = np.full((len(points), 3), np.nan)
+        valid = np.zeros(len(points), dtype=bool)
+
+        for i in range(len(points)):
+            try:
+                angles[i] = self.ik_solver(self.lengths, points[i])
+                valid[i] = True
+            except (ValueError, ZeroDivisionError):
+                pass
+
+        return angles, valid
+
     def update_position(self):
         """
         Update current leg position based on servo data.
@@ -665,12 +1002,65 @@ class Robot:
         self.head = head
         self.head_servos = [servo for servo in head]
 
+        # All servos as arrays.
+        self.bank = ServoBank(self.leg_servos + self.head_servos)
+
         # Define body.
         self.body = body
 
 
+class CompiledGait:
+    def __init__(self, servos, targets, dt, frames=None):
+        """
+        Pre-encoded speed and target commands for every frame of a gait.
+        Frames are assumed to loop, so the speeds of the first frame are relative to the last frame.
+        :param servos: The servo objects, one per column of targets.
+        :param targets: The targets in 0.25 us (steps x servos).
+        :param dt: Delta t.
+        :param frames: The prepared frames the targets were made from. Optional.
+        """
+
+        self.servos = servos
+        self.channels = np.array([servo.channel for servo in servos])
+        self.targets = np.asarray(targets, dtype=int)
+        self.frames = frames
+        self.dt = dt
+
+        # Compute velocity as a change in 0.25us PWM / 10ms, exactly as end_together() does.
+        delta = np.abs(self.targets - np.roll(self.targets, 1, axis=0))
+        self.speeds = np.rint(delta / dt * 10).astype(int)
+
+        # Time in ms until the slowest servo arrives at the commanded speeds.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arrival = np.where(self.speeds > 0, delta / self.speeds * 10, 0)
+
+        self.durations = arrival.max(axis=1)
+
+        # Encode everything once.
+        self.buffer, self.offsets = Maestro.encode_frames(self.channels, self.speeds, self.targets)
+        self.prologue = Maestro.encode(0x89, self.channels, np.zeros(len(servos), dtype=int)).tobytes()
+
+    def frame(self, i):
+        """
+        Get the commands of one frame without copying.
+        :param i: The frame index.
+        :return: A memoryview of the frame's commands.
+        """
+
+        return memoryview(self.buffer)[self.offsets[i]:self.offsets[i + 1]]
+
+    def __len__(self):
+        return len(self.targets)
+
+
 class Agility:
-    def __init__(self, robot):
+    def __init__(self, robot, maestro=None, usc=None):
+        """
+        :param robot: The robot object.
+        :param maestro: A Maestro-like object for the command port. Automatically detected if None.
+        :param usc: A Usc-like object for the low-level interface. Automatically detected if None.
+        """
+
         # Set up robot.
         self.robot = robot
 
@@ -678,26 +1068,35 @@ class Agility:
         self.epsilon = 1e-6
 
         # Set up Usc.
-        try:
-            self.usc = Usc()
-            logger.info("Successfully attached to Maestro's low-level interface.")
-        except ConnectionError:
-            self.usc = Dummy()
-            logger.warn("Failed to attached to Maestro's low-level interface. "
-                        "If not debugging, consider this a fatal error.")
+        if usc is not None:
+            self.usc = usc
+        else:
+            try:
+                self.usc = Usc()
+                logger.info("Successfully attached to Maestro's low-level interface.")
+            except ConnectionError:
+                self.usc = Dummy()
+                logger.warn("Failed to attached to Maestro's low-level interface. "
+                            "If not debugging, consider this a fatal error.")
 
         # Set up virtual COM and TTL ports.
-        try:
-            self.maestro = Maestro()
-            logger.info("Successfully attached to Maestro's command port.")
-        except ConnectionError:
-            self.maestro = Dummy()
-            logger.warn("Failed to attached to Maestro's command port. "
-                        "If not debugging, consider this a fatal error.")
+        if maestro is not None:
+            self.maestro = maestro
+        else:
+            try:
+                self.maestro = Maestro()
+                logger.info("Successfully attached to Maestro's command port.")
+            except ConnectionError:
+                self.maestro = Dummy()
+                logger.warn("Failed to attached to Maestro's command port. "
+                            "If not debugging, consider this a fatal error.")
 
         # Emergency stop.
         self.emergency = Event()
 
+        # Background position reads. See start_poller().
+        self.poller = None
+
         # Zero.
         self.zero()
 
@@ -715,6 +1114,59 @@ class Agility:
 
         self.emergency.clear()
 
+    def start_poller(self, rate=10, fast_rate=200):
+        """
+        Read all servo positions in the background.
+        Consumers then use the latest sample instead of querying the Maestro themselves.
+        :param rate: Samples per second while every servo is at its target. 0 to only sample when update() needs to.
+        :param fast_rate: Samples per second while any servo is moving.
+        """
+
+        if self.poller is None:
+            self.poller = Poller(self.maestro, self.robot.bank, rate, fast_rate)
+
+        self.poller.start()
+
+    def stop_poller(self):
+        """
+        Stop reading servo positions in the background.
+        """
+
+        if self.poller is not None:
+            self.poller.stop()
+
+    def update(self, servos, max_age=None):
+        """
+        Update servo positions. If the poller is running, its latest sample is used unless it is stale, in which case
+        the poller is asked for a fresh one.
+        :param servos: One or more servo objects.
+        :param max_age: The oldest sample to use in seconds. Defaults to two poll periods, so that a sample on its way
+                        is not requested again. Poll periods are short while servos are moving. Without background
+                        polling, a fresh sample is always taken.
+        """
+
+        if self.poller is not None and self.poller.is_alive():
+            bank = self.robot.bank
+            index = bank.indices([servos] if isinstance(servos, Servo) else servos)
+
+            if max_age is None:
+                # Servos that are still moving need a sample from the fast rate.
+                period = 1 / self.poller.fast_rate if self.poller.is_moving(index) else self.poller.get_period()
+                max_age = 2 * period if period is not None else None
+
+            age = self.poller.get_age()
+
+            if age is not None and max_age is not None and age <= max_age:
+                return
+
+            if self.poller.sample(0.1):
+                return
+
+        if isinstance(servos, Servo):
+            self.maestro.get_position(servos)
+        else:
+            self.maestro.get_multiple_positions(servos)
+
     def head_rotation(self):
         """
         Provides head rotation.
@@ -722,7 +1174,7 @@ class Agility:
         """
 
         servo = self.robot.head[0]
-        self.maestro.get_position(servo)
+        self.update(servo)
 
         return servo.get_position()
 
@@ -798,7 +1250,7 @@ class Agility:
         low, high = servo.get_range()
 
         # Update servo.
-        self.maestro.get_position(servo)
+        self.update(servo)
 
         # Check bound.
         bound = head.at_bound()
@@ -856,7 +1308,7 @@ class Agility:
         servos = head.servos
 
         # Update positions.
-        self.maestro.get_multiple_positions(servos)
+        self.update(servos)
 
         for i in range(2):
             servo = head[i]
@@ -898,6 +1350,10 @@ class Agility:
         :param frames: Frames generated by execute.
         """
 
+        # Only needed for debugging. Keeps matplotlib out of the control process.
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D
+
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
 
@@ -924,16 +1380,18 @@ class Agility:
         legs = self.robot.legs
         servos = self.robot.leg_servos
 
+        # Solve all frames once.
+        angles, valid = self.solve(frames)
+
         # Update initial leg locations.
-        self.maestro.get_multiple_positions(servos)
+        self.update(servos)
 
         for leg in legs:
             leg.get_position()
 
         while True:
-            for frame in frames:
-                for i in range(4):
-                    legs[i].target_point(frame[i])
+            for t in range(len(frames)):
+                self.target_frame(frames[t], angles[t], valid[t])
 
                 self.maestro.end_together(servos, dt)
                 self.wait(servos)
@@ -945,16 +1403,18 @@ class Agility:
         :param dt: Delta t.
         """
 
-        # Get all legs and servos for quick access.
-        legs = self.robot.legs
+        # Get all servos for quick access.
         servos = self.robot.leg_servos
 
+        # Check stability and solve all frames at once.
+        self.validate(frames)
+        angles, valid = self.solve(frames)
+
         # Update initial leg locations.
-        self.maestro.get_multiple_positions(servos)
+        self.update(servos)
 
-        for frame in frames:
-            for i in range(4):
-                legs[i].target_point(frame[i])
+        for t in range(len(frames)):
+            self.target_frame(frames[t], angles[t], valid[t])
 
             self.maestro.end_together(servos, dt)
             self.wait(servos)
@@ -963,51 +1423,136 @@ class Agility:
         """
         Execute frames with constant but possibly long dt.
         Automatically computes distance, and, if necessary, interpolates to get more accurate synchronization.
+        Interpolated frames are streamed, so memory does not grow with dt.
         :param prev_frame: The previous frame.
         :param frames: An array of frames.
         :param dt: Delta t.
         """
 
-        # Get all legs and servos for quick access.
-        legs = self.robot.legs
+        # Get all servos for quick access.
         servos = self.robot.leg_servos
 
         # Define break constant (ms / cm).
         k = 100
 
-        # Update initial leg locations.
-        self.maestro.get_multiple_positions(servos)
+        # Interpolate, solve and encode one frame at a time.
+        source = stream.interpolate(((frame, dt) for frame in frames), prev_frame, k)
+        source = stream.solve(self, source)
+        source = stream.encode(servos, source)
 
-        for frame in frames:
-            # Compute max distance.
-            d = max(np.linalg.norm(frame - prev_frame, axis=1))
+        self.execute_stream(source)
 
-            # Less than break. Too long. Linearly interpolate.
-            if dt / d > k:
-                n = int(round(dt / d / k)) + 1
-                l_frames = self.smooth(prev_frame, frame, n)
-                l_frames = l_frames[1:]
+    def execute_trajectory(self, frames, dt, profile='trapezoid', ramp=0.25):
+        """
+        Move through frames with smooth, time parameterized motion. Blocks until completion.
+        Unlike execute_long(), long moves are not split into many short frames. A trapezoid lets the Maestro ramp
+        every servo by itself, so each frame is a single write. An S-curve takes a few writes per frame.
+        :param frames: An array of frames.
+        :param dt: Delta t, or an array of one per frame. 0 for max speed.
+        :param profile: 'trapezoid' or 's-curve'.
+        :param ramp: The fraction of each move spent on each ramp of a trapezoid.
+        """
 
-                # Compute time.
-                t = dt / n
+        # Get all legs and servos for quick access.
+        legs = self.robot.legs
+        servos = self.robot.leg_servos
+        bank = self.robot.bank
+        index = bank.indices(servos)
 
-                # Execute intermediate frames.
-                for l_frame in l_frames:
-                    for i in range(4):
-                        legs[i].target_point(l_frame[i])
+        frames = np.asarray(frames, dtype=float)
 
-                    self.maestro.end_together(servos, t)
-                    self.wait(servos)
+        # Moves start where the servos are.
+        self.update(servos)
+        targets, reached = self.tabulate(frames, mask=True)
+        trajectory = Trajectory(bank.pwm[index], targets, dt, profile, ramp, max_vel=bank.max_vel[index])
+
+        deadline = time.monotonic()
+        last = len(trajectory) - 1
+
+        for i, (target, speed, accel, t) in enumerate(trajectory.segments):
+            self.maestro.move_together(servos, target, speed, accel)
+
+            if profile == 'trapezoid':
+                # The Maestro stops at every frame.
+                self.wait(servos)
             else:
-                t = dt
+                # Segments flow into each other.
+                deadline += t / 1000
 
-            for i in range(4):
-                legs[i].target_point(frame[i])
+                if not self.sleep_until(deadline):
+                    break
+
+            if self.emergency.is_set():
+                break
 
-            self.maestro.end_together(servos, t)
+            # Keep leg positions in sync at the end of every frame.
+            f = trajectory.waypoints[i]
+
+            if i == last or trajectory.waypoints[i + 1] != f:
+                for l in range(4):
+                    if reached[f, l]:
+                        legs[l].position = frames[f, l]
+
+        if profile != 'trapezoid':
             self.wait(servos)
 
-            prev_frame = frame
+    def execute_gait(self, gait, cycles=1):
+        """
+        Prepare and execute a gait one frame at a time, like prepare_gait() followed by execute_frames().
+        Motion starts as soon as the first frame is ready, instead of after the whole gait is prepared.
+        :param gait: The gait object.
+        :param cycles: The number of cycles to execute. None to execute until stopped.
+        """
+
+        # Get robot parts for quick access.
+        legs = self.robot.legs
+        body = self.robot.body
+        servos = self.robot.leg_servos
+
+        source = stream.evaluate(gait, legs, cycles)
+        source = stream.adjust(body, source, gait.ground, self.epsilon)
+        source = stream.solve(self, source)
+        source = stream.encode(servos, source)
+
+        self.execute_stream(source)
+
+    def execute_stream(self, source, size=8):
+        """
+        Execute frames produced by a chain of stages from agility.stream.
+        The stages run on a background thread while frames are executed.
+        :param source: An iterable of (frame, dt, targets, speeds, data), usually from stream.encode().
+        :param size: The maximum number of frames prepared ahead.
+        """
+
+        # Get all legs and servos for quick access.
+        legs = self.robot.legs
+        servos = self.robot.leg_servos
+        bank = self.robot.bank
+        index = bank.indices(servos)
+
+        pipeline = stream.Pipeline(source, size)
+
+        try:
+            for frame, dt, targets, speeds, data in pipeline:
+                if self.emergency.is_set():
+                    break
+
+                for l in range(4):
+                    legs[l].position = frame[l]
+
+                bank.target[index] = targets
+
+                if data is None:
+                    # The first frame depends on where the servos are.
+                    self.maestro.end_together(servos, dt, True)
+                else:
+                    # Keep servo objects in sync for wait().
+                    bank.vel[index] = speeds
+                    self.maestro.write(data)
+
+                self.wait(servos)
+        finally:
+            pipeline.close()
 
     def execute_variable(self, frames, dts):
         """
@@ -1016,19 +1561,20 @@ class Agility:
         :param dts: An array of dt.
         """
 
-        # Get all legs and servos for quick access.
-        legs = self.robot.legs
+        # Get all servos for quick access.
         servos = self.robot.leg_servos
 
-        # Update initial leg locations.
-        self.maestro.get_multiple_positions(servos)
-
         # Assertion check.
         assert len(frames) == len(dts)
 
+        # Solve all frames at once.
+        angles, valid = self.solve(frames)
+
+        # Update initial leg locations.
+        self.update(servos)
+
         for t in range(len(frames)):
-            for i in range(4):
-                legs[i].target_point(frames[t][i])
+            self.target_frame(frames[t], angles[t], valid[t])
 
             self.maestro.end_together(servos, dts[t])
             self.wait(servos)
@@ -1045,32 +1591,401 @@ class Agility:
         servos = self.robot.leg_servos
 
         # Update initial leg locations.
-        self.maestro.get_multiple_positions(servos)
+        self.update(servos)
 
         for angle in angles:
             for i in range(4):
-                legs[i].target_angle(angle)
+                legs[i].target_angle(angle[i])
 
             self.maestro.end_together(servos, dt)
             self.wait(servos)
 
-    def anglify(self, frames):
+    def execute_compiled(self, compiled):
         """
-        Converts frames generated by self.prepare to angles.
-        :param frames: The input frames.
-        :return: The output angles ready for execution.
+        Like execute_frames(), but only writes the pre-encoded commands of a compiled gait.
+        :param compiled: A CompiledGait from compile().
+        """
+
+        # Get table data for quick access.
+        servos = compiled.servos
+        targets = compiled.targets
+        speeds = compiled.speeds
+        bank = self.robot.bank
+        index = bank.indices(servos)
+
+        # Update initial leg locations.
+        self.update(servos)
+
+        # The speeds of the first frame are only correct if starting from the last frame.
+        if np.array_equal(bank.pwm[index], targets[-1]):
+            start = 0
+            self.maestro.write(compiled.prologue)
+        else:
+            start = 1
+
+            bank.target[index] = targets[0]
+
+            self.maestro.end_together(servos, compiled.dt)
+            self.wait(servos)
+
+        for i in range(start, len(compiled)):
+            # Keep servo objects in sync for wait().
+            bank.target[index] = targets[i]
+            bank.vel[index] = speeds[i]
+
+            self.maestro.write(compiled.frame(i))
+            self.wait(servos)
+
+    def execute_scheduled(self, compiled, rate=5):
+        """
+        Like execute_compiled(), but issues frames on a monotonic clock instead of polling for arrival.
+        Each frame is sent when the previous one should have finished given the commanded speeds.
+        Servo positions are only sampled at a low rate to correct for drift.
+        :param compiled: A CompiledGait from compile().
+        :param rate: Position samples per second used for drift correction. 0 to never sample.
+        """
+
+        # Get table data for quick access.
+        servos = compiled.servos
+        targets = compiled.targets
+        speeds = compiled.speeds
+        durations = compiled.durations.tolist()
+        bank = self.robot.bank
+        index = bank.indices(servos)
+
+        # Update initial leg locations.
+        self.update(servos)
+        now = time.monotonic()
+
+        # The speeds of the first frame are only correct if starting from the last frame.
+        if np.array_equal(bank.pwm[index], targets[-1]):
+            start = 0
+            deadline = now
+            self.maestro.write(compiled.prologue)
+        else:
+            start = 1
+
+            bank.target[index] = targets[0]
+
+            deadline = now + self.maestro.end_together(servos, compiled.dt) / 1000
+
+        # Schedule drift correction.
+        period = 1 / rate if rate > 0 else None
+        sample = now + period if period is not None else None
+
+        for i in range(start, len(compiled)):
+            if not self.sleep_until(deadline):
+                return
+
+            # Sample positions and wait out any lag.
+            if sample is not None and deadline >= sample:
+                self.update(servos)
+                deadline += self.lag(servos) / 1000
+                sample = deadline + period
+
+                if not self.sleep_until(deadline):
+                    return
+
+            # Keep servo objects in sync for wait().
+            bank.target[index] = targets[i]
+            bank.vel[index] = speeds[i]
+
+            self.maestro.write(compiled.frame(i))
+            deadline += durations[i] / 1000
+
+        # Settle the last frame.
+        if self.sleep_until(deadline):
+            self.wait(servos)
+
+    def sleep_until(self, deadline):
+        """
+        Sleep until a time given by time.monotonic(). Wakes up early on emergency stop.
+        :param deadline: The time to wake up.
+        :return: False if emergency stopped, else True.
+        """
+
+        remaining = deadline - time.monotonic()
+
+        if remaining > 0:
+            return not self.emergency.wait(remaining)
+
+        return not self.emergency.is_set()
+
+    @staticmethod
+    def lag(servos):
+        """
+        Estimate how long servos need to reach their targets at their current speeds.
+        Assumes servo positions were just updated.
+        :param servos: Servo objects.
+        :return: The time in ms.
+        """
+
+        bank, index = Maestro.get_bank(servos)
+
+        if bank is not None:
+            return bank.get_lag(index)
+
+        t = 0
+
+        for servo in servos:
+            if servo.vel > 0:
+                t = max(t, abs(servo.target - servo.pwm) / servo.vel * 10)
+
+        return t
+
+    def step_frame(self, frame, dt):
+        """
+        Move the legs to a single frame, solving it on the spot. Does not wait for completion.
+        :param frame: The frame (4 x 3).
+        :param dt: Delta t.
+        :return: The time in ms until the legs arrive.
+        """
+
+        # Get all servos for quick access.
+        servos = self.robot.leg_servos
+
+        frame = np.asarray(frame, dtype=float)
+        angles, valid = self.solve(frame[np.newaxis])
+        self.target_frame(frame, angles[0], valid[0])
+
+        return self.maestro.end_together(servos, dt, True)
+
+    def step_compiled(self, compiled, i):
+        """
+        Move the legs to a single frame of a compiled gait. Does not wait for completion.
+        Only correct when the legs are at frame i - 1.
+        :param compiled: A CompiledGait from compile().
+        :param i: The frame index.
+        :return: The time in ms until the legs arrive.
+        """
+
+        # Get servos for quick access.
+        bank = self.robot.bank
+        index = bank.indices(compiled.servos)
+
+        # Keep servo objects in sync for wait().
+        bank.target[index] = compiled.targets[i]
+        bank.vel[index] = compiled.speeds[i]
+
+        self.maestro.write(compiled.frame(i))
+
+        return compiled.durations[i]
+
+    def compile(self, frames, dt):
+        """
+        Compile prepared frames into pre-encoded servo commands.
+        :param frames: Looping frames from prepare_gait() or prepare_smoothly().
+        :param dt: Delta t.
+        :return: A CompiledGait ready for execute_compiled().
+        """
+
+        self.validate(frames)
+
+        return CompiledGait(self.robot.leg_servos, self.tabulate(frames), dt, frames)
+
+    def validate(self, frames, margin=0):
+        """
+        Check the static stability of frames. Unstable frames are logged.
+        :param frames: Prepared frames (steps x 4 x 3).
+        :param margin: The required stability margin.
+        :return: A Stability object.
+        """
+
+        stability = Stability(self.robot.body, frames)
+
+        if not stability.is_stable(margin):
+            unstable = stability.static() & (stability.margin <= margin)
+            logger.warning('{} of {} frames are not statically stable. Smallest margin is {:.2f}.'.format(
+                np.count_nonzero(unstable), len(stability), stability.get_margin()))
+
+        return stability
+
+    def compile_gait_to_script(self, frames, dt, name='gait'):
+        """
+        Compile prepared frames into a Maestro script subroutine that loops the gait on the device.
+        Each frame sets speeds and targets, then delays until the slowest servo arrives.
+        Commands for servos that do not move in a frame are left out.
+        :param frames: Looping frames from prepare_gait() or prepare_smoothly().
+        :param dt: Delta t.
+        :param name: The subroutine name.
+        :return: The script source of the subroutine. Upload with upload_scripts().
+        """
+
+        compiled = self.compile(frames, dt)
+        channels = compiled.channels.tolist()
+        targets = compiled.targets.tolist()
+        speeds = compiled.speeds.tolist()
+
+        lines = ['# {} frames at {} ms.'.format(len(compiled), dt), 'sub {}'.format(name)]
+
+        # Acceleration is not part of the gait.
+        lines.append('  ' + ' '.join('0 {} acceleration'.format(channel) for channel in channels))
+        lines.append('  begin')
+
+        for i in range(len(compiled)):
+            moving = [j for j in range(len(channels)) if targets[i][j] != targets[i - 1][j]]
+
+            if moving:
+                lines.append('    ' + ' '.join('{} {} speed'.format(speeds[i][j], channels[j]) for j in moving))
+                lines.append('    ' + ' '.join('{} {} servo'.format(targets[i][j], channels[j]) for j in moving))
+
+            # Never less than dt, like execute_scheduled().
+            delay = max(int(round(dt)), int(math.ceil(compiled.durations[i])))
+            lines.append('    {} delay'.format(delay))
+
+        lines.append('  repeat')
+
+        return '\n'.join(lines)
+
+    def upload_scripts(self, scripts, optimize=True):
+        """
+        Compile and upload script subroutines to the Maestro, replacing the current script.
+        :param scripts: A list of subroutine sources, such as from compile_gait_to_script().
+        :param optimize: Whether to run the peephole optimizer on the bytecode.
+        :return: A dictionary of subroutine name to subroutine number for start_script().
+        """
+
+        # Do nothing if started directly.
+        source = '\n'.join(['quit'] + list(scripts))
+        program = BytecodeReader().read(source, self.usc.isMiniMaestro, optimize)
+
+        if program.optimization is not None:
+            report = program.optimization
+            logger.info('Optimized script from {} to {} bytes and {} to {} instructions.'.format(
+                report['size_before'], report['size_after'],
+                report['instructions_before'], report['instructions_after']))
+
+        self.usc.loadProgram(program)
+
+        return {name.lower(): command - 128 for name, command in program.subroutineCommands.items()}
+
+    def start_script(self, subroutine, compiled=None):
+        """
+        Start a gait script uploaded with upload_scripts(). Returns immediately.
+        :param subroutine: The subroutine number.
+        :param compiled: The CompiledGait of the script. If given, first moves the legs to its last frame,
+                         so that the speeds of the first frame are correct.
+        """
+
+        if compiled is not None:
+            bank = self.robot.bank
+            index = bank.indices(compiled.servos)
+            bank.target[index] = compiled.targets[-1]
+
+            self.maestro.end_together(compiled.servos, compiled.dt)
+            self.wait(compiled.servos)
+
+        self.maestro.restart(subroutine)
+
+    def stop_script(self):
+        """
+        Stop the running script and hold the legs where they end up.
+        """
+
+        self.maestro.stop_script()
+
+        # The script changed targets behind our back.
+        servos = self.robot.leg_servos
+        bank = self.robot.bank
+        index = bank.indices(servos)
+
+        self.wait()
+        self.update(servos)
+        bank.target[index] = bank.pwm[index]
+
+    def tabulate(self, frames, hold=None, mask=False):
+        """
+        Convert frames to leg servo targets.
+        A leg that cannot reach a point holds its previous target, just like target_point().
+        :param frames: An array of frames (steps x 4 x 3).
+        :param hold: Targets to hold before the first reachable point (12). If None, holds the current targets.
+        :param mask: Whether to also return which points were reached.
+        :return: An integer array of targets in 0.25 us (steps x 12), or (targets, reached) where reached is (steps x 4).
         """
 
         # Get all legs and servos for quick access.
         legs = self.robot.legs
+        bank = self.robot.bank
+        index = bank.indices(self.robot.leg_servos)
+
+        # Solve all frames at once.
+        angles, valid = self.solve(frames)
+        steps = len(angles)
+
+        # Convert every servo at once.
+        deg, reachable = bank.normalize(angles.reshape(steps, 12), index)
+        deg = np.where(reachable, deg, bank.min_deg[index])
+        targets = bank.deg_to_maestro(deg, index)
+        reached = valid & reachable.reshape(steps, 4, 3).all(axis=2)
+
+        for l in range(4):
+            ok = reached[:, l]
+
+            if not ok.all():
+                leg = legs[l]
+                logger.error('Leg {} is unable to reach {} of {} points'.format(leg.index, steps - ok.sum(), steps))
+
+                # Hold the last reachable target. Before any, hold the current target.
+                held = np.maximum.accumulate(np.where(ok, np.arange(steps), -1))
+                columns = targets[held, 3 * l:3 * l + 3]
+
+                if hold is None:
+                    columns[held < 0] = bank.target[index[3 * l:3 * l + 3]]
+                else:
+                    columns[held < 0] = hold[3 * l:3 * l + 3]
+
+                targets[:, 3 * l:3 * l + 3] = columns
+
+        if mask:
+            return targets, reached
+
+        return targets
+
+    def solve(self, frames):
+        """
+        Solve the inverse kinematics of every leg in every frame at once.
+        :param frames: An array of frames (steps x 4 x 3).
+        :return: (angles, valid) where angles is (steps x 4 x 3) and valid is (steps x 4).
+        """
+
+        # Get all legs for quick access.
+        legs = self.robot.legs
 
         # Allocate memory.
+        frames = np.asarray(frames, dtype=float)
         angles = np.empty(frames.shape)
+        valid = np.empty(frames.shape[:-1], dtype=bool)
+
+        for l in range(4):
+            angles[:, l], valid[:, l] = legs[l].get_angles_batch(frames[:, l])
+
+        return angles, valid
+
+    def target_frame(self, frame, angles, valid):
+        """
+        Target all legs to a frame that has already been solved by solve().
+        :param frame: The frame (4 x 3).
+        :param angles: The solved angles (4 x 3).
+        :param valid: The validity mask (4).
+        """
+
+        # Get all legs for quick access.
+        legs = self.robot.legs
 
-        for i in range(len(frames)):
-            for l in range(4):
-                a = legs[l].get_angles(frames[i][l])
-                angles[i][l] = a
+        for i in range(4):
+            legs[i].target_solved(frame[i], angles[i], valid[i])
+
+    def anglify(self, frames):
+        """
+        Converts frames generated by self.prepare to angles.
+        :param frames: The input frames.
+        :return: The output angles ready for execution.
+        """
+
+        angles, valid = self.solve(frames)
+
+        if not valid.all():
+            raise ValueError('Frames contain unreachable points.')
 
         return angles
 
@@ -1266,7 +2181,7 @@ class Agility:
         # Compute times. Assume equal dt.
         dt = t / len(frames)
 
-        self.execute_long(pose, frames, dt)
+        self.execute_trajectory(frames, dt)
 
     def prepare_frames(self, frames, dt, ground):
         """
@@ -1281,29 +2196,14 @@ class Agility:
         # Define body for quick access.
         body = self.robot.body
 
-        # Create array for biases.
-        biases = np.empty(frames.shape)
-
         # Generate leg state arrays.
         state1 = np.greater(frames[:, :, 2], (ground + self.epsilon))       # Defines which legs are in the air.
-        state2 = state1.sum(1)                                              # The number of legs in the air.
-
-        # Define.
-        steps = len(frames)
-
-        for t in range(steps - 1):
-            # Look ahead and pass data to center of mass adjustment algorithms.
-            next_frame = frames[t]
 
-            # Determine which legs are off.
-            off = state1[t]
-            count = state2[t]
-
-            # Perform center of mass adjustments accordingly.
-            biases[t] = body.adjust(off, next_frame, count)
+        # Perform center of mass adjustments for all frames at once.
+        biases = body.adjust_batch(state1, frames)
 
         # Adjust frames.
-        frames -= biases
+        frames -= biases[:, np.newaxis]
 
         return frames, dt
 
@@ -1327,38 +2227,22 @@ class Agility:
         # Get all legs for quick access.
         legs = self.robot.legs
 
-        # Compute shape.
-        shape = (steps, 4, 3)
-
         # Evaluate gait.
-        f = [gait.evaluate(leg, ts) for leg in legs]
-        frames = np.concatenate(f).reshape(shape, order='F')
+        frames = gait.evaluate_all(legs, ts)
 
         # Debugging.
         if debug:
             self.plot_gait(frames)
 
-        # Create array for biases.
-        biases = np.empty(shape)
-
         # Generate leg state arrays.
-        state1 = np.greater(biases[:, :, 2], (ground + 1e-6))     # Defines which legs are in the air.
-        state2 = state1.sum(1)                                      # The number of legs in the air.
+        state1 = np.greater(frames[:, :, 2], (ground + 1e-6))     # Defines which legs are in the air.
 
-        # Iterate and perform static analysis.
-        for t in range(steps):
-            # Look ahead and pass data to center of mass adjustment algorithms.
-            next_frame = frames[(t + 1) % steps]
-
-            # Determine which legs are off.
-            off = state1[t]
-            count = state2[t]
-
-            # Perform center of mass adjustments accordingly.
-            biases[t] = body.adjust(off, next_frame, count)
+        # Look ahead and perform static analysis on all frames at once.
+        next_frames = np.roll(frames, -1, axis=0)
+        biases = body.adjust_batch(state1, next_frames)
 
         # Adjust frames.
-        frames -= biases
+        frames -= biases[:, np.newaxis]
 
         return frames, dt
 
@@ -1382,12 +2266,8 @@ class Agility:
         # Get all legs for quick access.
         legs = self.robot.legs
 
-        # Compute shape.
-        shape = (steps, 4, 3)
-
         # Evaluate gait.
-        f = [gait.evaluate(leg, ts) for leg in legs]
-        frames = np.concatenate(f).reshape(shape, order='F')
+        frames = gait.evaluate_all(legs, ts)
 
         # Generate leg state arrays.
         state1 = np.greater(frames[:, :, 2], (ground + 1e-6))  # Defines which legs are in the air.
@@ -1397,8 +2277,9 @@ class Agility:
         air = np.where(state2 != 0)[0]
         air = air.tolist()
 
-        # Create array for biases.
-        biases = np.empty(shape)
+        # Compute biases as usual for every frame at once. Only frames in the air are kept.
+        next_frames = np.roll(frames, -1, axis=0)
+        biases = body.adjust_batch(state1, next_frames)
 
         # Keep track of last air -> ground.
         t = air[-1]
@@ -1409,18 +2290,11 @@ class Agility:
             # There will
             last_ag = None
 
-        # Compute biases for each frame that is not on the ground.
+        # Smooth biases between frames that are in the air.
         for i in range(len(air)):
             # Get the index relative to all frames.
             t = air[i]
 
-            # Compute bias as usual.
-            next_frame = frames[(t + 1) % steps]
-            off = state1[t]
-            count = state2[t]
-
-            biases[t] = body.adjust(off, next_frame, count)
-
             # Checks if the current frame represents a ground -> air transition.
             if state2[t - 1] == 0:
                 curr_bias = biases[t]
@@ -1442,7 +2316,7 @@ class Agility:
                 last_ag = t
 
         # Adjust frames.
-        frames -= biases
+        frames -= biases[:, np.newaxis]
 
         return frames, dt
 
@@ -1458,7 +2332,7 @@ class Agility:
         legs = self.robot.legs
         servos = self.robot.leg_servos
 
-        self.maestro.get_multiple_positions(servos)
+        self.update(servos)
 
         for leg in legs:
             a, b, c = leg.get_position()
@@ -1467,7 +2341,7 @@ class Agility:
             c -= z
             leg.target_point((-x, -y, -leg.length - z))
 
-        self.maestro.end_together(servos, t)
+        self.maestro.end_ramped(servos, t)
         self.wait(servos)
 
     def configure(self):
@@ -1497,8 +2371,9 @@ class Agility:
             channel.minimum = (servo.min_pwm // 64) * 64
             channel.maximum = -(-servo.max_pwm // 64) * 64
 
-        self.usc.setUscSettings(settings, False)
-        self.usc.reinitialize(500)
+        # Only changed parameters are written. Nothing to apply if none changed.
+        if self.usc.setUscSettings(settings, False):
+            self.usc.reinitialize(500)
 
     def go_home(self):
         """
@@ -1560,14 +2435,18 @@ class Agility:
         if servos is None:
             return not self.maestro.get_moving_state()
         elif isinstance(servos, Servo):
-            self.maestro.get_position(servos)
+            self.update(servos)
 
             if servos.at_target():
                 return True
 
             return False
         else:
-            self.maestro.get_multiple_positions(servos)
+            self.update(servos)
+            bank, index = Maestro.get_bank(servos)
+
+            if bank is not None:
+                return bool(bank.at_target(index).all())
 
             if all(servo.at_target() for servo in servos):
                 return True
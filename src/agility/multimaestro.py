@@ -0,0 +1,248 @@
+from agility.maestro import Maestro
+from concurrent.futures import Future
+from threading import Thread
+from queue import Queue
+import numpy as np
+import logging
+
+logger = logging.getLogger('universe')
+
+
+class MultiMaestro(Maestro):
+    """
+    Several Maestros behind the interface of one, so that a robot can have more channels than one controller
+    and frames are not limited by the bandwidth of one port.
+
+    Every servo channel maps to (controller, channel). Each write or request is split by controller and each part is
+    sent by a thread per port, so all controllers receive a batch, such as the speeds and targets of
+    end_together(), at the same time. Commands to the same controller keep their order.
+
+    Going home, stopping scripts and reading moving state and errors apply to all controllers.
+    Scripts and PWM only run on the first controller.
+
+    This implementation is thread-safe.
+    """
+
+    # Number of data bytes following each fixed-length command.
+    lengths = {
+        0x84: 3,
+        0x87: 3,
+        0x89: 3,
+        0x8A: 4,
+        0x90: 1,
+        0x93: 0,
+        0xA1: 0,
+        0xA2: 0,
+        0xA4: 0,
+        0xA7: 1,
+        0xA8: 3,
+        0xAE: 0
+    }
+
+    # Reply sizes of requests.
+    replies = {
+        0x90: 2,
+        0x93: 1,
+        0xA1: 2,
+        0xAE: 1
+    }
+
+    # Commands that take a channel as their first data byte.
+    channel_commands = (0x84, 0x87, 0x89, 0x90)
+
+    # Commands sent to every controller.
+    broadcast_commands = (0x93, 0xA1, 0xA2, 0xA4)
+
+    def __init__(self, controllers, mapping=None, channels=24, history=1000):
+        """
+        :param controllers: A list of Maestro objects, one per controller.
+        :param mapping: A dictionary of channel to (controller index, channel).
+                        If None, controller i has channels i * channels to (i + 1) * channels - 1.
+        :param channels: The number of channels per controller when mapping is None.
+        :param history: The number of writes to keep byte counts for.
+        """
+
+        self.controllers = controllers
+
+        if mapping is None:
+            mapping = {i * channels + c: (i, c) for i in range(len(controllers)) for c in range(channels)}
+
+        self.mapping = mapping
+
+        # One queue and thread per port.
+        self.queues = [Queue() for controller in controllers]
+        self.threads = [Thread(target=self._run, args=(controller, queue), daemon=True)
+                        for controller, queue in zip(controllers, self.queues)]
+
+        for thread in self.threads:
+            thread.start()
+
+        super().__init__(history=history)
+
+    def connect(self, port, baud):
+        # Controllers have their own ports.
+        return None
+
+    def _run(self, controller, queue):
+        while True:
+            item = queue.get()
+
+            if item is None:
+                return
+
+            data, size, future = item
+
+            try:
+                if future is None:
+                    controller.write(data)
+                else:
+                    future.set_result(controller.query(data, size))
+            except Exception as e:
+                if future is None:
+                    logger.error('Write to Maestro at {} failed: {}'.format(controller.port, e))
+                else:
+                    future.set_exception(e)
+
+    def split(self, data):
+        """
+        Split a command stream into commands for each controller, with channels mapped.
+        :param data: Commands in the compact protocol.
+        :return: A list of (command byte, [(controller index, data)]) in order.
+        """
+
+        data = bytes(data)
+        commands = []
+        i = 0
+
+        while i < len(data):
+            command = data[i]
+
+            if command == 0x9F:
+                count, first = data[i + 1], data[i + 2]
+                end = i + 3 + 2 * count
+                words = data[i + 3:end]
+            elif command in self.lengths:
+                end = i + 1 + self.lengths[command]
+            else:
+                raise ValueError('Unknown Maestro command 0x{:02X}.'.format(command))
+
+            if end > len(data):
+                raise ValueError('Truncated Maestro command 0x{:02X}.'.format(command))
+
+            if command == 0x9F:
+                # Targets may spread over controllers and are no longer consecutive.
+                groups = {}
+
+                for j in range(count):
+                    index, channel = self.mapping[first + j]
+                    target = words[2 * j] | (words[2 * j + 1] << 7)
+                    groups.setdefault(index, ([], []))
+                    groups[index][0].append(channel)
+                    groups[index][1].append(target)
+
+                parts = [(index, Maestro.encode_targets(np.array(channels), np.array(targets)).tobytes())
+                         for index, (channels, targets) in groups.items()]
+            elif command in self.channel_commands:
+                index, channel = self.mapping[data[i + 1]]
+                parts = [(index, bytes((command, channel)) + data[i + 2:end])]
+            elif command in self.broadcast_commands:
+                parts = [(index, data[i:end]) for index in range(len(self.controllers))]
+            else:
+                parts = [(0, data[i:end])]
+
+            commands.append((command, parts))
+            i = end
+
+        return commands
+
+    def write(self, buffer):
+        """
+        Send data to the controllers. Returns immediately.
+        :param buffer: The data to send.
+        """
+
+        batches = {}
+
+        for command, parts in self.split(buffer):
+            for index, data in parts:
+                batches.setdefault(index, bytearray()).extend(data)
+
+        for index, data in batches.items():
+            self.queues[index].put((bytes(data), 0, None))
+
+        self.tick_bytes.append(len(buffer))
+
+        if self.recorder is not None:
+            self.recorder.write(buffer)
+
+    def query(self, data, size):
+        """
+        Send requests to the controllers at the same time and combine their replies in request order.
+        :param data: The request.
+        :param size: The size of the reply in bytes.
+        :return: The reply.
+        """
+
+        commands = self.split(data)
+        requests = {}
+
+        for command, parts in commands:
+            for index, part in parts:
+                request = requests.setdefault(index, [bytearray(), 0])
+                request[0].extend(part)
+                request[1] += self.replies.get(command, 0)
+
+        futures = {}
+
+        for index, (request, expected) in requests.items():
+            future = Future() if expected > 0 else None
+            self.queues[index].put((bytes(request), expected, future))
+            futures[index] = future
+
+        replies = {index: future.result() for index, future in futures.items() if future is not None}
+        offsets = dict.fromkeys(replies, 0)
+
+        reply = bytearray()
+
+        for command, parts in commands:
+            length = self.replies.get(command, 0)
+
+            if length == 0:
+                continue
+
+            values = []
+
+            for index, part in parts:
+                offset = offsets[index]
+                values.append(replies[index][offset:offset + length])
+                offsets[index] += length
+
+            if command == 0x93:
+                reply.extend(b'\x01' if any(value != b'\x00' for value in values) else b'\x00')
+            elif command == 0xA1:
+                errors = 0
+                for value in values:
+                    errors |= int.from_bytes(value, 'little')
+                reply.extend(errors.to_bytes(2, 'little'))
+            else:
+                reply.extend(values[0])
+
+        if self.recorder is not None:
+            self.recorder.request(data)
+            self.recorder.reply(bytes(reply))
+
+        return bytes(reply)
+
+    def close(self):
+        """
+        Stop the port threads and close every controller.
+        """
+
+        self.stepper_executor.shutdown(wait=True)
+
+        for queue in self.queues:
+            queue.put(None)
+
+        for thread, controller in zip(self.threads, self.controllers):
+            thread.join()
+            controller.close()
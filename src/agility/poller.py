@@ -0,0 +1,261 @@
+from threading import Thread, Condition, Event
+import numpy as np
+import logging
+import time
+
+logger = logging.getLogger('universe')
+
+
+class Poller:
+    """
+    Reads the positions of every servo in a ServoBank with one batched request at a fixed rate, and at once
+    whenever a consumer asks for a fresh sample with sample().
+    The rate is low while every servo is at its target and high while any is moving, so consumers such as wait()
+    find a recent sample without touching the port and an idle robot sends little traffic.
+    Samples of (timestamp, pwm) go into a preallocated ring buffer and the bank is kept up to date.
+
+    Timestamps are from time.monotonic(), taken halfway between sending the request and receiving the reply.
+
+    This implementation is thread-safe.
+    """
+
+    def __init__(self, maestro, bank, rate=10, fast_rate=200, size=1024):
+        """
+        :param maestro: A Maestro object.
+        :param bank: A ServoBank with the servos to poll.
+        :param rate: Samples per second while every servo is at its target. 0 to only sample on demand.
+        :param fast_rate: Samples per second while any servo is moving.
+        :param size: The number of samples to keep.
+        """
+
+        self.maestro = maestro
+        self.bank = bank
+        self.rate = rate
+        self.fast_rate = fast_rate
+        self.size = size
+
+        # One batched request for all channels.
+        channels = bank.channel.tolist()
+        self.request = bytes(b for channel in channels for b in (0x90, channel))
+        self.reply_size = 2 * len(channels)
+
+        # Ring buffer. Sample i is at i % size.
+        self.times = np.zeros(size)
+        self.requested = np.zeros(size)
+        self.positions = np.zeros((size, len(channels)), dtype=int)
+        self.count = 0
+
+        self.condition = Condition()
+        self.stop_event = Event()
+        self.wake = Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Start polling on a background thread.
+        """
+
+        if self.is_alive():
+            return
+
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop polling and wait for the thread to exit.
+        """
+
+        self.stop_event.set()
+        self.wake.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def get_period(self):
+        """
+        Get the time between background samples, which depends on whether any servo is moving.
+        :return: The period in seconds, or None if only sampling on demand.
+        """
+
+        if self.is_moving():
+            return 1 / self.fast_rate
+
+        return 1 / self.rate if self.rate > 0 else None
+
+    def is_moving(self, index=None):
+        """
+        Checks if servos are away from their targets according to the latest sample.
+        :param index: Indices of servos in the bank. None for all.
+        :return: True if any is moving, else False.
+        """
+
+        if index is None:
+            return bool(np.any(self.bank.pwm != self.bank.target))
+
+        return bool(np.any(self.bank.pwm[index] != self.bank.target[index]))
+
+    def get_age(self):
+        """
+        Get the age of the latest sample.
+        :return: The age in seconds, or None if there are no samples yet.
+        """
+
+        with self.condition:
+            if self.count == 0:
+                return None
+
+            return time.monotonic() - self.requested[(self.count - 1) % self.size]
+
+    def _run(self):
+        deadline = time.monotonic()
+
+        while not self.stop_event.is_set():
+            # Requests that arrive during a poll need the next one.
+            self.wake.clear()
+
+            try:
+                self.poll()
+            except TimeoutError as e:
+                # A lost reply. The Maestro resyncs, so keep going.
+                logger.warning('Servo poller missed a sample: {}'.format(e))
+            except Exception as e:
+                logger.error('Servo poller stopped: {}'.format(e))
+                return
+
+            period = self.get_period()
+
+            if period is None:
+                self.wake.wait()
+                continue
+
+            deadline += period
+            remaining = deadline - time.monotonic()
+
+            if remaining > 0:
+                # Poll early if someone asks for a sample.
+                if self.wake.wait(remaining):
+                    deadline = time.monotonic()
+            else:
+                # Fell behind. Do not try to catch up.
+                deadline = time.monotonic()
+
+    def poll(self):
+        """
+        Take one sample now.
+        """
+
+        requested = time.monotonic()
+        reply = self.maestro.query(self.request, self.reply_size)
+        received = time.monotonic()
+
+        pwm = np.frombuffer(reply, dtype='<u2', count=self.reply_size // 2)
+
+        with self.condition:
+            i = self.count % self.size
+            self.times[i] = (requested + received) / 2
+            self.requested[i] = requested
+            self.positions[i] = pwm
+            self.count += 1
+
+            self.bank.pwm[:] = pwm
+            self.condition.notify_all()
+
+    def latest(self):
+        """
+        Get the latest sample.
+        :return: (timestamp, pwm), or None if there are no samples yet.
+        """
+
+        with self.condition:
+            if self.count == 0:
+                return None
+
+            i = (self.count - 1) % self.size
+            return self.times[i], self.positions[i].copy()
+
+    def history(self, n=None, window=None):
+        """
+        Get recent samples, oldest first.
+        :param n: The maximum number of samples.
+        :param window: Only samples from the last window seconds, relative to the latest sample.
+        :return: (timestamps, pwm) where pwm is (samples x channels).
+        """
+
+        with self.condition:
+            available = min(self.count, self.size)
+
+            if n is not None:
+                available = min(available, n)
+
+            index = np.arange(self.count - available, self.count) % self.size
+            times = self.times[index]
+            positions = self.positions[index]
+
+        if window is not None and len(times) > 0:
+            keep = times >= times[-1] - window
+            times, positions = times[keep], positions[keep]
+
+        return times, positions
+
+    def wait_for(self, t, timeout=None):
+        """
+        Block until a sample requested at or after a given time is available.
+        Use time.monotonic() to wait for positions newer than anything sent so far.
+        :param t: A time given by time.monotonic().
+        :param timeout: The maximum time to wait in seconds.
+        :return: True if such a sample is available, False on timeout or if the poller is not running.
+        """
+
+        def fresh():
+            return self.count > 0 and self.requested[(self.count - 1) % self.size] >= t
+
+        end = None if timeout is None else time.monotonic() + timeout
+
+        with self.condition:
+            while not fresh():
+                if not self.is_alive():
+                    return False
+
+                # Wake up periodically in case the poller stops.
+                remaining = 0.05 if end is None else min(0.05, end - time.monotonic())
+
+                if remaining <= 0:
+                    return False
+
+                self.condition.wait(remaining)
+
+        return True
+
+    def sample(self, timeout=None):
+        """
+        Take a sample as soon as possible and wait for it. Costs one round trip instead of waiting for the next
+        scheduled sample.
+        :param timeout: The maximum time to wait in seconds.
+        :return: True if a sample requested after this call is available, False on timeout or if the poller is not
+        running.
+        """
+
+        t = time.monotonic()
+        self.wake.set()
+
+        return self.wait_for(t, timeout)
+
+    def get_velocity(self, window=0.05):
+        """
+        Estimate the velocity of every channel from recent samples.
+        :param window: The time span in seconds to estimate over.
+        :return: Velocity in 0.25 us / s for every channel, or None if there are too few samples.
+        """
+
+        times, positions = self.history(window=window)
+
+        if len(times) < 2 or times[-1] == times[0]:
+            return None
+
+        return (positions[-1] - positions[0]) / (times[-1] - times[0])
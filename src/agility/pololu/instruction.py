@@ -58,6 +58,22 @@ class BytecodeInstruction:
 
         return list
 
+    # Same as len(self.toByteList()), without building the list.
+    def size(self):
+        if self.isLabel or self.isSubroutine:
+            return 0
+
+        if self.opcode == Opcode.LITERAL or self.opcode == Opcode.JUMP or (self.opcode == Opcode.JUMP_Z or self.opcode == Opcode.CALL):
+            return 3
+        elif self.opcode == Opcode.LITERAL8:
+            return 2
+        elif self.opcode == Opcode.LITERAL_N:
+            return 2 + 2 * len(self.literalArguments)
+        elif self.opcode == Opcode.LITERAL8_N:
+            return 2 + len(self.literalArguments)
+        else:
+            return 1
+
     def error(self, msg):
         raise Exception('%s:%s:%s:%s' % (self.filename, self.lineNumber, self.columnNumber, msg))
 
@@ -0,0 +1,91 @@
+import struct
+from agility.pololu.enumeration import uscRequest, uscParameter
+
+
+class MockDevice:
+    """
+    An in-memory stand-in for the Maestro's USB device, for use with Usc(dev=MockDevice()).
+    Parameters and script memory are kept in memory and every control transfer is counted.
+    """
+
+    productIDs = {6: 0x0089, 12: 0x008a, 18: 0x008b, 24: 0x008c}
+
+    def __init__(self, servoCount=18, serialNumber='00000000', firmwareVersion=(1, 4)):
+        self.idProduct = self.productIDs[servoCount]
+        self.serial_number = serialNumber
+        self.firmwareVersion = firmwareVersion
+
+        # Parameters are stored little endian at their address.
+        # Script memory is followed by the subroutine table.
+        self.parameters = bytearray(256)
+        self.script = bytearray((0xFF,) * (8192 + 256))
+
+        self.transfers = 0
+        self.reads = 0
+        self.writes = 0
+        self.erases = 0
+        self.reinitializations = 0
+
+        self.reset()
+
+    def reset(self):
+        """
+        Load default parameters, like a factory reset.
+        """
+
+        self.parameters[:] = bytes(256)
+
+        self.setParameter(uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER, 12, 1)
+        self.setParameter(uscParameter.PARAMETER_SCRIPT_DONE, 1, 1)
+        self.setParameter(uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L, 80000 & 0xFF, 1)
+        self.setParameter(uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU, 80000 >> 8, 2)
+
+        for i in range(24):
+            offset = i * 9
+            self.setParameter(uscParameter.PARAMETER_SERVO0_MIN + offset, 3968 // 64, 1)
+            self.setParameter(uscParameter.PARAMETER_SERVO0_MAX + offset, 8000 // 64, 1)
+            self.setParameter(uscParameter.PARAMETER_SERVO0_NEUTRAL + offset, 6000, 2)
+            self.setParameter(uscParameter.PARAMETER_SERVO0_RANGE + offset, 1905 // 127, 1)
+
+    def getParameter(self, parameter, numBytes):
+        if numBytes == 1:
+            return self.parameters[parameter]
+        else:
+            return struct.unpack_from('<H', self.parameters, parameter)[0]
+
+    def setParameter(self, parameter, value, numBytes):
+        if numBytes == 1:
+            self.parameters[parameter] = value & 0xFF
+        else:
+            struct.pack_into('<H', self.parameters, parameter, value & 0xFFFF)
+
+    def ctrl_transfer(self, requestType, request, value=0, index=0, data=None):
+        self.transfers += 1
+
+        # Device descriptor with the firmware version in BCD.
+        if requestType == 0x80 and request == 6:
+            descriptor = bytearray(18)
+            major, minor = self.firmwareVersion
+            descriptor[12] = (minor // 10) << 4 | minor % 10
+            descriptor[13] = (major // 10) << 4 | major % 10
+            return descriptor
+
+        if request == uscRequest.REQUEST_GET_PARAMETER:
+            self.reads += 1
+            return bytes(self.parameters[index:index + data])
+        elif request == uscRequest.REQUEST_SET_PARAMETER:
+            self.writes += 1
+            self.setParameter(index & 0xFF, value, index >> 8)
+        elif request == uscRequest.REQUEST_ERASE_SCRIPT:
+            self.erases += 1
+            self.script[:] = bytes((0xFF,) * len(self.script))
+        elif request == uscRequest.REQUEST_WRITE_SCRIPT:
+            self.writes += 1
+            self.script[index * 16:index * 16 + len(data)] = data
+        elif request == uscRequest.REQUEST_REINITIALIZE:
+            self.reinitializations += 1
+
+        return None
+
+    def close(self):
+        pass
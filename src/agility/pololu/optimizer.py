@@ -0,0 +1,320 @@
+from agility.pololu.enumeration import Opcode
+from agility.pololu.instruction import BytecodeInstruction
+
+
+def toSigned(value):
+    value &= 0xFFFF
+    return value - 0x10000 if value >= 0x8000 else value
+
+
+def truncatedDivide(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+class BytecodeOptimizer:
+    """
+    A peephole optimizer for parsed Maestro scripts. Runs after parsing and before literals, calls and jumps are
+    completed, so that labels are still names and literals are still plain lists.
+
+    Passes:
+    - Fold operations on literals and merge consecutive literal pushes.
+    - Remove unreachable code after QUIT, RETURN and unconditional jumps.
+    - Thread jumps to unconditional jumps and remove jumps to the next instruction.
+    - Hoist the literals of consecutive commands into one push, such as "1 0 servo 2 1 servo" to "2 1 1 0 servo servo".
+      This deepens the stack by at most maxHoist values less those of one command.
+
+    The Maestro's stack holds signed 16 bit values, which folding respects.
+    """
+
+    # Operations on the top of the stack. Values are signed.
+    UNARY = {
+        Opcode.BITWISE_NOT: lambda a: ~a,
+        Opcode.LOGICAL_NOT: lambda a: int(a == 0),
+        Opcode.NEGATE: lambda a: -a,
+        Opcode.POSITIVE: lambda a: int(a > 0),
+        Opcode.NEGATIVE: lambda a: int(a < 0),
+        Opcode.NONZERO: lambda a: int(a != 0)
+    }
+
+    BINARY = {
+        Opcode.BITWISE_AND: lambda a, b: a & b,
+        Opcode.BITWISE_OR: lambda a, b: a | b,
+        Opcode.BITWISE_XOR: lambda a, b: a ^ b,
+        Opcode.SHIFT_LEFT: lambda a, b: a << b if 0 <= b < 16 else None,
+        Opcode.LOGICAL_AND: lambda a, b: int(a != 0 and b != 0),
+        Opcode.LOGICAL_OR: lambda a, b: int(a != 0 or b != 0),
+        Opcode.PLUS: lambda a, b: a + b,
+        Opcode.MINUS: lambda a, b: a - b,
+        Opcode.TIMES: lambda a, b: a * b,
+        Opcode.DIVIDE: lambda a, b: truncatedDivide(a, b) if b != 0 else None,
+        Opcode.MOD: lambda a, b: a - truncatedDivide(a, b) * b if b != 0 else None,
+        Opcode.EQUALS: lambda a, b: int(a == b),
+        Opcode.NOT_EQUALS: lambda a, b: int(a != b),
+        Opcode.MIN: lambda a, b: min(a, b),
+        Opcode.MAX: lambda a, b: max(a, b),
+        Opcode.LESS_THAN: lambda a, b: int(a < b),
+        Opcode.GREATER_THAN: lambda a, b: int(a > b)
+    }
+
+    # Commands that only consume a fixed number of values and push nothing.
+    CONSUMERS = {
+        Opcode.DELAY: 1,
+        Opcode.DROP: 1,
+        Opcode.SERVO: 2,
+        Opcode.SERVO_8BIT: 2,
+        Opcode.SPEED: 2,
+        Opcode.ACCELERATION: 2,
+        Opcode.PWM: 2,
+        Opcode.SERIAL_SEND_BYTE: 1
+    }
+
+    def __init__(self, isMiniMaestro):
+        self.isMiniMaestro = isMiniMaestro
+        self.maxLiterals = 126 if isMiniMaestro else 32
+
+        # Hoisting leaves values on the stack for later commands, on top of whatever the script already keeps there.
+        # Keep the extra depth to a quarter of the stack, which holds 126 values on the Mini Maestro and 32 on the
+        # Micro Maestro.
+        self.maxHoist = 32 if isMiniMaestro else 8
+
+    @staticmethod
+    def isLiteral(instruction):
+        return instruction.opcode == Opcode.LITERAL
+
+    @staticmethod
+    def isMarker(instruction):
+        return bool(instruction.isLabel or instruction.isSubroutine)
+
+    @staticmethod
+    def isJump(instruction):
+        return bool(instruction.isJumpToLabel) and instruction.opcode == Opcode.JUMP
+
+    @staticmethod
+    def isEnd(instruction):
+        if BytecodeOptimizer.isMarker(instruction) or instruction.isCall:
+            return False
+
+        return instruction.opcode in (Opcode.QUIT, Opcode.RETURN) or BytecodeOptimizer.isJump(instruction)
+
+    @staticmethod
+    def size(instruction):
+        if BytecodeOptimizer.isMarker(instruction):
+            return 0
+
+        if BytecodeOptimizer.isLiteral(instruction):
+            arguments = instruction.literalArguments
+            wide = any(value > 255 for value in arguments)
+
+            if len(arguments) == 1:
+                return 3 if wide else 2
+            else:
+                return 2 + len(arguments) * (2 if wide else 1)
+
+        return instruction.size()
+
+    @staticmethod
+    def measure(instructions):
+        """
+        Get the size in bytes and the number of executable instructions.
+        Each instruction takes about the same time to dispatch on the Maestro, so fewer instructions run faster.
+        """
+
+        size = sum(BytecodeOptimizer.size(instruction) for instruction in instructions)
+        count = sum(1 for instruction in instructions if not BytecodeOptimizer.isMarker(instruction))
+
+        return size, count
+
+    @staticmethod
+    def newLiteral(arguments, instruction):
+        literal = BytecodeInstruction(Opcode.LITERAL, instruction.filename, instruction.lineNumber,
+                                      instruction.columnNumber)
+        literal.literalArguments = list(arguments)
+        return literal
+
+    def optimize(self, program):
+        """
+        Optimize a program in place.
+        :param program: A BytecodeProgram that has been parsed but not completed.
+        :return: A report of (size, instructions) before and after.
+        """
+
+        instructions = program.instructionList
+        before = self.measure(instructions)
+
+        instructions = self.fold(instructions)
+
+        while True:
+            previous = len(instructions)
+            instructions = self.removeDeadCode(instructions)
+            instructions = self.threadJumps(instructions)
+
+            if len(instructions) == previous:
+                break
+
+        instructions = self.fold(instructions)
+        instructions = self.hoist(instructions)
+
+        program.instructionList = instructions
+        program.labelIndices = {}
+
+        for index, instruction in enumerate(instructions):
+            if instruction.isLabel and instruction.labelName not in program.labelIndices:
+                program.labelIndices[instruction.labelName] = index
+
+        after = self.measure(instructions)
+
+        return {
+            'size_before': before[0],
+            'size_after': after[0],
+            'instructions_before': before[1],
+            'instructions_after': after[1]
+        }
+
+    def fold(self, instructions):
+        output = []
+
+        for instruction in instructions:
+            top = output[-1] if output and self.isLiteral(output[-1]) else None
+
+            if self.isLiteral(instruction):
+                if top is not None and len(top.literalArguments) + len(instruction.literalArguments) <= self.maxLiterals:
+                    top.literalArguments.extend(instruction.literalArguments)
+                else:
+                    output.append(self.newLiteral(instruction.literalArguments, instruction))
+                continue
+
+            if top is not None and not instruction.isCall and not self.isMarker(instruction):
+                arguments = top.literalArguments
+                opcode = instruction.opcode
+                result = None
+
+                if opcode in self.UNARY and len(arguments) >= 1:
+                    result = [self.UNARY[opcode](toSigned(arguments[-1]))]
+                    consumed = 1
+                elif opcode in self.BINARY and len(arguments) >= 2:
+                    value = self.BINARY[opcode](toSigned(arguments[-2]), toSigned(arguments[-1]))
+                    result = None if value is None else [value]
+                    consumed = 2
+                elif opcode == Opcode.DROP and len(arguments) >= 1:
+                    result, consumed = [], 1
+                elif opcode == Opcode.DUP and len(arguments) >= 1 and len(arguments) < self.maxLiterals:
+                    result, consumed = [arguments[-1]] * 2, 1
+                elif opcode == Opcode.SWAP and len(arguments) >= 2:
+                    result, consumed = [arguments[-1], arguments[-2]], 2
+                elif opcode == Opcode.OVER and len(arguments) >= 2 and len(arguments) < self.maxLiterals:
+                    result, consumed = [arguments[-2], arguments[-1], arguments[-2]], 2
+
+                if result is not None:
+                    del arguments[len(arguments) - consumed:]
+                    arguments.extend(value & 0xFFFF for value in result)
+
+                    if len(arguments) == 0:
+                        output.pop()
+
+                    continue
+
+            output.append(instruction)
+
+        return output
+
+    def removeDeadCode(self, instructions):
+        output = []
+        reachable = True
+
+        for instruction in instructions:
+            # Labels can be jumped to and subroutines called.
+            if self.isMarker(instruction):
+                reachable = True
+
+            if reachable:
+                output.append(instruction)
+
+                if self.isEnd(instruction):
+                    reachable = False
+
+        return output
+
+    def threadJumps(self, instructions):
+        labels = {}
+
+        for index, instruction in enumerate(instructions):
+            if instruction.isLabel:
+                labels[instruction.labelName] = index
+
+        def resolve(index):
+            # The first instruction that runs after a label.
+            while index < len(instructions) and self.isMarker(instructions[index]):
+                index += 1
+            return index
+
+        output = []
+
+        for index, instruction in enumerate(instructions):
+            if instruction.isJumpToLabel and instruction.labelName in labels:
+                name = instruction.labelName
+                seen = {name}
+
+                # Follow chains of unconditional jumps.
+                while True:
+                    target = resolve(labels[name])
+
+                    if target < len(instructions) and self.isJump(instructions[target]) and \
+                            instructions[target].labelName in labels and instructions[target].labelName not in seen:
+                        name = instructions[target].labelName
+                        seen.add(name)
+                    else:
+                        break
+
+                instruction.labelName = name
+
+                # A jump to the next instruction does nothing.
+                if self.isJump(instruction) and resolve(labels[name]) == resolve(index + 1):
+                    continue
+
+            output.append(instruction)
+
+        return output
+
+    def hoist(self, instructions):
+        output = []
+        index = 0
+
+        def group(i):
+            # A literal push consumed entirely by the following command.
+            if i + 1 < len(instructions) and self.isLiteral(instructions[i]):
+                command = instructions[i + 1]
+                count = self.CONSUMERS.get(command.opcode) if not (command.isCall or self.isMarker(command)) else None
+                if count is not None and count == len(instructions[i].literalArguments):
+                    return count
+            return None
+
+        while index < len(instructions):
+            groups = []
+            total = 0
+            i = index
+
+            while True:
+                count = group(i)
+                if count is None or total + count > self.maxHoist:
+                    break
+                groups.append(i)
+                total += count
+                i += 2
+
+            if len(groups) < 2:
+                output.append(instructions[index])
+                index += 1
+                continue
+
+            # The first command must find its values on top, so pushes go in reverse.
+            arguments = []
+            for i in reversed(groups):
+                arguments.extend(instructions[i].literalArguments)
+
+            output.append(self.newLiteral(arguments, instructions[groups[0]]))
+            output.extend(instructions[i + 1] for i in groups)
+
+            index = groups[-1] + 2
+
+        return output
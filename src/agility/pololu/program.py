@@ -11,9 +11,11 @@ class BytecodeProgram:
         self.openBlockTypes = []
         self.subroutineAddresses = {}
         self.subroutineCommands = {}
-        self.CRC7_TABLE = tuple(BytecodeProgram.oneByteCRC(i) for i in range(256))
+        self.labelIndices = {}
+        self.addresses = []
+        self.optimization = None
         self.maxBlock = 0
-        
+
     def __getitem__(self, item):
         return self.instructionList[item]
 
@@ -33,6 +35,9 @@ class BytecodeProgram:
         return len(self.sourceLines)
 
     def addInstruction(self, instruction):
+        if instruction.isLabel and instruction.labelName not in self.labelIndices:
+            self.labelIndices[instruction.labelName] = len(self.instructionList)
+
         self.instructionList.append(instruction)
 
     def addLiteral(self, literal, filename, lineNumber, columnNumber, isMiniMaestro):
@@ -68,10 +73,10 @@ class BytecodeProgram:
         return 'block_end_%s' % self.maxBlock
 
     def findLabelIndex(self, name):
-        for index in range(len(self.instructionList)):
-            if self.instructionList[index].isLabel and self.instructionList[index].labelName == name:
-                return index
-        raise Exception('Label not found.')
+        try:
+            return self.labelIndices[name]
+        except KeyError:
+            raise Exception('Label not found.')
 
     def findLabelInstruction(self, name):
         return self.instructionList[self.findLabelIndex(name)]
@@ -81,16 +86,23 @@ class BytecodeProgram:
                                                          line_number, column_number))
         self.openBlockTypes.pop()
 
+    def computeAddresses(self):
+        address = 0
+        self.addresses = []
+
+        for bytecodeInstruction in self.instructionList:
+            self.addresses.append(address)
+            address += bytecodeInstruction.size()
+
+    # Must run after completeCalls(), which computes addresses. Jumps do not change size.
     def completeJumps(self):
         dictionary = {}
-        num = 0
 
-        for bytecodeInstruction in self.instructionList:
+        for bytecodeInstruction, address in zip(self.instructionList, self.addresses):
             if bytecodeInstruction.isLabel:
                 if bytecodeInstruction.labelName in dictionary:
                     bytecodeInstruction.error('The label %s has already been used.' % bytecodeInstruction.labelName)
-                dictionary[bytecodeInstruction.labelName] = num
-            num += len(bytecodeInstruction.toByteList())
+                dictionary[bytecodeInstruction.labelName] = address
 
         for bytecodeInstruction in self.instructionList:
             try:
@@ -119,12 +131,11 @@ class BytecodeProgram:
             except KeyError:
                 bytecodeInstruction.error("Did not understand '%s'." % bytecodeInstruction.labelName)
 
-        num2 = 0
+        self.computeAddresses()
 
-        for bytecodeInstruction in self.instructionList:
+        for bytecodeInstruction, address in zip(self.instructionList, self.addresses):
             if bytecodeInstruction.isSubroutine:
-                self.subroutineAddresses[bytecodeInstruction.labelName] = num2
-            num2 += len(bytecodeInstruction.toByteList())
+                self.subroutineAddresses[bytecodeInstruction.labelName] = address
 
         for bytecodeInstruction in self.instructionList:
             if bytecodeInstruction.opcode == Opcode.CALL:
@@ -148,9 +159,9 @@ class BytecodeProgram:
         message = bytearray()
         numArray = [0] * 128
 
-        for index in range(len(self.subroutineCommands)):
-            if self.subroutineCommands[index] != 54:
-                numArray[self.subroutineCommands[index] - 128] = self.subroutineAddresses[index]
+        for name, command in self.subroutineCommands.items():
+            if command != 54:
+                numArray[command - 128] = self.subroutineAddresses[name]
 
         for num in numArray:
             message.extend((num & 255, num >> 8))
@@ -175,6 +186,10 @@ class BytecodeProgram:
         num = 0
 
         for byte in message:
-            num = (num >> 8 ^ self.CRC7_TABLE[num ^ byte])
+            num = (num >> 8 ^ self.CRC7_TABLE[(num ^ byte) & 0xFF])
 
         return num
+
+
+# The table only depends on the polynomial, so it is built once.
+BytecodeProgram.CRC7_TABLE = tuple(BytecodeProgram.oneByteCRC(i) for i in range(256))
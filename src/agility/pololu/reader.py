@@ -1,12 +1,22 @@
 import re
+import hashlib
 
 from agility.pololu.program import BytecodeProgram
 from agility.pololu.enumeration import Opcode, Mode, Keyword, BlockType
 
 from agility.pololu.instruction import BytecodeInstruction
+from agility.pololu.optimizer import BytecodeOptimizer
+
+# Tokens end at whitespace or the start of a comment.
+TOKEN = re.compile(r"[^\s#]+|#")
+LITERAL = re.compile(r"-?[0-9.]+|0[xX][0-9a-fA-F.]+")
 
 
 class BytecodeReader:
+    # Parsed programs keyed by (source hash, isMiniMaestro, optimize). Programs must not be modified after reading.
+    programCache = {}
+    programCacheSize = 32
+
     def __init__(self):
         self.mode = None
 
@@ -60,41 +70,50 @@ class BytecodeReader:
 
         streamWriter.close()
 
-    def read(self, program, isMiniMaestro):
+    def read(self, program, isMiniMaestro, optimize=False):
+        if program is None:
+            program = ""
+
+        key = (hashlib.sha1(program.encode()).hexdigest(), bool(isMiniMaestro), bool(optimize))
+
+        if key not in BytecodeReader.programCache:
+            if len(BytecodeReader.programCache) >= BytecodeReader.programCacheSize:
+                del BytecodeReader.programCache[next(iter(BytecodeReader.programCache))]
+
+            BytecodeReader.programCache[key] = self.parse(program, isMiniMaestro, optimize)
+
+        return BytecodeReader.programCache[key]
+
+    # With optimize, the program's optimization attribute holds a report from BytecodeOptimizer.
+    def parse(self, program, isMiniMaestro, optimize=False):
         bytecode_program = BytecodeProgram()
         self.mode = Mode.NORMAL
 
         if program is None:
             program = ""
 
-        strArray = program.splitlines()
-
-        line_number = 1
-
-        while line_number <= len(strArray):
-            str1 = strArray[line_number - 1]
+        # Tokenize in a single pass over each line.
+        for line_number, str1 in enumerate(program.splitlines(), 1):
             bytecode_program.addSourceLine(str1)
-            column_number = 1
 
-            str2 = re.sub(r"#.*", r"", str1)
+            for match in TOKEN.finditer(str1):
+                s = match.group().upper()
+                column_number = match.start() + 1
 
-            for str3 in str2.split():
-                if str3 == '':
-                    column_number += 1
-                else:
-                    s = str3.upper()
-                    if self.mode == Mode.NORMAL:
-                        self.parseString(s, bytecode_program, 'script', line_number, column_number, isMiniMaestro)
-                    elif self.mode == Mode.GOTO:
-                        self.parseGoto(s, bytecode_program, 'script', line_number, column_number)
-                    elif self.mode == Mode.SUBROUTINE:
-                        self.parseSubroutine(s, bytecode_program, 'script', line_number, column_number)
-                    column_number += len(s) + 1
-            line_number += 1
+                if s == '#':
+                    break
+                elif self.mode == Mode.NORMAL:
+                    self.parseString(s, bytecode_program, 'script', line_number, column_number, isMiniMaestro)
+                elif self.mode == Mode.GOTO:
+                    self.parseGoto(s, bytecode_program, 'script', line_number, column_number)
+                elif self.mode == Mode.SUBROUTINE:
+                    self.parseSubroutine(s, bytecode_program, 'script', line_number, column_number)
 
         if bytecode_program.blockIsOpen():
             currentBlockStartLabel = bytecode_program.getCurrentBlockStartLabel()
             bytecode_program.findLabelInstruction(currentBlockStartLabel).error('BEGIN block was never closed.')
+        if optimize:
+            bytecode_program.optimization = BytecodeOptimizer(isMiniMaestro).optimize(bytecode_program)
         bytecode_program.completeLiterals()
         bytecode_program.completeCalls(isMiniMaestro)
         bytecode_program.completeJumps()
@@ -119,9 +138,7 @@ class BytecodeReader:
 
     @staticmethod
     def looksLikeLiteral(s):
-        if not re.match(r"^-?[0-9.]+$", s):
-            return bool(re.match(r"^0[xX][0-9a-fA-F.]+$", s))
-        return True
+        return LITERAL.fullmatch(s) is not None
 
     def parseString(self, s, bytecode_program, filename, line_number, column_number, isMiniMaestro):
         try:
@@ -141,8 +158,7 @@ class BytecodeReader:
                     if num > 65535 or num < 0:
                         raise Exception('Value %s is not in the allowed range of 0 to 65525.' % s)
 
-                literal = (num % 65535)
-                bytecode_program.addLiteral(literal, filename, line_number, column_number, isMiniMaestro)
+                bytecode_program.addLiteral(num, filename, line_number, column_number, isMiniMaestro)
                 return
         except Exception as ex:
             raise Exception('Error parsing %s: %s' % (s, ex))
@@ -152,10 +168,9 @@ class BytecodeReader:
         elif s == 'SUB':
             self.mode = Mode.SUBROUTINE
         else:
-            match = re.match(r"(.*):$", s)
-            if match:
+            if s.endswith(':'):
                 bytecode_program.addInstruction(BytecodeInstruction.newLabel(
-                    'USER_%s' % match.group(1), filename, line_number, column_number))
+                    'USER_%s' % s[:-1], filename, line_number, column_number))
             elif s == 'BEGIN':
                 bytecode_program.openBlock(BlockType.BEGIN, filename, line_number, column_number)
             elif s == 'WHILE':
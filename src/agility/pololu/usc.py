@@ -1,4 +1,4 @@
-import usb, logging, time, pickle
+import usb, logging, time, pickle, hashlib
 from agility.pololu.structure import *
 from agility.pololu.settings import UscSettings, ChannelSetting
 from agility.pololu.enumeration import uscRequest, uscParameter, Opcode, ChannelMode, HomeMode
@@ -50,8 +50,14 @@ class Usc:
     MiniMaestroStackSize = 126
     MiniMaestroCallStackSize = 126
 
-    def __init__(self):
-        self.dev = usb.core.find(idVendor=self.vendorID)
+    # Raw parameters last read from or written to each device, keyed by (serial number, firmware version).
+    parameterCache = {}
+
+    # Hash of the last program written to each device, keyed like parameterCache.
+    programCache = {}
+
+    def __init__(self, dev=None):
+        self.dev = dev if dev is not None else usb.core.find(idVendor=self.vendorID)
 
         if self.dev is None:
             raise ConnectionError('Unable to connect to Mini Maestro.')
@@ -123,7 +129,8 @@ class Usc:
         else:
             return int((self.INSTRUCTION_FREQUENCY - bps / 2) / bps)
 
-    def setSubroutines(self, subroutineAddresses, subroutineCommands):
+    @staticmethod
+    def getSubroutineData(subroutineAddresses, subroutineCommands):
         subroutineData = bytearray((0xFF,) * 256)
 
         for name, value in subroutineAddresses.items():
@@ -135,6 +142,11 @@ class Usc:
             subroutineData[2 * (bytecode - 128)] = value % 256
             subroutineData[2 * (bytecode - 128) + 1] = value >> 8
 
+        return subroutineData
+
+    def setSubroutines(self, subroutineAddresses, subroutineCommands):
+        subroutineData = self.getSubroutineData(subroutineAddresses, subroutineCommands)
+
         for block in range(16):
             block_bytes = bytearray((0x00,) * 16)
 
@@ -192,9 +204,12 @@ class Usc:
         array = self.dev.ctrl_transfer(0xC0, uscRequest.REQUEST_GET_PARAMETER, 0, parameter, parameterRange.bytes)
 
         if parameterRange.bytes == 1:
-            return int(struct.unpack('<B', array)[0])
+            value = int(struct.unpack('<B', array)[0])
         else:
-            return int(struct.unpack('<H', array)[0])
+            value = int(struct.unpack('<H', array)[0])
+
+        self.getCachedParameters()[int(parameter)] = value
+        return value
 
     @staticmethod
     def requireArgumentRange(argumentValue, minimum, maximum, argumentName):
@@ -210,6 +225,7 @@ class Usc:
     def setRawParameterNoChecks(self, parameter, value, numBytes):
         index = (numBytes << 8) + parameter
         self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_SET_PARAMETER, value, index)
+        self.getCachedParameters()[int(parameter)] = value
 
     @staticmethod
     def getRange(parameterId):
@@ -262,47 +278,104 @@ class Usc:
 
     def restoreDefaultConfiguration(self):
         self.setRawParameterNoChecks(uscParameter.PARAMETER_INITIALIZED, 0xFF, 1)
+        self.clearCachedParameters()
         self.reinitialize(1500)
 
     def setPWM(self, dutyCycle, period):
         self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_SET_PWM, dutyCycle, period)
 
-    def getUscSettings(self):
+    def getCachedParameters(self):
+        return Usc.parameterCache.setdefault((self.serialNumber, self.firmwareVersionString), {})
+
+    def clearCachedParameters(self):
+        Usc.parameterCache.pop((self.serialNumber, self.firmwareVersionString), None)
+
+    def getRawParameters(self, parameters, cached=True):
+        cache = self.getCachedParameters()
+        values = {}
+
+        for parameter in parameters:
+            if not cached or parameter not in cache:
+                self.getRawParameter(parameter)
+
+            values[parameter] = cache[parameter]
+
+        return values
+
+    def getSettingParameters(self):
+        parameters = [uscParameter.PARAMETER_SERIAL_MODE,
+                      uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE,
+                      uscParameter.PARAMETER_SERIAL_ENABLE_CRC,
+                      uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND,
+                      uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER,
+                      uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET,
+                      uscParameter.PARAMETER_SERIAL_TIMEOUT,
+                      uscParameter.PARAMETER_SCRIPT_DONE]
+
+        if not self.isMiniMaestro:
+            parameters += [uscParameter.PARAMETER_SERVOS_AVAILABLE,
+                           uscParameter.PARAMETER_SERVO_PERIOD,
+                           uscParameter.PARAMETER_IO_MASK_C,
+                           uscParameter.PARAMETER_OUTPUT_MASK_C]
+        else:
+            parameters += [uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L,
+                           uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU,
+                           uscParameter.PARAMETER_SERVO_MULTIPLIER]
+            parameters += [uscParameter.PARAMETER_CHANNEL_MODES_0_3 + i for i in range(6)]
+
+        if self.servoCount > 18:
+            parameters.append(uscParameter.PARAMETER_ENABLE_PULLUPS)
+
+        for i in range(self.servoCount):
+            parameters += [self.specifyServo(uscParameter.PARAMETER_SERVO0_HOME, i),
+                           self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i),
+                           self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i),
+                           self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i),
+                           self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i),
+                           self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i),
+                           self.specifyServo(uscParameter.PARAMETER_SERVO0_ACCELERATION, i)]
+
+        return [int(parameter) for parameter in parameters]
+
+    def getUscSettings(self, cached=True):
+        raw = self.getRawParameters(self.getSettingParameters(), cached)
+        return self.decodeSettings(raw)
+
+    def decodeSettings(self, raw):
         settings = UscSettings()
 
-        settings.serialMode = self.getRawParameter(uscParameter.PARAMETER_SERIAL_MODE)
-        settings.fixedBaudRate = self.convertSpbrgToBps(
-            self.getRawParameter(uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE))
-        settings.enableCrc = self.getRawParameter(uscParameter.PARAMETER_SERIAL_ENABLE_CRC) != 0
-        settings.neverSuspend = self.getRawParameter(uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND) != 0
-        settings.serialDeviceNumber = self.getRawParameter(uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER)
-        settings.miniSscOffset = self.getRawParameter(uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET)
-        settings.serialTimeout = self.getRawParameter(uscParameter.PARAMETER_SERIAL_TIMEOUT)
-        settings.scriptDone = self.getRawParameter(uscParameter.PARAMETER_SCRIPT_DONE) != 0
+        settings.serialMode = raw[uscParameter.PARAMETER_SERIAL_MODE]
+        settings.fixedBaudRate = self.convertSpbrgToBps(raw[uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE])
+        settings.enableCrc = raw[uscParameter.PARAMETER_SERIAL_ENABLE_CRC] != 0
+        settings.neverSuspend = raw[uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND] != 0
+        settings.serialDeviceNumber = raw[uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER]
+        settings.miniSscOffset = raw[uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET]
+        settings.serialTimeout = raw[uscParameter.PARAMETER_SERIAL_TIMEOUT]
+        settings.scriptDone = raw[uscParameter.PARAMETER_SCRIPT_DONE] != 0
 
         if not self.isMiniMaestro:
-            settings.servosAvailable = self.getRawParameter(uscParameter.PARAMETER_SERVOS_AVAILABLE)
-            settings.servoPeriod = self.getRawParameter(uscParameter.PARAMETER_SERVO_PERIOD)
+            settings.servosAvailable = raw[uscParameter.PARAMETER_SERVOS_AVAILABLE]
+            settings.servoPeriod = raw[uscParameter.PARAMETER_SERVO_PERIOD]
         else:
-            tmp = self.getRawParameter(uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU) << 8
-            tmp |= self.getRawParameter(uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L)
+            tmp = raw[uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU] << 8
+            tmp |= raw[uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L]
             settings.miniMaestroServoPeriod = tmp
 
-            settings.servoMultiplier = self.getRawParameter(uscParameter.PARAMETER_SERVO_MULTIPLIER) + 1
+            settings.servoMultiplier = raw[uscParameter.PARAMETER_SERVO_MULTIPLIER] + 1
 
         if self.servoCount > 18:
-            settings.enablePullups = self.getRawParameter(uscParameter.PARAMETER_ENABLE_PULLUPS) != 0
+            settings.enablePullups = raw[uscParameter.PARAMETER_ENABLE_PULLUPS] != 0
 
         ioMask = 0
         outputMask = 0
         channelModeBytes = []
 
         if not self.isMiniMaestro:
-            ioMask = self.getRawParameter(uscParameter.PARAMETER_IO_MASK_C)
-            outputMask = self.getRawParameter(uscParameter.PARAMETER_OUTPUT_MASK_C)
+            ioMask = raw[uscParameter.PARAMETER_IO_MASK_C]
+            outputMask = raw[uscParameter.PARAMETER_OUTPUT_MASK_C]
         else:
             for i in range(6):
-                channelModeBytes.append(self.getRawParameter(uscParameter.PARAMETER_CHANNEL_MODES_0_3 + i))
+                channelModeBytes.append(raw[uscParameter.PARAMETER_CHANNEL_MODES_0_3 + i])
 
         for i in range(self.servoCount):
             setting = ChannelSetting()
@@ -318,7 +391,7 @@ class Usc:
             else:
                 setting.mode = (channelModeBytes[i >> 2] >> ((i & 3) << 1)) & 3
 
-            home = self.getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_HOME, i))
+            home = raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_HOME, i)]
 
             if home == 0:
                 setting.homeMode = HomeMode.Off
@@ -330,38 +403,36 @@ class Usc:
                 setting.homeMode = HomeMode.Goto
                 setting.home = home
 
-            setting.minimum = 64 * self.getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i))
-            setting.maximum = 64 * self.getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i))
-            setting.neutral = self.getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i))
-            setting.range = 127 * self.getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i))
+            setting.minimum = 64 * raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i)]
+            setting.maximum = 64 * raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i)]
+            setting.neutral = raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i)]
+            setting.range = 127 * raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i)]
             setting.speed = self.exponentialSpeedToNormalSpeed(
-                self.getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i)))
-            setting.acceleration = self.getRawParameter(
-                self.specifyServo(uscParameter.PARAMETER_SERVO0_ACCELERATION, i))
+                raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i)])
+            setting.acceleration = raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_ACCELERATION, i)]
 
             settings.channelSettings.append(setting)
 
         return settings
 
-    def setUscSettings(self, settings, newScript):
-        self.setRawParameter(uscParameter.PARAMETER_SERIAL_MODE, settings.serialMode)
-        self.setRawParameter(uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE,
-                             self.convertBpsToSpbrg(settings.fixedBaudRate))
-        self.setRawParameter(uscParameter.PARAMETER_SERIAL_ENABLE_CRC, int(settings.enableCrc))
-        self.setRawParameter(uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND, int(settings.neverSuspend))
-        self.setRawParameter(uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER, settings.serialDeviceNumber)
-        self.setRawParameter(uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET, settings.miniSscOffset)
-        self.setRawParameter(uscParameter.PARAMETER_SERIAL_TIMEOUT, settings.serialTimeout)
-        self.setRawParameter(uscParameter.PARAMETER_SCRIPT_DONE, int(settings.scriptDone))
+    def encodeSettings(self, settings):
+        raw = {
+            uscParameter.PARAMETER_SERIAL_MODE: settings.serialMode,
+            uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE: self.convertBpsToSpbrg(settings.fixedBaudRate),
+            uscParameter.PARAMETER_SERIAL_ENABLE_CRC: int(settings.enableCrc),
+            uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND: int(settings.neverSuspend),
+            uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER: settings.serialDeviceNumber,
+            uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET: settings.miniSscOffset,
+            uscParameter.PARAMETER_SERIAL_TIMEOUT: settings.serialTimeout,
+            uscParameter.PARAMETER_SCRIPT_DONE: int(settings.scriptDone)
+        }
 
         if not self.isMiniMaestro:
-            self.setRawParameter(uscParameter.PARAMETER_SERVOS_AVAILABLE, settings.servosAvailable)
-            self.setRawParameter(uscParameter.PARAMETER_SERVO_PERIOD, settings.servoPeriod)
+            raw[uscParameter.PARAMETER_SERVOS_AVAILABLE] = settings.servosAvailable
+            raw[uscParameter.PARAMETER_SERVO_PERIOD] = settings.servoPeriod
         else:
-            self.setRawParameter(
-                uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L, settings.miniMaestroServoPeriod & 0xFF)
-            self.setRawParameter(
-                uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU, settings.miniMaestroServoPeriod >> 8)
+            raw[uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L] = settings.miniMaestroServoPeriod & 0xFF
+            raw[uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU] = settings.miniMaestroServoPeriod >> 8
 
             if settings.servoMultiplier < 1:
                 multiplier = 0
@@ -370,10 +441,10 @@ class Usc:
             else:
                 multiplier = settings.servoMultiplier - 1
 
-            self.setRawParameter(uscParameter.PARAMETER_SERVO_MULTIPLIER, multiplier)
+            raw[uscParameter.PARAMETER_SERVO_MULTIPLIER] = multiplier
 
         if self.servoCount > 18:
-            self.setRawParameter(uscParameter.PARAMETER_ENABLE_PULLUPS, int(settings.enablePullups))
+            raw[uscParameter.PARAMETER_ENABLE_PULLUPS] = int(settings.enablePullups)
 
         ioMask = 0
         outputMask = 0
@@ -403,18 +474,41 @@ class Usc:
             else:
                 home = setting.home
 
-            self.setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_HOME, i), home)
-            self.setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i), int(setting.minimum / 64))
-            self.setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i), int(setting.maximum / 64))
-            self.setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i), setting.neutral)
-            self.setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i), int(setting.range / 127))
-            self.setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i),
-                                 self.normalSpeedToExponentialSpeed(setting.speed))
-            self.setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_ACCELERATION, i), setting.acceleration)
+            raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_HOME, i)] = home
+            raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i)] = int(setting.minimum / 64)
+            raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i)] = int(setting.maximum / 64)
+            raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i)] = setting.neutral
+            raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i)] = int(setting.range / 127)
+            raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i)] = \
+                self.normalSpeedToExponentialSpeed(setting.speed)
+            raw[self.specifyServo(uscParameter.PARAMETER_SERVO0_ACCELERATION, i)] = setting.acceleration
+
+        # The Micro Maestro keeps channel modes in masks.
+        if not self.isMiniMaestro:
+            raw[uscParameter.PARAMETER_IO_MASK_C] = ioMask
+            raw[uscParameter.PARAMETER_OUTPUT_MASK_C] = outputMask
+        else:
+            for i in range(6):
+                raw[uscParameter.PARAMETER_CHANNEL_MODES_0_3 + i] = channelModeBytes[i]
+
+        return {int(parameter): value for parameter, value in raw.items()}
+
+    # Only writes parameters that differ from the device. Returns the number of parameters written.
+    def setUscSettings(self, settings, newScript, cached=True):
+        raw = self.encodeSettings(settings)
+        current = self.getRawParameters(raw.keys(), cached)
+        written = 0
+
+        for parameter, value in raw.items():
+            if current[parameter] != value:
+                self.setRawParameter(parameter, value)
+                written += 1
 
         if newScript:
             self.loadProgram(settings.bytecodeProgram, CRC=True)
 
+        return written
+
     def fixSettings(self, settings):
         warnings = []
 
@@ -539,7 +633,8 @@ class Usc:
         return settings
 
     # Custom function to load script. Can be called externally.
-    def loadProgram(self, program, CRC=False):
+    # The upload is skipped if the device already has the program. Returns True if the program was written.
+    def loadProgram(self, program, CRC=True, force=False):
         self.setScriptDone(1)
         byteList = program.getByteList()
 
@@ -549,11 +644,26 @@ class Usc:
         if len(byteList) < self.maxScriptLength:
             byteList.append(Opcode.QUIT)
 
+        key = (self.serialNumber, self.firmwareVersionString)
+        subroutineData = self.getSubroutineData(program.subroutineAddresses, program.subroutineCommands)
+        digest = hashlib.sha1(bytes(byteList) + bytes(subroutineData)).hexdigest()
+        crc = program.getCRC()
+
+        # The stored CRC must match. If this process wrote the device, the hash must match too.
+        if not force and CRC and Usc.programCache.get(key, digest) == digest:
+            if self.getRawParameter(uscParameter.PARAMETER_SCRIPT_CRC) == crc:
+                Usc.programCache[key] = digest
+                logger.info('Script is unchanged. Skipping upload.')
+                return False
+
         self.eraseScript()
         self.setSubroutines(program.subroutineAddresses, program.subroutineCommands)
         self.writeScript(byteList)
 
         if CRC:
-            self.setRawParameter(uscParameter.PARAMETER_SCRIPT_CRC, program.getCRC())
+            self.setRawParameter(uscParameter.PARAMETER_SCRIPT_CRC, crc)
 
+        Usc.programCache[key] = digest
         self.reinitialize(100)
+
+        return True
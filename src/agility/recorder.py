@@ -0,0 +1,231 @@
+from threading import Lock
+from collections import deque
+import numpy as np
+import struct
+import glob
+import time
+import os
+
+
+class Recorder:
+    """
+    A flight recorder for the Maestro command port.
+    Every write, request and reply is appended to a memory-mapped .npy log of fixed-size records with
+    time.monotonic() timestamps. Data longer than one record continues in the following records.
+    A new file is started once a file is full and only the newest files are kept.
+
+    Attach with maestro.recorder = Recorder(prefix).
+
+    This implementation is thread-safe.
+    """
+
+    # Record kinds.
+    WRITE = 1
+    REQUEST = 2
+    REPLY = 3
+    CONTINUED = 0x80
+
+    # Record layout.
+    header = struct.Struct('<dBB')
+    chunk = 118
+    dtype = np.dtype([('time', '<f8'), ('kind', 'u1'), ('length', 'u1'), ('data', 'u1', (118,))])
+
+    def __init__(self, prefix, size=16 * 1024 * 1024, keep=8):
+        """
+        :param prefix: Path prefix of log files. Files are named <prefix>.<number>.npy.
+        :param size: The size of each file in bytes.
+        :param keep: The number of files to keep.
+        """
+
+        self.prefix = prefix
+        self.capacity = max(1, size // self.dtype.itemsize)
+        self.keep = keep
+
+        directory = os.path.dirname(os.path.abspath(prefix))
+        os.makedirs(directory, exist_ok=True)
+
+        # Continue numbering after existing files.
+        files = self.get_files(prefix)
+        self.number = int(files[-1].rsplit('.', 2)[-2]) + 1 if files else 0
+
+        self.log = None
+        self.buffer = None
+        self.index = 0
+
+        self.lock = Lock()
+        self.open()
+
+    @staticmethod
+    def get_files(prefix):
+        """
+        Get the log files of a prefix, oldest first.
+        :param prefix: Path prefix of log files.
+        :return: A list of paths.
+        """
+
+        files = glob.glob(glob.escape(prefix) + '.*.npy')
+        return sorted(files, key=lambda file: int(file.rsplit('.', 2)[-2]))
+
+    def open(self):
+        """
+        Start a new log file and remove old ones. Must hold lock.
+        """
+
+        file = '{}.{:04d}.npy'.format(self.prefix, self.number)
+        self.number += 1
+
+        self.log = np.lib.format.open_memmap(file, mode='w+', dtype=self.dtype, shape=(self.capacity,))
+        self.buffer = self.log.view(np.uint8).data
+        self.index = 0
+
+        for file in self.get_files(self.prefix)[:-self.keep]:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Flush and close the current log file.
+        """
+
+        with self.lock:
+            if self.log is not None:
+                self.log.flush()
+                self.buffer = None
+                self.log = None
+
+    def record(self, kind, data):
+        """
+        Append data to the log.
+        :param kind: WRITE, REQUEST or REPLY.
+        :param data: The bytes.
+        """
+
+        now = time.monotonic()
+        data = bytes(data)
+        size = self.dtype.itemsize
+        offset = self.header.size
+
+        with self.lock:
+            if self.log is None:
+                return
+
+            for start in range(0, max(len(data), 1), self.chunk):
+                if self.index == self.capacity:
+                    self.log.flush()
+                    self.open()
+
+                part = data[start:start + self.chunk]
+                position = self.index * size
+
+                self.header.pack_into(self.buffer, position, now, kind | (self.CONTINUED if start else 0), len(part))
+                self.buffer[position + offset:position + offset + len(part)] = part
+                self.index += 1
+
+    def write(self, data):
+        self.record(self.WRITE, data)
+
+    def request(self, data):
+        self.record(self.REQUEST, data)
+
+    def reply(self, data):
+        self.record(self.REPLY, data)
+
+
+def read(prefix):
+    """
+    Read every event in the log files of a prefix.
+    :param prefix: Path prefix of log files.
+    :return: A list of (time, kind, data), oldest first.
+    """
+
+    events = []
+
+    for file in Recorder.get_files(prefix):
+        log = np.load(file, mmap_mode='r')
+        kinds = log['kind']
+        used = np.nonzero(kinds)[0]
+
+        for i in used.tolist():
+            kind = int(kinds[i])
+            data = log['data'][i, :log['length'][i]].tobytes()
+
+            if kind & Recorder.CONTINUED and events:
+                t, k, previous = events[-1]
+                events[-1] = (t, k, previous + data)
+            else:
+                events.append((float(log['time'][i]), kind, data))
+
+    return events
+
+
+def summarize(events):
+    """
+    Compute command jitter and request latency from a log.
+    :param events: From read().
+    :return: A dictionary of statistics. Times are in ms.
+    """
+
+    writes = np.array([t for t, kind, data in events if kind == Recorder.WRITE])
+    sizes = np.array([len(data) for t, kind, data in events if kind == Recorder.WRITE])
+
+    # Match replies to requests in order.
+    latencies = []
+    requests = deque()
+
+    for t, kind, data in events:
+        if kind == Recorder.REQUEST:
+            requests.append(t)
+        elif kind == Recorder.REPLY and requests:
+            latencies.append(t - requests.popleft())
+
+    intervals = np.diff(writes) * 1000
+    latencies = np.array(latencies) * 1000
+
+    return {
+        'writes': len(writes),
+        'bytes': int(sizes.sum()) if len(sizes) > 0 else 0,
+        'interval_mean': intervals.mean() if len(intervals) > 0 else 0,
+        'interval_std': intervals.std() if len(intervals) > 0 else 0,
+        'interval_max': intervals.max() if len(intervals) > 0 else 0,
+        'requests': len(latencies),
+        'latency_mean': latencies.mean() if len(latencies) > 0 else 0,
+        'latency_max': latencies.max() if len(latencies) > 0 else 0
+    }
+
+
+def replay(events, maestro, speed=1.0):
+    """
+    Feed a log into a controller, usually an Emulator, with the original timing.
+    Every recorded request is sent again and its reply compared to the recorded one.
+    :param events: From read().
+    :param maestro: A Maestro object connected to the controller.
+    :param speed: Playback speed.
+    :return: A list of (time, recorded, replayed) replies.
+    """
+
+    if not events:
+        return []
+
+    start = time.monotonic()
+    origin = events[0][0]
+
+    results = []
+    requests = deque()
+
+    for t, kind, data in events:
+        remaining = start + (t - origin) / speed - time.monotonic()
+
+        if remaining > 0:
+            time.sleep(remaining)
+
+        if kind == Recorder.WRITE:
+            maestro.write(data)
+        elif kind == Recorder.REQUEST:
+            requests.append(data)
+        elif kind == Recorder.REPLY and requests:
+            reply = maestro.query(requests.popleft(), len(data))
+            results.append((t, data, reply))
+
+    return results
@@ -0,0 +1,307 @@
+from agility.emulator import Emulator
+from agility.maestro import Maestro
+from agility.main import Agility
+from agility.gait import Dynamic
+from agility.stability import Stability
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from shared.debug import Dummy
+from functools import partial
+import numpy as np
+import itertools
+import importlib
+import argparse
+import logging
+import json
+import math
+import time
+import os
+
+logger = logging.getLogger('universe')
+
+
+# Candidate values of every tunable constant of Dynamic.
+SPACE = {
+    'beta_crawl': (0.75, 0.8, 0.825, 0.85, 0.875, 0.9),
+    'beta_trot': (0.6, 0.65, 0.7, 0.75, 0.8, 0.85),
+    'lift': (1, 1.5, 2, 2.5),
+    'transition': (3, 4, 5, 6, 8),
+    'crawl': ('1243', '1423', '1234', '1342', '1324', '1432'),
+    'min_steps': (10, 20, 30),
+    'max_steps': (60, 100)
+}
+
+# Vectors of (forward, rotation) every candidate is evaluated on.
+VECTORS = ((2, 0), (4, 0), (6, 0), (8, 0), (12, 0), (15, 0), (0, 1), (0, 2), (4, 0.5), (8, -0.5))
+
+# The Agility object of a worker process. See initialize().
+agility = None
+emulator = None
+
+
+def initialize(factory):
+    """
+    Set up a worker process. Gaits are prepared offline, so an emulated Maestro is used.
+    :param factory: A picklable function that returns a Robot.
+    """
+
+    global agility, emulator
+
+    emulator = Emulator()
+    agility = Agility(factory(), maestro=Maestro(port=emulator.port), usc=Dummy())
+
+
+def evaluate(parameters, vectors=VECTORS, weight=0.1, cap=2):
+    """
+    Evaluate one candidate in a worker process.
+    :param parameters: A dictionary of Dynamic parameters.
+    :param vectors: The vectors of (forward, rotation) to walk.
+    :param weight: The weight of the stability margin relative to speed.
+    :param cap: Margins above this many cm are not rewarded further.
+    :return: A result dictionary. The score is None if the candidate cannot reach every point.
+    """
+
+    start = time.time()
+
+    robot = agility.robot
+    bank = robot.bank
+    index = bank.indices(robot.leg_servos)
+
+    dynamic = Dynamic(robot)
+    dynamic.set_parameters(parameters)
+
+    speeds = []
+    margins = []
+    reached = 0
+    total = 0
+
+    for vector in vectors:
+        gait = dynamic.generate(*vector)
+        frames, dt = agility.prepare_smoothly(gait)
+        steps = len(frames)
+
+        # Reachability.
+        angles, valid = agility.solve(frames)
+        deg, reachable = bank.normalize(angles.reshape(steps, 12), index)
+        ok = valid & reachable.reshape(steps, 4, 3).all(axis=2)
+        reached += np.count_nonzero(ok)
+        total += ok.size
+
+        # Servos move at most 60 degrees per max_vel ms. Slower servos stretch the cycle.
+        delta = np.abs(deg - np.roll(deg, 1, axis=0))
+        need = np.nanmax(delta * bank.max_vel[index] / 60)
+        speeds.append(1 / max(1, need / dt))
+
+        margin = Stability(robot.body, frames).get_margin()
+        if margin is not None:
+            margins.append(margin)
+
+    reach = reached / total
+    speed = float(np.mean(speeds))
+    margin = min(margins) if margins else 0
+
+    if reach < 1:
+        score = None
+    else:
+        score = speed + weight * min(margin, cap)
+
+    return {
+        'parameters': parameters,
+        'score': score,
+        'speed': speed,
+        'margin': margin,
+        'reach': reach,
+        'time': time.time() - start
+    }
+
+
+class GaitSearch:
+    """
+    A search over the tunable constants of Dynamic. Candidates are evaluated in parallel processes, each of which
+    walks a set of vectors and checks reachability, servo speed limits and the stability margin of the body.
+
+    Candidates are scored by the fraction of the commanded speed the servos can achieve, plus a weighted stability
+    margin. Results are appended to a checkpoint file as they arrive, so an interrupted search resumes where it left off.
+    """
+
+    def __init__(self, factory, checkpoint, space=None, vectors=VECTORS, weight=0.1, cap=2, workers=None):
+        """
+        :param factory: A picklable function that returns a Robot. Called once in every worker.
+        :param checkpoint: The file results are appended to, one JSON object per line.
+        :param space: A dictionary of parameter name to candidate values. Defaults to SPACE.
+        :param vectors: The vectors of (forward, rotation) to walk.
+        :param weight: The weight of the stability margin relative to speed.
+        :param cap: Margins above this many cm are not rewarded further.
+        :param workers: The number of processes. None to use all cores.
+        """
+
+        self.factory = factory
+        self.checkpoint = checkpoint
+        self.space = SPACE if space is None else space
+        self.vectors = vectors
+        self.weight = weight
+        self.cap = cap
+        self.workers = workers
+
+        self.results = {}
+        self.load_checkpoint()
+
+    @staticmethod
+    def get_key(parameters):
+        return json.dumps(parameters, sort_keys=True)
+
+    def candidates(self):
+        """
+        Get every combination of candidate values.
+        :return: A generator of parameter dictionaries.
+        """
+
+        names = sorted(self.space)
+
+        for values in itertools.product(*(self.space[name] for name in names)):
+            parameters = dict(zip(names, values))
+
+            if parameters.get('min_steps', 0) > parameters.get('max_steps', math.inf):
+                continue
+
+            yield parameters
+
+    def load_checkpoint(self):
+        """
+        Load results of a previous run.
+        """
+
+        try:
+            with open(self.checkpoint, 'r') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+
+        for line in lines:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # The last line of an interrupted run may be partial.
+                continue
+
+            self.results[self.get_key(result['parameters'])] = result
+
+        logger.info('Resuming gait search with {} results.'.format(len(self.results)))
+
+    def run(self, limit=None):
+        """
+        Evaluate every candidate that has no result yet.
+        :param limit: The maximum number of candidates to evaluate. None for all.
+        :return: A list of all results.
+        """
+
+        pending = [c for c in self.candidates() if self.get_key(c) not in self.results]
+
+        if limit is not None:
+            pending = pending[:limit]
+
+        if not pending:
+            return list(self.results.values())
+
+        logger.info('Evaluating {} gait candidates.'.format(len(pending)))
+        start = time.time()
+
+        with ProcessPoolExecutor(self.workers, initializer=initialize, initargs=(self.factory,)) as executor, \
+                open(self.checkpoint, 'a') as f:
+            futures = [executor.submit(evaluate, parameters, self.vectors, self.weight, self.cap)
+                       for parameters in pending]
+
+            for i, future in enumerate(as_completed(futures)):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error('Gait candidate failed: {}'.format(e))
+                    continue
+
+                self.results[self.get_key(result['parameters'])] = result
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+
+                if (i + 1) % 100 == 0:
+                    logger.info('Evaluated {} of {} gait candidates in {:.1f} s.'.format(
+                        i + 1, len(pending), time.time() - start))
+
+        return list(self.results.values())
+
+    def best(self, count=20):
+        """
+        Get the best results.
+        :param count: The number of results.
+        :return: A list of results, best first.
+        """
+
+        scored = [result for result in self.results.values() if result['score'] is not None]
+        scored.sort(key=lambda result: result['score'], reverse=True)
+
+        return scored[:count]
+
+    def save_table(self, file, count=20):
+        """
+        Write a parameter table that Dynamic.load() reads. The best candidate is used, the others are kept for
+        reference.
+        :param file: The file name.
+        :param count: The number of results to keep.
+        """
+
+        best = self.best(count)
+
+        if not best:
+            raise ValueError('No gait candidate reached every point.')
+
+        table = {
+            'parameters': best[0]['parameters'],
+            'score': best[0]['score'],
+            'vectors': [list(vector) for vector in self.vectors],
+            'results': best
+        }
+
+        temp = file + '.tmp'
+
+        with open(temp, 'w') as f:
+            json.dump(table, f, indent=2)
+
+        os.replace(temp, file)
+
+
+def get_robot(pack):
+    """
+    Get the robot of a pack. Imported on call, so that only worker processes set up the robot.
+    :param pack: The name of a package in cerebral, such as 'pack1'.
+    :return: A Robot.
+    """
+
+    return importlib.import_module('cerebral.{}.hippocampus'.format(pack)).Android.robot
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search the gait constants of a robot.')
+    parser.add_argument('output', help='The parameter table to write, such as cerebral/pack1/gaits/parameters.json.')
+    parser.add_argument('--pack', default='pack1', help='The robot to tune.')
+    parser.add_argument('--checkpoint', help='The results file. Defaults to search.jsonl next to the output.')
+    parser.add_argument('--limit', type=int, help='The maximum number of candidates to evaluate in this run.')
+    parser.add_argument('--workers', type=int, help='The number of processes. Defaults to all cores.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    output = os.path.abspath(args.output)
+    checkpoint = args.checkpoint or os.path.join(os.path.dirname(output), 'search.jsonl')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    # Run again to resume.
+    factory = partial(get_robot, args.pack)
+    search = GaitSearch(factory, checkpoint, workers=args.workers)
+    search.run(args.limit)
+
+    for result in search.best(10):
+        print('{:.4f} | speed {:.3f} | margin {:6.2f} | {}'.format(
+            result['score'], result['speed'], result['margin'], result['parameters']))
+
+    # Dynamic loads the table on the robot.
+    search.save_table(output)
+    Dynamic(factory()).load(output)
+    print('Saved to {}.'.format(output))
@@ -0,0 +1,123 @@
+import numpy as np
+
+
+def contains(polygon, point):
+    """
+    Checks if a convex polygon strictly contains a point.
+    :param polygon: The vertices of the polygon in any order (n x 2).
+    :param point: The point (2).
+    :return: True if the point is inside, else False.
+    """
+
+    polygon = np.asarray(polygon, dtype=float)[:, :2]
+
+    if len(polygon) < 3:
+        return False
+
+    # Order counterclockwise so that the inside is on the left of every edge.
+    center = polygon.mean(axis=0)
+    polygon = polygon[np.argsort(np.arctan2(polygon[:, 1] - center[1], polygon[:, 0] - center[0]))]
+
+    a = polygon
+    edge = np.roll(polygon, -1, axis=0) - a
+    cross = edge[:, 0] * (point[1] - a[:, 1]) - edge[:, 1] * (point[0] - a[:, 0])
+
+    return bool(np.all(cross > 0))
+
+
+class Stability:
+    def __init__(self, body, frames, epsilon=1e-6):
+        """
+        Static stability of every frame of a gait at once.
+        The support polygon of a frame is made of the legs on the ground, ordered counterclockwise.
+        The margin is the distance from the center of mass to the nearest edge of the support polygon,
+        positive inside and negative outside. With fewer than three legs on the ground, the support polygon is a
+        segment or a point, so the center of mass is never inside.
+        :param body: The body object.
+        :param frames: Prepared frames (steps x 4 x 3).
+        :param epsilon: Tolerance when deciding whether a leg is on the ground.
+        """
+
+        frames = np.asarray(frames, dtype=float)
+        steps = len(frames)
+        rows = np.arange(steps)[:, np.newaxis]
+
+        # Legs on the ground.
+        z = frames[:, :, 2]
+        self.grounded = z <= z.min(axis=1, keepdims=True) + epsilon
+        self.count = np.count_nonzero(self.grounded, axis=1)
+
+        # Relative to absolute.
+        original = frames[:, :, :2] + body.vertices[:, :2]
+
+        # Center of mass as in Body.get_com().
+        self.com = body.ml * np.sum(original, axis=1) / (body.ml + body.mb) + body.com[:2]
+
+        # Order grounded legs counterclockwise about their center. Legs in the air go last.
+        count = np.maximum(self.count, 1)
+        center = np.sum(original * self.grounded[:, :, np.newaxis], axis=1) / count[:, np.newaxis]
+        angle = np.arctan2(original[:, :, 1] - center[:, 1:], original[:, :, 0] - center[:, :1])
+        angle[~self.grounded] = np.inf
+        order = np.argsort(angle, axis=1)
+
+        # Support polygons (steps x 4 x 2). Only the first count points of each are used.
+        self.polygon = original[rows, order]
+
+        # Edges from every point to the next, wrapping at count.
+        k = np.arange(4)
+        used = k < self.count[:, np.newaxis]
+        following = np.where(k + 1 < count[:, np.newaxis], k + 1, 0)
+        a = self.polygon
+        b = self.polygon[rows, following]
+        edge = b - a
+        relative = self.com[:, np.newaxis] - a
+
+        # Inside if left of every edge.
+        cross = edge[:, :, 0] * relative[:, :, 1] - edge[:, :, 1] * relative[:, :, 0]
+        self.inside = (self.count >= 3) & np.all((cross > 0) | ~used, axis=1)
+
+        # Distance to every edge as a segment.
+        length = np.sum(edge ** 2, axis=2)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = np.where(length > 0, np.sum(relative * edge, axis=2) / length, 0)
+
+        u = np.clip(u, 0, 1)
+        distance = np.linalg.norm(relative - u[:, :, np.newaxis] * edge, axis=2)
+        distance = np.where(used, distance, np.inf).min(axis=1)
+
+        self.margin = np.where(self.inside, distance, -distance)
+
+    def static(self):
+        """
+        Get the frames that must be statically stable, those with at least three legs on the ground.
+        A trot only ever has two legs on the ground and is balanced dynamically.
+        :return: A boolean array (steps).
+        """
+
+        return self.count >= 3
+
+    def get_margin(self):
+        """
+        Get the smallest margin of the statically stable frames.
+        :return: The margin, or None if no frame has three legs on the ground.
+        """
+
+        static = self.static()
+
+        if not static.any():
+            return None
+
+        return float(self.margin[static].min())
+
+    def is_stable(self, margin=0):
+        """
+        Checks if every frame that must be statically stable keeps the center of mass inside its support polygon.
+        :param margin: The required margin.
+        :return: True if stable, else False.
+        """
+
+        return bool(np.all(self.margin[self.static()] > margin))
+
+    def __len__(self):
+        return len(self.margin)
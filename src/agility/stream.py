@@ -0,0 +1,205 @@
+from agility.maestro import Maestro
+from threading import Thread, Event
+from queue import Queue, Full
+import numpy as np
+
+
+def evaluate(gait, legs, cycles=1):
+    """
+    Evaluate a gait one frame at a time.
+    :param gait: The gait object.
+    :param legs: The legs of the robot.
+    :param cycles: The number of cycles to evaluate. None to evaluate forever.
+    :return: A generator of (frame, dt).
+    """
+
+    steps = gait.steps
+    dt = gait.time / steps
+    cycle = 0
+
+    while cycles is None or cycle < cycles:
+        for i in range(steps):
+            t = np.array((i * (1000 / steps),))
+            frame = gait.evaluate_all(legs, t)[0]
+            yield frame, dt
+
+        cycle += 1
+
+
+def adjust(body, source, ground, epsilon=1e-6, loop=True):
+    """
+    Perform center of mass adjustments with a lookahead of one frame, like prepare_gait().
+    :param body: The body object.
+    :param source: An iterable of (frame, dt).
+    :param ground: Ground.
+    :param epsilon: Tolerance when deciding whether a leg is in the air.
+    :param loop: Whether the last frame looks ahead to the first frame.
+    :return: A generator of (frame, dt).
+    """
+
+    def bias(current, upcoming):
+        frame, dt = current
+        off = np.greater(frame[:, 2], ground + epsilon)
+        return frame - body.adjust(off, upcoming[0]), dt
+
+    source = iter(source)
+
+    try:
+        first = current = next(source)
+    except StopIteration:
+        return
+
+    for upcoming in source:
+        yield bias(current, upcoming)
+        current = upcoming
+
+    yield bias(current, first if loop else current)
+
+
+def interpolate(source, previous, k=100):
+    """
+    Split frames with long dt into shorter linear steps, like execute_long().
+    :param source: An iterable of (frame, dt).
+    :param previous: The frame before the first frame.
+    :param k: Break constant (ms / cm).
+    :return: A generator of (frame, dt).
+    """
+
+    previous = np.asarray(previous, dtype=float)
+
+    for frame, dt in source:
+        frame = np.asarray(frame, dtype=float)
+
+        # Compute max distance.
+        d = max(np.linalg.norm(frame - previous, axis=1))
+
+        # Less than break. Too long. Linearly interpolate.
+        if d > 0 and dt / d > k:
+            n = int(round(dt / d / k)) + 1
+            delta = (frame - previous) / n
+            u = dt / n
+
+            for i in range(1, n):
+                yield previous + i * delta, u
+        else:
+            u = dt
+
+        yield frame, u
+
+        previous = frame
+
+
+def solve(agility, source):
+    """
+    Convert frames to leg servo targets. Unreachable points hold the previous target.
+    Frames are yielded as executed, so a leg that holds its target also keeps its previous point.
+    :param agility: An Agility object.
+    :param source: An iterable of (frame, dt).
+    :return: A generator of (frame, dt, targets).
+    """
+
+    hold = None
+    previous = None
+
+    for frame, dt in source:
+        targets, reached = agility.tabulate(frame[np.newaxis], hold, True)
+        hold = targets[0]
+
+        if not reached.all():
+            frame = frame.copy()
+
+            for l in np.where(~reached[0])[0]:
+                frame[l] = agility.robot.legs[l].get_position() if previous is None else previous[l]
+
+        yield frame, dt, hold
+
+        previous = frame
+
+
+def encode(servos, source):
+    """
+    Encode speed and target commands for every frame, exactly as end_together() would after wait().
+    The first frame is not encoded, since its speeds depend on where the servos are.
+    :param servos: The servo objects, one per target.
+    :param source: An iterable of (frame, dt, targets).
+    :return: A generator of (frame, dt, targets, speeds, data) where speeds and data are None for the first frame.
+    """
+
+    channels = np.array([servo.channel for servo in servos])
+    previous = None
+
+    for frame, dt, targets in source:
+        if previous is None:
+            speeds, data = None, None
+        else:
+            speeds = np.rint(np.abs(targets - previous) / dt * 10).astype(int)
+            data, _ = Maestro.encode_frames(channels, speeds[np.newaxis], targets[np.newaxis])
+
+        yield frame, dt, targets, speeds, data
+
+        previous = targets
+
+
+class Pipeline:
+    def __init__(self, source, size=8):
+        """
+        Run a chain of generator stages on a background thread, feeding a bounded queue.
+        A typical chain is evaluate() -> adjust() -> solve() -> encode(). Each stage handles one frame at a time,
+        so only a few frames exist at once and the first frame is ready as soon as it is computed.
+        Iterate over the pipeline to consume items. Exceptions in a stage are raised to the consumer.
+        :param source: An iterable, usually the last stage of a chain.
+        :param size: The maximum number of items waiting in the queue.
+        """
+
+        self.queue = Queue(maxsize=size)
+        self.stop_event = Event()
+
+        self.thread = Thread(target=self._run, args=(source,), daemon=True)
+        self.thread.start()
+
+    def _run(self, source):
+        try:
+            for item in source:
+                if not self.put((item, None)):
+                    return
+        except Exception as e:
+            self.put((None, e))
+            return
+
+        self.put((None, None))
+
+    def put(self, entry):
+        """
+        Put an entry in the queue, giving up if the pipeline is closed.
+        :param entry: (item, exception).
+        :return: True if the entry was queued.
+        """
+
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(entry, timeout=0.05)
+                return True
+            except Full:
+                pass
+
+        return False
+
+    def close(self):
+        """
+        Stop the background thread. Remaining items are discarded.
+        """
+
+        self.stop_event.set()
+        self.thread.join()
+
+    def __iter__(self):
+        while True:
+            item, e = self.queue.get()
+
+            if e is not None:
+                raise e
+
+            if item is None:
+                return
+
+            yield item
@@ -0,0 +1,64 @@
+from agility.emulator import Emulator
+from agility.maestro import Maestro
+from agility.main import Agility
+from agility.gait import Dynamic
+from agility.atlas import GaitAtlas
+from cerebral.pack1.hippocampus import Android
+from shared.debug import Dummy
+import numpy as np
+import tempfile
+import time
+import os
+
+
+# Build atlases for the robot with python -m agility.atlas cerebral/pack1/gaits/atlas.npz.
+
+# Robot by reference.
+robot = Android.robot
+
+# Gaits are prepared offline, so an emulated Maestro will do.
+emulator = Emulator()
+maestro = Maestro(port=emulator.port)
+agility = Agility(robot, maestro=maestro, usc=Dummy())
+dynamic = Dynamic(robot)
+
+# A coarse grid.
+start = time.time()
+atlas = GaitAtlas.build(agility, dynamic, forward=(-8, 8, 5), rotation=(-1, 1, 5))
+print('Built {} of {} entries in {:.1f} s.'.format(len(atlas), atlas.pattern.size, time.time() - start))
+
+file = os.path.join(tempfile.mkdtemp(), 'atlas.npz')
+atlas.save(file)
+print('Saved to {} ({} bytes).'.format(file, os.path.getsize(file)))
+
+# Round trip.
+loaded = GaitAtlas.load(agility, dynamic, file)
+
+for name in ('forward', 'rotation', 'frames', 'dt', 'steps', 'pattern'):
+    assert np.array_equal(getattr(loaded, name), getattr(atlas, name)), name
+
+assert loaded.profile == atlas.profile
+
+for vector in ((4, 0), (-3, 0.5), (0, 1), (6, -0.25)):
+    a, b = atlas.blend(vector), loaded.blend(vector)
+    assert np.array_equal(a[0], b[0]) and a[1] == b[1], vector
+
+# Lookup time.
+start = time.time()
+for i in range(100):
+    loaded.get((i * 0.08, 0.5))
+print('Lookup: {:.2f} ms.'.format((time.time() - start) * 10))
+
+# Atlases built for other gait constants are rejected.
+other = Dynamic(robot)
+other.set_parameters({'lift': other.lift + 1})
+
+try:
+    GaitAtlas.load(agility, other, file)
+except ValueError as e:
+    print('Rejected: {}'.format(e))
+else:
+    raise AssertionError('Atlas loaded for different gait constants.')
+
+maestro.close()
+emulator.close()
@@ -0,0 +1,66 @@
+from agility.pololu.reader import BytecodeReader
+import random
+import time
+
+
+def generate(subroutines, frames=20, channels=12):
+    """
+    Generate a script shaped like compile_gait_to_script() output.
+    """
+
+    lines = []
+
+    for i in range(subroutines):
+        lines.append('sub gait_{}'.format(i))
+        lines.append('  begin')
+
+        for j in range(frames):
+            lines.append('    ' + ' '.join('{} {} speed'.format(random.randint(0, 200), c) for c in range(channels)))
+            lines.append('    ' + ' '.join('{} {} servo'.format(random.randint(3000, 9000), c) for c in range(channels)))
+            lines.append('    20 delay')
+
+        lines.append('  repeat')
+
+    return '\n'.join(lines)
+
+
+def measure(subroutines, repeat=5):
+    source = generate(subroutines)
+    reader = BytecodeReader()
+
+    # Bypass the memoized read().
+    start = time.perf_counter()
+    for i in range(repeat):
+        program = reader.parse(source, True)
+    parse = (time.perf_counter() - start) / repeat * 1000
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        program.getCRC()
+    crc = (time.perf_counter() - start) / repeat * 1000
+
+    reader.read(source, True)
+    start = time.perf_counter()
+    for i in range(repeat):
+        reader.read(source, True)
+    cached = (time.perf_counter() - start) / repeat * 1000
+
+    size = len(program.getByteList())
+
+    print('{:3} subroutines | {:6} bytes | parse {:7.1f} ms ({:5.2f} ms/KB) | CRC {:5.1f} ms | cached {:5.2f} ms'.format(
+        subroutines, size, parse, parse / size * 1024, crc, cached))
+
+    start = time.perf_counter()
+    report = reader.parse(source, True, optimize=True).optimization
+    optimize = (time.perf_counter() - start) * 1000
+
+    print('{:3} subroutines | optimized {:6} -> {:6} bytes | {:6} -> {:6} instructions | {:7.1f} ms'.format(
+        subroutines, report['size_before'], report['size_after'],
+        report['instructions_before'], report['instructions_after'], optimize))
+
+
+random.seed(0)
+
+# Time per KB should stay flat as scripts grow.
+for subroutines in (1, 2, 4, 8, 16):
+    measure(subroutines)
@@ -0,0 +1,46 @@
+from agility.emulator import Emulator
+from agility.maestro import Maestro
+from agility.asyncmaestro import AsyncMaestro
+from cerebral.pack1.hippocampus import Android
+from threading import Thread
+import time
+
+
+# Robot by reference.
+robot = Android.robot
+
+
+def poll(maestro, servos, results, name, count=200):
+    start = time.monotonic()
+
+    for i in range(count):
+        maestro.get_multiple_positions(servos)
+        maestro.get_moving_state()
+
+    results[name] = (time.monotonic() - start) / count * 1000
+
+
+def measure(cls):
+    # Emulated Maestro with 2 ms USB latency.
+    emulator = Emulator(latency=0.002)
+    maestro = cls(port=emulator.port)
+    results = {}
+
+    # Head tracking and walking poll the port at the same time.
+    threads = [Thread(target=poll, args=(maestro, robot.leg_servos, results, 'legs')),
+               Thread(target=poll, args=(maestro, robot.head_servos, results, 'head'))]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    print('{:<14} | legs {:6.2f} ms/poll | head {:6.2f} ms/poll'.format(cls.__name__, results['legs'], results['head']))
+
+    maestro.close()
+    emulator.close()
+
+
+measure(Maestro)
+measure(AsyncMaestro)
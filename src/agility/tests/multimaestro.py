@@ -0,0 +1,95 @@
+from agility.emulator import Emulator
+from agility.maestro import Maestro
+from agility.multimaestro import MultiMaestro
+from agility.gait import Dynamic
+from agility.main import Agility
+from cerebral.pack1.hippocampus import Android
+from shared.debug import Dummy
+from threading import Timer
+import numpy as np
+import time
+
+
+# Robot by reference.
+robot = Android.robot
+servos = robot.leg_servos + robot.head_servos
+
+
+def run(maestro):
+    """
+    Run the same moves on a Maestro and collect what it reports.
+    :return: A list of (name, result).
+    """
+
+    results = []
+
+    agility = Agility(robot, maestro=maestro, usc=Dummy())
+    dynamic = Dynamic(robot)
+
+    # Servos that never reach their targets would block forever. Stop instead, so that positions differ.
+    watchdog = Timer(30, agility.stop)
+    watchdog.start()
+
+    agility.ready(dynamic.ground)
+    maestro.get_multiple_positions(servos)
+    results.append(('ready', [servo.pwm for servo in servos]))
+
+    frames, dt = agility.prepare_smoothly(dynamic.generate(8, 0))
+    agility.execute_frames(frames, dt)
+    agility.wait()
+    maestro.get_multiple_positions(servos)
+    results.append(('gait', [servo.pwm for servo in servos]))
+
+    agility.set_head((20, -10), 300)
+    maestro.get_multiple_positions(servos)
+    results.append(('head', [servo.pwm for servo in servos]))
+
+    watchdog.cancel()
+
+    results.append(('moving', maestro.get_moving_state()))
+    results.append(('errors', maestro.get_errors()))
+
+    # Set multiple targets for channels 7 to 10 behind Agility's back. This spans both controllers when split.
+    # Unlimited speed and acceleration, so that they arrive within one tick.
+    targets = np.array([5000, 5500, 6500, 7000])
+    maestro.write(bytes(b for channel in range(7, 11) for b in (0x87, channel, 0, 0, 0x89, channel, 0, 0)))
+    maestro.write(Maestro.encode_targets(np.arange(7, 11), targets).tobytes())
+    time.sleep(0.1)
+
+    # Mixed requests: positions, moving state and errors in one query.
+    request = bytes((0x90, 7, 0x90, 10, 0x93, 0x90, 17, 0xA1))
+    results.append(('mixed query', maestro.query(request, 9)))
+
+    # Go home is broadcast. Unlimited speed and acceleration, so that every servo arrives within one tick.
+    channels = [servo.channel for servo in servos]
+    maestro.write(bytes(b for channel in channels for b in (0x87, channel, 0, 0, 0x89, channel, 0, 0)))
+    maestro.go_home()
+    time.sleep(0.1)
+    maestro.get_multiple_positions(servos)
+    results.append(('home', [servo.pwm for servo in servos]))
+
+    return results
+
+
+# One controller with every channel.
+emulator = Emulator(channels=18, latency=0.001)
+maestro = Maestro(port=emulator.port)
+single = run(maestro)
+maestro.close()
+emulator.close()
+
+# Two controllers with 9 channels each, so legs span both.
+emulators = [Emulator(channels=9, latency=0.001) for i in range(2)]
+maestro = MultiMaestro([Maestro(port=emulator.port) for emulator in emulators], channels=9)
+multi = run(maestro)
+maestro.close()
+
+for emulator in emulators:
+    emulator.close()
+
+for (name, expected), (other, actual) in zip(single, multi):
+    assert name == other
+    print('{:<12} {}'.format(name, 'same' if actual == expected else 'DIFFERENT'))
+    assert actual == expected, (name, expected, actual)
+
+print('Two controllers matched one.')
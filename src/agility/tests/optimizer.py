@@ -0,0 +1,269 @@
+from agility.pololu.reader import BytecodeReader
+from agility.pololu.optimizer import BytecodeOptimizer
+from agility.pololu.enumeration import Opcode
+import random
+import math
+
+
+def signed(value):
+    value &= 0xFFFF
+    return value - 0x10000 if value >= 0x8000 else value
+
+
+# Operations as the Maestro defines them, independent of the optimizer's own tables.
+UNARY = {
+    Opcode.BITWISE_NOT: lambda a: ~a,
+    Opcode.LOGICAL_NOT: lambda a: 1 if a == 0 else 0,
+    Opcode.NEGATE: lambda a: -a,
+    Opcode.POSITIVE: lambda a: 1 if a > 0 else 0,
+    Opcode.NEGATIVE: lambda a: 1 if a < 0 else 0,
+    Opcode.NONZERO: lambda a: 1 if a != 0 else 0
+}
+
+BINARY = {
+    Opcode.BITWISE_AND: lambda a, b: a & b,
+    Opcode.BITWISE_OR: lambda a, b: a | b,
+    Opcode.BITWISE_XOR: lambda a, b: a ^ b,
+    Opcode.SHIFT_LEFT: lambda a, b: a << b,
+    Opcode.LOGICAL_AND: lambda a, b: 1 if a and b else 0,
+    Opcode.LOGICAL_OR: lambda a, b: 1 if a or b else 0,
+    Opcode.PLUS: lambda a, b: a + b,
+    Opcode.MINUS: lambda a, b: a - b,
+    Opcode.TIMES: lambda a, b: a * b,
+    Opcode.DIVIDE: lambda a, b: int(a / b),
+    Opcode.MOD: lambda a, b: int(math.fmod(a, b)),
+    Opcode.EQUALS: lambda a, b: 1 if a == b else 0,
+    Opcode.NOT_EQUALS: lambda a, b: 1 if a != b else 0,
+    Opcode.MIN: min,
+    Opcode.MAX: max,
+    Opcode.LESS_THAN: lambda a, b: 1 if a < b else 0,
+    Opcode.GREATER_THAN: lambda a, b: 1 if a > b else 0
+}
+
+
+def run(program, steps=100000):
+    """
+    Interpret the bytecode of a completed program.
+    :return: (trace, stack, depth) where trace holds every command with an effect outside of the stack and depth is
+    the deepest the stack got.
+    """
+
+    code = program.getByteList()
+    subroutines = {command: program.subroutineAddresses[name] for name, command in program.subroutineCommands.items()}
+
+    pc = 0
+    stack = []
+    calls = []
+    trace = []
+    depth = 0
+
+    for i in range(steps):
+        depth = max(depth, len(stack))
+
+        if pc >= len(code):
+            break
+
+        op = code[pc]
+        pc += 1
+
+        if op == Opcode.QUIT:
+            break
+        elif op == Opcode.LITERAL:
+            stack.append(signed(code[pc] | code[pc + 1] << 8))
+            pc += 2
+        elif op == Opcode.LITERAL8:
+            stack.append(code[pc])
+            pc += 1
+        elif op == Opcode.LITERAL_N:
+            n = code[pc]
+            pc += 1
+            for j in range(n // 2):
+                stack.append(signed(code[pc] | code[pc + 1] << 8))
+                pc += 2
+        elif op == Opcode.LITERAL8_N:
+            n = code[pc]
+            pc += 1
+            stack.extend(code[pc:pc + n])
+            pc += n
+        elif op == Opcode.JUMP:
+            pc = code[pc] | code[pc + 1] << 8
+        elif op == Opcode.JUMP_Z:
+            target = code[pc] | code[pc + 1] << 8
+            pc += 2
+            if stack.pop() == 0:
+                pc = target
+        elif op == Opcode.CALL:
+            calls.append(pc + 2)
+            pc = code[pc] | code[pc + 1] << 8
+        elif op >= 128:
+            calls.append(pc)
+            pc = subroutines[op]
+        elif op == Opcode.RETURN:
+            if not calls:
+                break
+            pc = calls.pop()
+        elif op in (Opcode.SERVO, Opcode.SPEED, Opcode.ACCELERATION):
+            channel = stack.pop()
+            value = stack.pop()
+            trace.append((Opcode(op).name, channel, value))
+        elif op == Opcode.DELAY:
+            trace.append(('DELAY', stack.pop()))
+        elif op == Opcode.DROP:
+            stack.pop()
+        elif op == Opcode.DUP:
+            stack.append(stack[-1])
+        elif op == Opcode.SWAP:
+            stack[-1], stack[-2] = stack[-2], stack[-1]
+        elif op == Opcode.OVER:
+            stack.append(stack[-2])
+        elif op in UNARY:
+            stack.append(signed(UNARY[op](stack.pop())))
+        elif op in BINARY:
+            b = stack.pop()
+            a = stack.pop()
+            stack.append(signed(BINARY[op](a, b)))
+        else:
+            raise ValueError('Opcode {} is not supported.'.format(op))
+
+    return trace, stack, depth
+
+
+def expression(depth=0):
+    """
+    Generate an expression that pushes one value.
+    """
+
+    if depth > 2 or random.random() < 0.4:
+        return str(random.randint(0, 300) if random.random() < 0.8 else random.randint(0, 65535))
+
+    kind = random.random()
+
+    if kind < 0.2:
+        return '{} {}'.format(expression(depth + 1), random.choice(
+            ('bitwise_not', 'logical_not', 'negate', 'positive', 'negative', 'nonzero')))
+    elif kind < 0.3:
+        # Divisors and shifts are kept in range.
+        return '{} {} {}'.format(expression(depth + 1), random.randint(1, 9), random.choice(('divide', 'mod')))
+    elif kind < 0.35:
+        return '{} {} shift_left'.format(expression(depth + 1), random.randint(0, 15))
+    elif kind < 0.45:
+        return '{} dup {}'.format(expression(depth + 1), random.choice(('plus', 'times')))
+    elif kind < 0.55:
+        return '{} {} swap {}'.format(expression(depth + 1), expression(depth + 1), random.choice(('minus', 'max')))
+    elif kind < 0.6:
+        return '{} {} over drop {}'.format(expression(depth + 1), expression(depth + 1), random.choice(('plus', 'min')))
+    else:
+        return '{} {} {}'.format(expression(depth + 1), expression(depth + 1), random.choice(
+            ('bitwise_and', 'bitwise_or', 'bitwise_xor', 'logical_and', 'logical_or', 'plus', 'minus', 'times',
+             'equals', 'not_equals', 'min', 'max', 'less_than', 'greater_than')))
+
+
+def block(subroutines, labels, depth=0, length=6):
+    """
+    Generate statements that leave the stack as they found it.
+    """
+
+    lines = []
+
+    for i in range(random.randint(1, length)):
+        kind = random.random()
+
+        if kind < 0.45:
+            # Runs of commands, which hoisting targets.
+            for j in range(random.randint(1, 20)):
+                command = random.choice(('servo', 'servo', 'speed', 'acceleration', 'delay'))
+                if command == 'delay':
+                    lines.append('{} delay'.format(expression()))
+                else:
+                    lines.append('{} {} {}'.format(expression(), random.randint(0, 17), command))
+        elif kind < 0.55 and depth < 3:
+            lines.append('{} if'.format(expression()))
+            lines.extend(block(subroutines, labels, depth + 1, 3))
+            if random.random() < 0.5:
+                lines.append('else')
+                lines.extend(block(subroutines, labels, depth + 1, 3))
+            lines.append('endif')
+        elif kind < 0.65 and depth < 3:
+            # Loops keep a counter on the stack below the body.
+            lines.append('{} begin dup while'.format(random.randint(0, 3)))
+            lines.extend(block(subroutines, labels, depth + 1, 3))
+            lines.append('1 minus repeat drop')
+        elif kind < 0.75 and subroutines:
+            lines.append(random.choice(subroutines))
+        elif kind < 0.85:
+            # A chain of jumps to the next statement.
+            first, second = 'l{}'.format(len(labels)), 'l{}'.format(len(labels) + 1)
+            labels.extend((first, second))
+            lines.append('goto {} {}: goto {} {}:'.format(first, second, second, first))
+            lines.append('{} {} servo'.format(expression(), random.randint(0, 17)))
+        else:
+            lines.append('{} drop'.format(expression()))
+
+    return lines
+
+
+def generate():
+    """
+    Generate a random terminating script with subroutines, loops and dead code.
+    """
+
+    labels = []
+    names = ['s{}'.format(i) for i in range(random.randint(0, 3))]
+    lines = block(names, labels)
+    lines.append('quit')
+
+    # Unreachable code.
+    if random.random() < 0.5:
+        lines.append('{} 0 servo'.format(expression()))
+
+    for i, name in enumerate(names):
+        lines.append('sub {}'.format(name))
+        lines.extend(block(names[:i], labels, 1, 3))
+        lines.append('return')
+
+    return '\n'.join(lines)
+
+
+def check(source, isMiniMaestro):
+    """
+    Check that an optimized program does exactly what the original does, and that hoisting stays within its budget.
+    :return: The optimization report.
+    """
+
+    original = BytecodeReader().parse(source, isMiniMaestro)
+    optimized = BytecodeReader().parse(source, isMiniMaestro, optimize=True)
+
+    trace, stack, depth = run(original)
+    optimizedTrace, optimizedStack, optimizedDepth = run(optimized)
+
+    assert optimizedTrace == trace, source
+    assert optimizedStack == stack, source
+    assert optimizedDepth <= depth + BytecodeOptimizer(isMiniMaestro).maxHoist, source
+
+    return optimized.optimization
+
+
+# A loop that keeps its counter on the stack under 16 servo commands. The Micro Maestro's stack holds 32 values.
+source = '3 begin dup while {} 1 minus repeat drop'.format(' '.join('{} {} servo'.format(6000, c) for c in range(16)))
+for isMiniMaestro in (False, True):
+    check(source, isMiniMaestro)
+    depth = run(BytecodeReader().parse(source, isMiniMaestro, optimize=True))[2]
+    print('Loop of 16 servo commands on the {} Maestro: stack depth {}.'.format(
+        'Mini' if isMiniMaestro else 'Micro', depth))
+    assert isMiniMaestro or depth < 32
+
+# Random programs.
+random.seed(0)
+count = 1000
+size = [0, 0]
+instructions = [0, 0]
+
+for i in range(count):
+    report = check(generate(), random.random() < 0.5)
+    size[0] += report['size_before']
+    size[1] += report['size_after']
+    instructions[0] += report['instructions_before']
+    instructions[1] += report['instructions_after']
+
+print('{} random programs matched | {} -> {} bytes | {} -> {} instructions.'.format(
+    count, size[0], size[1], instructions[0], instructions[1]))
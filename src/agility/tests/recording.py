@@ -0,0 +1,65 @@
+from agility.emulator import Emulator
+from agility.maestro import Maestro
+from agility.recorder import Recorder, read, summarize, replay
+from agility.gait import Dynamic
+from agility.main import Agility
+from cerebral.pack1.hippocampus import Android
+from shared.debug import Dummy
+import numpy as np
+import tempfile
+import time
+import os
+
+
+# Emulated Maestro with 1 ms USB latency.
+emulator = Emulator(latency=0.001)
+maestro = Maestro(port=emulator.port)
+
+# Record everything from power on, so that a replay starts from the same state.
+prefix = os.path.join(tempfile.mkdtemp(), 'maestro')
+maestro.recorder = Recorder(prefix, size=256 * 1024)
+
+# Robot by reference.
+robot = Android.robot
+agility = Agility(robot, maestro=maestro, usc=Dummy())
+
+# Gait.
+dynamic = Dynamic(robot)
+gait = dynamic.generate(8, 0)
+frames, dt = agility.prepare_smoothly(gait)
+agility.ready(dynamic.ground)
+
+# Walk a few cycles.
+start = time.monotonic()
+
+for i in range(5):
+    agility.execute_frames(frames, dt)
+
+elapsed = time.monotonic() - start
+maestro.recorder.close()
+maestro.recorder = None
+
+events = read(prefix)
+stats = summarize(events)
+
+print('Recorded {} events in {} files. Walked for {:.2f} s.'.format(len(events), len(Recorder.get_files(prefix)), elapsed))
+print('Writes: {writes} ({bytes} B), interval {interval_mean:.2f} +/- {interval_std:.2f} ms, max {interval_max:.2f} ms'
+      .format(**stats))
+print('Requests: {requests}, latency {latency_mean:.2f} ms, max {latency_max:.2f} ms'.format(**stats))
+
+maestro.close()
+emulator.close()
+
+# Replay into a fresh emulator and compare the positions it reports.
+emulator = Emulator(latency=0.001)
+maestro = Maestro(port=emulator.port)
+
+results = replay(events, maestro)
+errors = [np.abs(np.frombuffer(a, dtype='<u2').astype(int) - np.frombuffer(b, dtype='<u2')).max()
+          for t, a, b in results if len(a) == len(b) and len(a) % 2 == 0 and len(a) > 0]
+
+print('Replayed {} requests. Position error {:.1f} mean, {} max (0.25 us).'.format(len(results), np.mean(errors),
+                                                                                   np.max(errors)))
+
+maestro.close()
+emulator.close()
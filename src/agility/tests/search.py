@@ -0,0 +1,47 @@
+from agility.search import GaitSearch, get_robot
+from agility.gait import Dynamic
+from functools import partial
+import tempfile
+import logging
+import json
+import os
+
+
+# Build tables for the robot with python -m agility.search cerebral/pack1/gaits/parameters.json.
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    factory = partial(get_robot, 'pack1')
+    root = tempfile.mkdtemp()
+    checkpoint = os.path.join(root, 'search.jsonl')
+
+    # A small space on a few vectors.
+    space = {'beta_crawl': (0.8, 0.85), 'lift': (1.5, 2)}
+    vectors = ((4, 0), (8, 0), (0, 1))
+
+    search = GaitSearch(factory, checkpoint, space=space, vectors=vectors, workers=2)
+    results = search.run(limit=3)
+    assert len(results) == 3
+
+    # A new search resumes from the checkpoint.
+    search = GaitSearch(factory, checkpoint, space=space, vectors=vectors, workers=2)
+    assert len(search.results) == 3
+    results = search.run()
+    assert len(results) == 4
+
+    for result in search.best():
+        print('{:.4f} | speed {:.3f} | margin {:6.2f} | {}'.format(
+            result['score'], result['speed'], result['margin'], result['parameters']))
+
+    # Dynamic loads the table.
+    file = os.path.join(root, 'parameters.json')
+    search.save_table(file)
+
+    dynamic = Dynamic(factory())
+    dynamic.load(file)
+
+    with open(file) as f:
+        best = json.load(f)['parameters']
+
+    assert all(getattr(dynamic, name) == value for name, value in best.items())
+    print('Saved to {}.'.format(file))
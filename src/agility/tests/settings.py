@@ -0,0 +1,39 @@
+from agility.main import Agility
+from agility.emulator import Emulator
+from agility.maestro import Maestro
+from agility.pololu.usc import Usc
+from agility.pololu.mock import MockDevice
+from cerebral.pack1.hippocampus import Android
+
+
+# Robot by reference.
+robot = Android.robot
+
+# Mock device that counts USB control transfers.
+device = MockDevice(servoCount=18)
+usc = Usc(dev=device)
+
+emulator = Emulator()
+maestro = Maestro(port=emulator.port)
+agility = Agility(robot, maestro=maestro, usc=usc)
+
+
+def measure(name, fn):
+    device.transfers = device.reads = device.writes = device.reinitializations = 0
+    fn()
+    print('{:<22} | {:4} transfers | {:4} reads | {:4} writes | {} reinitializations'.format(
+        name, device.transfers, device.reads, device.writes, device.reinitializations))
+
+
+measure('configure (cold)', agility.configure)
+measure('configure (unchanged)', agility.configure)
+
+# Recalibrate one servo.
+robot.legs[0][0].max_pwm -= 64
+measure('configure (one servo)', agility.configure)
+
+measure('read (uncached)', lambda: usc.getUscSettings(cached=False))
+measure('read (cached)', usc.getUscSettings)
+
+maestro.close()
+emulator.close()
@@ -1,6 +1,16 @@
 from agility.maestro import Maestro
 from agility.main import Stepper
+from agility.pololu.usc import Usc
+from agility.pololu.reader import BytecodeReader
 
 stepper = Stepper(0, 1, 200)
 maestro = Maestro()
-maestro.rotate(stepper, -360, 2000)
\ No newline at end of file
+
+# Time pulses on the Maestro.
+usc = Usc()
+program = BytecodeReader().read(stepper.script(), usc.isMiniMaestro)
+usc.loadProgram(program)
+stepper.subroutine = program.subroutineCommands[stepper.name.upper()] - 128
+
+future = maestro.rotate_async(stepper, -360, 2000)
+print(future.result())
@@ -0,0 +1,59 @@
+from agility.emulator import Emulator
+from agility.maestro import Maestro
+from agility.gait import Dynamic
+from agility.main import Agility
+from cerebral.pack1.hippocampus import Android
+from shared.debug import Dummy
+import time
+
+
+# Emulated Maestro with 1 ms USB latency.
+emulator = Emulator(latency=0.001)
+maestro = Maestro(port=emulator.port)
+
+# Robot by reference.
+robot = Android.robot
+agility = Agility(robot, maestro=maestro, usc=Dummy())
+
+# Gait.
+dynamic = Dynamic(robot)
+gait = dynamic.generate(8, 0)
+frames, dt = agility.prepare_smoothly(gait)
+compiled = agility.compile(frames, dt)
+agility.ready(dynamic.ground)
+
+
+def measure(name, function, cycles=5):
+    emulator.reset_stats()
+    maestro.tick_bytes.clear()
+    start = time.monotonic()
+
+    for i in range(cycles):
+        function()
+
+    elapsed = time.monotonic() - start
+    stats = emulator.stats()
+    ticks = maestro.get_tick_stats()
+    count = cycles * len(frames)
+
+    print('{:<20} | {:6.1f} frames/s | {:6.2f} ms/frame (dt {:.1f} ms) | {:6d} B in | {:6d} B out | {:5.1f}% bus | '
+          '{:5.1f} B/write'.format(name, count / elapsed, elapsed / count * 1000, dt, stats['bytes_in'],
+                                   stats['bytes_out'], emulator.utilization() * 100, ticks['mean']))
+
+
+measure('execute_frames', lambda: agility.execute_frames(frames, dt))
+measure('execute_compiled', lambda: agility.execute_compiled(compiled))
+measure('execute_scheduled', lambda: agility.execute_scheduled(compiled))
+measure('execute_gait', lambda: agility.execute_gait(gait))
+
+# Latency of a single wait() on servos already at their targets.
+servos = robot.leg_servos
+start = time.monotonic()
+
+for i in range(100):
+    agility.wait(servos)
+
+print('wait() latency at target: {:.2f} ms'.format((time.monotonic() - start) / 100 * 1000))
+
+maestro.close()
+emulator.close()
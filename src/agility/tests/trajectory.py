@@ -0,0 +1,67 @@
+from agility.emulator import Emulator
+from agility.maestro import Maestro
+from agility.trajectory import Trajectory
+from agility.gait import Dynamic
+from agility.main import Agility
+from cerebral.pack1.hippocampus import Android
+from shared.debug import Dummy
+from threading import Timer
+import numpy as np
+import time
+
+
+# A move in no time has one segment at unlimited speed.
+trajectory = Trajectory([6000, 6000], [[7000, 5000]], [0])
+assert len(trajectory) == 1
+assert trajectory.segments[0][1].tolist() == [0, 0]
+
+# With max_vel, it is timed like end_together(servos, 0).
+trajectory = Trajectory([6000, 6000], [[7000, 5000]], [0], max_vel=np.array([200, 200]))
+assert len(trajectory) == 1 and trajectory.get_duration() > 0
+
+# Emulated Maestro with 1 ms USB latency.
+emulator = Emulator(latency=0.001)
+maestro = Maestro(port=emulator.port)
+
+# Robot by reference.
+robot = Android.robot
+servos = robot.leg_servos
+agility = Agility(robot, maestro=maestro, usc=Dummy())
+dynamic = Dynamic(robot)
+
+# Servos that never reach their targets would block forever.
+watchdog = Timer(30, agility.stop)
+watchdog.start()
+
+
+def check(name, task):
+    start = time.monotonic()
+    task()
+    elapsed = time.monotonic() - start
+
+    maestro.get_multiple_positions(servos)
+    pwm = np.array([servo.pwm for servo in servos])
+    target = np.array([servo.target for servo in servos])
+    moved = emulator.stats()['commands']
+
+    print('{:<24} {:.2f} s | |pwm - target| {}'.format(name, elapsed, np.abs(pwm - target).max()))
+    assert not agility.emergency.is_set(), name
+    assert np.array_equal(pwm, target), name
+
+    return moved
+
+
+# Max speed moves must still reach their targets.
+before = emulator.stats()['commands']
+check('ready(ground, 0)', lambda: agility.ready(dynamic.ground, 0))
+assert emulator.stats()['commands'] > before
+
+check('ready(ground - 1, 0)', lambda: agility.ready(dynamic.ground - 1, 0))
+check('lift_leg(1, 3, 0)', lambda: agility.lift_leg(1, 3, 0))
+check('ready(ground, 1000)', lambda: agility.ready(dynamic.ground, 1000))
+
+watchdog.cancel()
+maestro.close()
+emulator.close()
+
+print('Moves with no time reached their targets.')
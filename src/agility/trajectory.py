@@ -0,0 +1,171 @@
+import numpy as np
+
+
+# Largest acceleration the Maestro accepts.
+MAX_ACCEL = 255
+
+
+def trapezoid(distance, t, ramp=0.25):
+    """
+    Compute the Maestro speed and acceleration of a trapezoidal move. The controller ramps up for ramp * t, cruises
+    and ramps down for ramp * t, so the move is a single command per servo.
+    :param distance: Distances in 0.25 us.
+    :param t: The time of the move in ms.
+    :param ramp: The fraction of t spent on each ramp, in (0, 0.5].
+    :return: (speed, accel) where speed is in 0.25 us / 10 ms and accel is in 0.25 us / 10 ms / 80 ms.
+    """
+
+    assert 0 < ramp <= 0.5
+
+    distance = np.abs(np.asarray(distance, dtype=float))
+    ta = ramp * t
+
+    # The area under the velocity profile is the distance.
+    v = distance / (t - ta) * 10
+    speed = np.where(distance > 0, np.maximum(np.rint(v), 1), 0).astype(int)
+
+    # The velocity gain per 80 ms that reaches speed in ta. Ramps too short for the Maestro are dropped, so those
+    # servos move at a constant speed like end_together().
+    accel = np.rint(speed * 80 / ta)
+    accel = np.where((distance > 0) & (accel <= MAX_ACCEL), np.maximum(accel, 1), 0).astype(int)
+
+    # Rounding and limits change the ramps. Solve for the speed that still takes t with the acceleration sent,
+    # from distance = v * (t - v / a). Moves that cannot finish in time become triangles.
+    a = accel / 800
+    root = np.sqrt(np.maximum((a * t) ** 2 - 4 * a * distance, 0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.where(accel > 0, (a * t - root) / 2, distance / t) * 10
+
+    # Speeds are whole units, so round to whichever arrives closer to t.
+    low = np.maximum(np.floor(v), 1)
+    high = np.maximum(np.ceil(v), 1)
+    closer = np.abs(durations(distance, low, accel) - t) <= np.abs(durations(distance, high, accel) - t)
+    speed = np.where(distance > 0, np.where(closer, low, high), 0).astype(int)
+
+    return speed, accel
+
+
+def durations(distance, speed, accel):
+    """
+    Estimate how long the Maestro takes to move each servo some distance with the given limits.
+    :param distance: Distances in 0.25 us.
+    :param speed: Speeds in 0.25 us / 10 ms. 0 is unlimited.
+    :param accel: Accelerations in 0.25 us / 10 ms / 80 ms. 0 is unlimited.
+    :return: An array of times in ms. Servos that do not move or move without limits take 0.
+    """
+
+    distance = np.abs(np.asarray(distance, dtype=float))
+    speed = np.asarray(speed, dtype=float)
+    accel = np.asarray(accel, dtype=float)
+
+    v, a = speed / 10, accel / 800
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Time on one ramp and the distance it covers.
+        ta = np.where(a > 0, v / a, 0)
+        da = 0.5 * v * ta
+
+        # Trapezoid if both ramps fit, else a triangle that never reaches speed.
+        t = np.where(distance >= 2 * da, distance / v + ta, 2 * np.sqrt(distance / a))
+
+    return np.where((distance > 0) & (speed > 0), t, 0)
+
+
+def arrival(distance, speed, accel):
+    """
+    Estimate how long the Maestro takes to move some servos with the given limits.
+    :param distance: Distances in 0.25 us.
+    :param speed: Speeds in 0.25 us / 10 ms. 0 is unlimited.
+    :param accel: Accelerations in 0.25 us / 10 ms / 80 ms. 0 is unlimited.
+    :return: The time in ms of the slowest servo.
+    """
+
+    t = durations(distance, speed, accel)
+
+    return float(np.max(t)) if np.size(t) > 0 else 0.0
+
+
+def minimum_jerk(u):
+    """
+    The position of a minimum jerk (S-curve) move.
+    :param u: Normalized time in [0, 1].
+    :return: Normalized position in [0, 1].
+    """
+
+    u = np.asarray(u, dtype=float)
+    return u ** 3 * (10 - 15 * u + 6 * u ** 2)
+
+
+class Trajectory:
+    def __init__(self, start, waypoints, durations, profile='trapezoid', ramp=0.25, segments=5, max_vel=None):
+        """
+        A time parameterized move of some servos through waypoints, expressed as Maestro commands.
+        A trapezoid uses the Maestro's own acceleration limit, so each waypoint is one command per servo and servos
+        stop at every waypoint. The Maestro has no jerk limit, so an S-curve is approximated by a few constant speed
+        segments along a minimum jerk profile that flow into each other.
+        :param start: The current targets in 0.25 us (servos).
+        :param waypoints: The targets to pass through in 0.25 us (n x servos).
+        :param durations: The time in ms to reach each waypoint (n). 0 for max speed.
+        :param profile: 'trapezoid' or 's-curve'.
+        :param ramp: The fraction of each move spent on each ramp of a trapezoid.
+        :param segments: The number of segments of each S-curve move.
+        :param max_vel: The max_vel of every servo, used to time moves at max speed like end_together(). If None,
+                        moves at max speed have no speed limit.
+        """
+
+        assert profile in ('trapezoid', 's-curve')
+
+        start = np.asarray(start, dtype=int)
+        waypoints = np.asarray(waypoints, dtype=int).reshape(-1, len(start))
+        durations = np.broadcast_to(np.asarray(durations, dtype=float), (len(waypoints),))
+
+        self.profile = profile
+
+        # Segments of (targets, speeds, accels, duration) and the waypoint each one ends at or heads to.
+        self.segments = []
+        self.waypoints = []
+
+        previous = start
+
+        for j, (target, t) in enumerate(zip(waypoints, durations)):
+            # Max speed. The peak speed of a trapezoid is 1 / (1 - ramp) times its average.
+            if t <= 0 and max_vel is not None:
+                t = np.max(np.abs(target - previous) / max_vel * 10)
+
+                if profile == 'trapezoid':
+                    t /= 1 - ramp
+
+            if t <= 0:
+                # Unlimited speed and acceleration.
+                zeros = np.zeros(len(start), dtype=int)
+                self.segments.append((target, zeros, zeros, 0))
+                self.waypoints.append(j)
+            elif profile == 'trapezoid':
+                speed, accel = trapezoid(target - previous, t, ramp)
+                self.segments.append((target, speed, accel, t))
+                self.waypoints.append(j)
+            else:
+                u = np.linspace(0, 1, segments + 1)
+                s = minimum_jerk(u)
+                points = np.rint(previous + np.outer(s, target - previous)).astype(int)
+                dt = t / segments
+
+                for i in range(1, segments + 1):
+                    delta = np.abs(points[i] - points[i - 1])
+                    speed = np.where(delta > 0, np.maximum(np.rint(delta / dt * 10), 1), 0).astype(int)
+                    self.segments.append((points[i], speed, np.zeros(len(start), dtype=int), dt))
+                    self.waypoints.append(j)
+
+            previous = target
+
+    def get_duration(self):
+        """
+        Get the planned time of the whole trajectory.
+        :return: The time in ms.
+        """
+
+        return sum(segment[3] for segment in self.segments)
+
+    def __len__(self):
+        return len(self.segments)
@@ -14,25 +14,29 @@ class Android:
     servo1 = Servo(0, -180, 90, 500, 2500, 150, bias=-10, direction=1)
     servo2 = Servo(1, -45, 225, 500, 2500, 150, bias=2, direction=1)
     servo3 = Servo(2, -135, 135, 500, 2500, 150, bias=5, direction=-1)
-    leg1 = Leg(servo1, servo2, servo3, (6.3, 7.13), 0, Finesse.inverse_pack, Finesse.forward_pack)
+    leg1 = Leg(servo1, servo2, servo3, (6.3, 7.13), 0, Finesse.inverse_pack, Finesse.forward_pack,
+               Finesse.inverse_pack_batch)
 
     # Leg 2.
     servo4 = Servo(3, -90, 180, 500, 2500, 150, bias=5, direction=-1)
     servo5 = Servo(4, -225, 45, 500, 2500, 150, bias=-5, direction=1)
     servo6 = Servo(5, -135, 135, 500, 2500, 150, bias=5, direction=1)
-    leg2 = Leg(servo4, servo5, servo6, (6.3, 7.13), 1, Finesse.inverse_pack, Finesse.forward_pack)
+    leg2 = Leg(servo4, servo5, servo6, (6.3, 7.13), 1, Finesse.inverse_pack, Finesse.forward_pack,
+               Finesse.inverse_pack_batch)
 
     # Leg 3.
     servo7 = Servo(6, -90, 180, 500, 2500, 150, bias=-5, direction=1)
     servo8 = Servo(7, -45, 225, 500, 2500, 150, bias=-2.5, direction=1)
     servo9 = Servo(8, -135, 135, 500, 2500, 150, bias=5, direction=-1)
-    leg3 = Leg(servo7, servo8, servo9, (6.3, 7.13), 2, Finesse.inverse_pack, Finesse.forward_pack)
+    leg3 = Leg(servo7, servo8, servo9, (6.3, 7.13), 2, Finesse.inverse_pack, Finesse.forward_pack,
+               Finesse.inverse_pack_batch)
 
     # Leg 4 .
     servo10 = Servo(9, -180, 90, 500, 2500, 150, bias=-8, direction=-1)
     servo11 = Servo(10, -225, 45, 500, 2500, 150, bias=5, direction=1)
     servo12 = Servo(11, -135, 135, 500, 2500, 150, bias=0, direction=1)
-    leg4 = Leg(servo10, servo11, servo12, (6.3, 7.13), 3, Finesse.inverse_pack, Finesse.forward_pack)
+    leg4 = Leg(servo10, servo11, servo12, (6.3, 7.13), 3, Finesse.inverse_pack, Finesse.forward_pack,
+               Finesse.inverse_pack_batch)
 
     # Head (emulated)
     servo16 = Servo(16, -90, 90, 400, 2400, 100, bias=0, direction=1, left_bound=-45, right_bound=45)
@@ -3,12 +3,16 @@ from cerebral import logger as l
 import Pyro4
 from cerebral.nameserver import ports
 from agility.gait import Dynamic
+from agility.cache import GaitCache
+from agility.atlas import GaitAtlas
+from agility.engine import GaitEngine
+from agility.asyncmaestro import AsyncMaestro
 from cerebral.pack2.hippocampus import Android
 from agility.main import Agility, ServoError
 from threading import Thread, Lock, Event
-from functools import lru_cache
 import time
 import logging
+import os
 
 
 # Configure pyro.
@@ -22,9 +26,40 @@ logger = logging.getLogger('universe')
 class SuperAgility:
     def __init__(self):
         self.robot = Android.robot
-        self.agility = Agility(self.robot)
+
+        # The head and leg threads share the port. Let their reads overlap.
+        try:
+            maestro = AsyncMaestro()
+        except ConnectionError:
+            maestro = None
+
+        self.agility = Agility(self.robot, maestro=maestro)
+
+        # Share one stream of servo positions between the head and leg threads.
+        if maestro is not None:
+            self.agility.start_poller()
         self.gait = Dynamic(self.robot)
 
+        # Prepared gait cache.
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gaits')
+
+        # Use tuned gait constants if a search has been run. See agility.search.
+        try:
+            self.gait.load(os.path.join(path, 'parameters.json'))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error('Not using tuned gait constants: {}'.format(e))
+        self.cache = GaitCache(self.agility, self.gait, path)
+        self.cache.warm()
+
+        # Blend gaits from a prebuilt atlas if there is one.
+        try:
+            self.atlas = GaitAtlas.load(self.agility, self.gait, os.path.join(path, 'atlas.npz'))
+        except (OSError, ValueError) as e:
+            logger.info('Not using a gait atlas: {}'.format(e))
+            self.atlas = None
+
         # Walking stuff.
         self.leg_stop = Event()
         self.new_vector = Event()
@@ -200,21 +235,23 @@ class SuperAgility:
 
     def _watch(self):
         self.agility.ready(self.gait.ground)
+        engine = GaitEngine(self.agility)
 
         while not self.leg_stop.is_set():
+            self.new_vector.clear()
             vector = self.vector
 
+            # Vectors that are too small to walk give None.
             if vector == (0, 0):
+                compiled = None
+            elif self.atlas is not None:
+                compiled = self.atlas.get(vector)
+            else:
+                compiled = self.cache.get(vector)
+
+            # Check the vector again after every frame.
+            if not engine.step(compiled):
                 self.new_vector.wait()
-                continue
-
-            frames, dt = self._generate(vector)
-            self.agility.execute_frames(frames, dt)
-
-    @lru_cache()
-    def _generate(self, vector):
-        g = self.gait.generate(*vector)
-        return self.agility.prepare_smoothly(g)
 
     def _head(self):
         while True:
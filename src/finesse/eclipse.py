@@ -1,4 +1,5 @@
 from numpy.linalg import norm
+import numpy as np
 from math import sin, cos, asin, acos, atan2, pi, degrees
 
 
@@ -75,3 +76,46 @@ class Finesse:
         else:
             return theta1, theta2, theta3
 
+    @staticmethod
+    def inverse_pack_batch(lengths, points, a2=False, a3=False, deg=True):
+        """
+        Vectorized version of inverse_pack over many targets.
+        Unreachable targets are flagged in a mask instead of raising ValueError.
+        :param lengths: An array of lengths (l1, l2).
+        :param points: An array of targets (N x 3).
+        :param a2: Returns an alternate solution for theta2.
+        :param a3: Returns an alternate solution for theta3.
+        :param deg: Return the result in degrees if True and radians otherwise.
+        :return: (angles, valid) where angles is (N x 3) and valid is a boolean mask of length N.
+        """
+
+        l1, l2 = lengths
+        points = np.asarray(points, dtype=float)
+        x, y, z = points[..., 0], points[..., 1], points[..., 2]
+        dist = norm(points, axis=-1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Same as inverse_pack. Domain errors become False in the mask.
+            theta3 = (l1 ** 2 + l2 ** 2 - dist ** 2) / (2 * l1 * l2)
+            theta3 = np.round(theta3, 13)
+            valid = (dist <= l1 + l2) & (np.abs(theta3) <= 1)
+            theta3 = np.arccos(np.clip(theta3, -1, 1)) - pi
+            if a3:
+                theta3 *= -1
+
+            k = l1 + l2 * np.cos(theta3)
+            theta2 = np.round(y / k, 13)
+            valid &= (k != 0) & (np.abs(theta2) <= 1)
+            theta2 = np.arcsin(np.clip(theta2, -1, 1))
+            if a2:
+                theta2 = pi - theta2
+
+            theta1 = np.arctan2(z, -x) + np.arctan2(k * np.cos(theta2), l2 * np.sin(theta3))
+
+        angles = np.stack((theta1, theta2, theta3), axis=-1)
+        angles[~valid] = np.nan
+
+        if deg:
+            angles = np.degrees(angles)
+
+        return angles, valid